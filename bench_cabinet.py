@@ -0,0 +1,347 @@
+# bench_cabinet.py
+#   Benchmark suite for cabinet.py.  Generates deterministic synthetic
+#   cabinets and times the public operations on each of them.
+#
+#   The cabinets are many tiny members, a few huge members, and members
+#   spread over many folders, each both stored and MSZIP compressed.  For each
+#   operation the best time of a few runs is reported, as throughput in MB/s
+#   where it processes member data, and as the latency per call where it is
+#   called many times.  The peak memory is measured in a separate run under
+#   tracemalloc.  "read last" reads only the last member, starting from the
+#   nearest decoder checkpoint.  "checksums" is testcabinet() verifying only
+#   the structure and the CFDATA checksums.  "manifest" hashes every member
+#   with SHA-256 as it is decoded.  "read cached" repeats read() with
+#   the decompressed blocks in a BlockCache.
+#
+#   The memory benchmark measures the directory of a cabinet with 65535
+#   members: the member table alone, with the name index used by getinfo(),
+#   with every CabinetInfo created, and as the plain objects with a __dict__
+#   used before the member table.
+#
+#   Results can be written as JSON with --json, and compared with an earlier
+#   JSON file with --compare, to track performance between releases.
+#
+#   Usage: python bench_cabinet.py [-m megabytes] [-r repeat] [--case name]
+#                                  [--json file] [--compare file] [--label name]
+
+from __future__ import print_function
+import os
+import io
+import gc
+import json
+import platform
+import random
+import shutil
+import tempfile
+import time
+import argparse
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None #python 2, no memory measurements
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.clock if os.name == "nt" else time.time #python 2
+
+import cabinet
+
+
+def synthetic_data(size, rnd, words):
+    """Deterministic, moderately compressible data"""
+    text = b" ".join(rnd.choice(words) for j in range(size // 5 + 1))
+    return text[:size]
+
+
+def synthetic_members(megabytes, nfiles=16, seed=0):
+    """A list of nfiles (name, data) tuples with megabytes of data in total"""
+    rnd = random.Random(seed)
+    words = [bytes(bytearray(rnd.randrange(97, 123) for j in range(rnd.randrange(2, 10))))
+             for i in range(2000)]
+    size = int(megabytes * 1024 * 1024) // nfiles
+    return [("dir%02d\\file%05d.txt" % (i % 50, i), synthetic_data(size, rnd, words))
+            for i in range(nfiles)]
+
+
+#the shapes of the generated cabinets: the number of members, the share of
+#the data size given on the command line, and the number of folders
+SHAPES = {
+    "tiny":    (20000, 0.125, 1),
+    "huge":    (2, 1.0, 1),
+    "folders": (64, 1.0, 16),
+}
+
+COMPRESSIONS = {
+    "stored": cabinet.tcompTYPE_NONE,
+    "mszip":  cabinet.tcompTYPE_MSZIP,
+}
+
+
+def make_cabinet(path, members, compression=cabinet.tcompTYPE_MSZIP, folders=1):
+    """Write the (name, data) members to a cabinet at path, in about the
+    given number of folders.
+    """
+    total = sum(len(data) for name, data in members)
+    folder_size = -(-total // folders) if folders > 1 else None
+    with cabinet.CabinetFile(path, "w", compression=compression, folder_size=folder_size,
+                             workers=None) as cf:
+        for name, data in members:
+            cf.writestr(name, data)
+
+
+class Case(object):
+    """A generated cabinet to run the operations on"""
+    def __init__(self, shape, compression, megabytes, tmp):
+        self.name = "%s-%s" % (shape, compression)
+        nfiles, share, folders = SHAPES[shape]
+        members = synthetic_members(megabytes * share, nfiles)
+        self.path = os.path.join(tmp, self.name + ".cab")
+        make_cabinet(self.path, members, COMPRESSIONS[compression], folders)
+        self.names = [name for name, data in members]
+        self.total = sum(len(data) for name, data in members)
+        self.last = len(members[-1][1])
+        self.tmp = tmp
+
+    def open(self, **options):
+        return cabinet.CabinetFile(self.path, block_cache=False, **options)
+
+
+#the operations.  Each returns the function to time, the number of bytes of
+#member data it processes, and the number of calls it makes.
+
+def on_cabinet(case, method, *args, **kwargs):
+    """A function opening the cabinet of case, calling a method on it and
+    closing it
+    """
+    def run():
+        with case.open() as cf:
+            getattr(cf, method)(*args, **kwargs)
+    return run
+
+def op_is_cabinetfile(case):
+    def run():
+        for i in range(100):
+            cabinet.is_cabinetfile(case.path)
+    return run, 0, 100
+
+def op_namelist(case):
+    return on_cabinet(case, "namelist"), 0, 1
+
+def op_infolist(case):
+    return on_cabinet(case, "infolist"), 0, 1
+
+def op_getinfo(case):
+    cf = case.open()
+    cf.namelist()
+    def run():
+        for name in case.names:
+            cf.getinfo(name)
+    return run, 0, len(case.names)
+
+def op_read(case):
+    return on_cabinet(case, "read", case.names), case.total, 1
+
+def op_read_last(case):
+    return on_cabinet(case, "read", case.names[-1]), case.last, 1
+
+def op_extract(case):
+    target = os.path.join(case.tmp, "out")
+    def run():
+        shutil.rmtree(target, True)
+        with case.open() as cf:
+            cf.extract(target)
+    return run, case.total, 1
+
+def op_testcabinet(case):
+    return on_cabinet(case, "testcabinet"), case.total, 1
+
+def op_checksums(case):
+    return on_cabinet(case, "testcabinet", decompress=False), case.total, 1
+
+def op_manifest(case):
+    return on_cabinet(case, "manifest"), case.total, 1
+
+def op_read_cached(case):
+    cf = cabinet.CabinetFile(case.path, block_cache=cabinet.BlockCache(2 * case.total))
+    cf.read(case.names)
+    return lambda: cf.read(case.names), case.total, 1
+
+OPERATIONS = [
+    ("is_cabinetfile", op_is_cabinetfile),
+    ("namelist", op_namelist),
+    ("infolist", op_infolist),
+    ("getinfo", op_getinfo),
+    ("read", op_read),
+    ("read last", op_read_last),
+    ("extract", op_extract),
+    ("testcabinet", op_testcabinet),
+    ("checksums", op_checksums),
+    ("manifest", op_manifest),
+    ("read cached", op_read_cached),
+]
+
+
+def peak_memory(func):
+    """The peak memory allocated while running func, or None"""
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(case, label, op, repeat=3, memory=True):
+    """Run an operation on a case, returning a dict of the results"""
+    func, nbytes, calls = op(case)
+    best = None
+    for i in range(repeat):
+        t0 = clock()
+        func()
+        t = clock() - t0
+        best = t if best is None else min(best, t)
+    result = {"case": case.name, "op": label, "seconds": best,
+              "latency_us": best / calls * 1e6, "calls": calls, "bytes": nbytes}
+    if nbytes:
+        result["mb_per_s"] = nbytes / max(best, 1e-9) / 1e6
+    if memory:
+        result["peak_bytes"] = peak_memory(op(case)[0])
+    return result
+
+
+def show(result):
+    rate = "%8.1f MB/s" % result["mb_per_s"] if "mb_per_s" in result else \
+           "%8.1f us/call" % result["latency_us"]
+    peak = result.get("peak_bytes")
+    peak = "%8.1f MB peak" % (peak / 1e6) if peak is not None else ""
+    print("%-16s %-15s %8.3f s %s %s" % (result["case"], result["op"], result["seconds"],
+                                         rate, peak))
+
+
+class DictInfo(object):
+    """A member as it was stored before the member table, for comparison"""
+    def __init__(self, name, size, offset, folder, date, time, attribs):
+        self.filename, self.date_time = name, cabinet.DecodeFATTime(date, time)
+        self.file_size = size
+        self.external_attr = attribs
+        self.folder_index = folder
+        self.folder_offset = offset
+        self.fat_date, self.fat_time = date, time
+
+
+def bench_memory(nfiles=65535):
+    """Measure the memory held by the directory of a cabinet with nfiles
+    members.  Returns a list of result dicts.
+    """
+    if tracemalloc is None:
+        return []
+    data = io.BytesIO()
+    with cabinet.CabinetFile(data, "w", compression=cabinet.tcompTYPE_NONE) as cf:
+        for i in range(nfiles):
+            cf.writestr("dir%03d\\file%05d.txt" % (i % 100, i), b"x")
+    data = data.getvalue()
+    results = []
+
+    def measure(label, func):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            keep = func()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        results.append({"case": "directory", "op": label, "bytes": size,
+                        "bytes_per_member": size // nfiles})
+        print("%-16s %-15s %8.1f MB %8d bytes/member" % ("directory", label, size / 1e6,
+                                                         size // nfiles))
+        return keep
+
+    cf = cabinet.CabinetFile(data, block_cache=False)
+    measure("table", cf._getdirectory)
+    measure("getinfo", lambda: cf.getinfo("dir000\\file00000.txt"))
+    measure("infolist", cf.infolist)
+    table = cabinet.CabinetFile(data)._getdirectory().infos
+
+    def dict_infos():
+        old = [DictInfo(*row) for row in table.rows()]
+        return old, dict((info.filename, info) for info in old)
+    measure("dict infos", dict_infos)
+    return results
+
+
+def compare(results, filename, megabytes):
+    """Print the change of each result from those in an earlier JSON file"""
+    with open(filename) as f:
+        old = json.load(f)
+    before = dict(((r["case"], r["op"]), r) for r in old["results"])
+    print("\nCompared with %s (%s):" % (filename, old.get("label") or "unlabeled"))
+    if old.get("megabytes") != megabytes:
+        print("warning: that run used %s megabytes, not %s" % (old.get("megabytes"), megabytes))
+    for r in results:
+        o = before.get((r["case"], r["op"]))
+        if o is None:
+            continue
+        if "seconds" in r and o.get("seconds"):
+            change = (r["seconds"] / o["seconds"] - 1) * 100
+            print("%-16s %-15s %+7.1f%% time" % (r["case"], r["op"], change))
+        elif o.get("bytes"):
+            change = (r["bytes"] / float(o["bytes"]) - 1) * 100
+            print("%-16s %-15s %+7.1f%% memory" % (r["case"], r["op"], change))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark cabinet.py")
+    parser.add_argument("-m", "--megabytes", type=float, default=16,
+                        help="member data in the larger cabinets")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--case", action="append",
+                        help="run only these cases, such as tiny-mszip")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the peak memory measurements")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with the results in this file")
+    parser.add_argument("--label", help="a name for this run, such as a release")
+    options = parser.parse_args(args)
+
+    results = []
+    tmp = tempfile.mkdtemp()
+    try:
+        for shape in sorted(SHAPES):
+            for compression in sorted(COMPRESSIONS):
+                name = "%s-%s" % (shape, compression)
+                if options.case and name not in options.case:
+                    continue
+                case = Case(shape, compression, options.megabytes, tmp)
+                print("%s: %d members, %d bytes, %d bytes in the cabinet" % (
+                    name, len(case.names), case.total, os.path.getsize(case.path)))
+                for label, op in OPERATIONS:
+                    result = bench(case, label, op, options.repeat, not options.no_memory)
+                    show(result)
+                    results.append(result)
+    finally:
+        shutil.rmtree(tmp)
+    if not options.case and not options.no_memory:
+        results.extend(bench_memory())
+
+    if options.compare:
+        compare(results, options.compare, options.megabytes)
+    if options.json:
+        report = {"label": options.label,
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "python": platform.python_version(),
+                  "implementation": platform.python_implementation(),
+                  "platform": platform.platform(),
+                  "cpus": cabinet._cpu_count(),
+                  "numpy": cabinet.numpy is not None,
+                  "megabytes": options.megabytes,
+                  "repeat": options.repeat,
+                  "results": results}
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -37,16 +37,52 @@ Utility module to read windows cabinet files.
 from __future__ import print_function
 import sys
 import os.path
+import ntpath
+import stat
+import re
+import fnmatch
+import zipfile
+import tarfile
+import json
+import struct
+import zlib
+import hashlib
+import bisect
+import io
+import threading
+import mmap
+import time
+from array import array
+from io import BytesIO
 try:
-    from cStringIO import StringIO
+    from concurrent import futures
 except ImportError:
-    from io import StringIO
+    futures = None #python 2 without the futures backport
+try:
+    import numpy
+except ImportError:
+    numpy = None #checksums are computed in pure python
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None #no DirectoryCache
+try:
+    import asyncio
+except ImportError:
+    asyncio = None #python 2, no AsyncCabinetFile
 from ctypes import *
 from ctypes.wintypes import BOOL
 from functools import wraps
+from collections import OrderedDict
+from itertools import count
 
 import sys
 PY2 = sys.version_info[0] == 2
+_clock = getattr(time, "perf_counter", time.time)
+if PY2:
+    string_types = basestring
+else:
+    string_types = str
 
 
 ##################################
@@ -153,8 +189,12 @@ FDIERROR = _enum(["FDIERROR_NONE", "FDIERROR_CABINET_NOT_FOUND", "FDIERROR_NOT_A
                    "FDIERROR_TARGET_FILE", "FDIERROR_RESERVE_MISMATCH", "FDIERROR_WRONG_CABINET",
                    "FDIERROR_USER_ABORT"])
 
-_A_NAME_IS_UTF  =0x80
+_A_RDONLY       =0x01
+_A_HIDDEN       =0x02
+_A_SYSTEM       =0x04
+_A_ARCH         =0x20
 _A_EXEC         =0x40
+_A_NAME_IS_UTF  =0x80
 
 #then FDI context handle
 HFDI = c_void_p
@@ -249,34 +289,40 @@ PFNFDINOTIFY = CFUNCTYPE(c_int, FDINOTIFICATIONTYPE, POINTER(FDINOTIFICATION))
 
 
 
-#finally, the FDI api functions, from the CABINET.DLL file:
-
-#FDICreate
+#finally, the FDI api functions, from the CABINET.DLL file.
+#The dll is only present on windows.  Elsewhere, these are left as None and
+#only the pure python parts of this module are available.
 try:
-    FDICreate = cdll.cabinet.FDICreate
+    _cabinet = cdll.cabinet
 except Exception:
-    raise ImportError("cabinet only works on windows")
-FDICreate.restype = HFDI
-FDICreate.argtypes = [PFNALLOC, PFNFREE, PFNOPEN, PFNREAD, PFNWRITE, PFNCLOSE, PFNSEEK,
-                      c_int, POINTER(ERF)]
+    _cabinet = None
+
+if _cabinet is not None:
+    #FDICreate
+    FDICreate = _cabinet.FDICreate
+    FDICreate.restype = HFDI
+    FDICreate.argtypes = [PFNALLOC, PFNFREE, PFNOPEN, PFNREAD, PFNWRITE, PFNCLOSE, PFNSEEK,
+                          c_int, POINTER(ERF)]
 
-#FDIIsCabinet
-FDIIsCabinet = cdll.cabinet.FDIIsCabinet
-FDIIsCabinet.argtypes = [HFDI, c_int, POINTER(FDICABINETINFO)]
-FDIIsCabinet.restype = BOOL
+    #FDIIsCabinet
+    FDIIsCabinet = _cabinet.FDIIsCabinet
+    FDIIsCabinet.argtypes = [HFDI, c_int, POINTER(FDICABINETINFO)]
+    FDIIsCabinet.restype = BOOL
 
-#FDICopy
-#the decyrpt function isn't supported, so we just declare a void pointer which
-#we must call with a null.
-FDICopy = cdll.cabinet.FDICopy
-#FDICopy.argtypes = [HFDI, c_char_p, c_char_p, c_int, PFNFDINOTIFY, PFNFDIDECRYPT, py_object]
-FDICopy.argtypes = [HFDI, c_char_p, c_char_p, c_int, PFNFDINOTIFY, c_void_p, py_object]
-FDICopy.restype = BOOL
+    #FDICopy
+    #the decyrpt function isn't supported, so we just declare a void pointer which
+    #we must call with a null.
+    FDICopy = _cabinet.FDICopy
+    #FDICopy.argtypes = [HFDI, c_char_p, c_char_p, c_int, PFNFDINOTIFY, PFNFDIDECRYPT, py_object]
+    FDICopy.argtypes = [HFDI, c_char_p, c_char_p, c_int, PFNFDINOTIFY, c_void_p, py_object]
+    FDICopy.restype = BOOL
 
-#FDIDestropy
-FDIDestroy = cdll.cabinet.FDIDestroy
-FDIDestroy.argtypes = [HFDI]
-FDIDestroy.restype = BOOL
+    #FDIDestropy
+    FDIDestroy = _cabinet.FDIDestroy
+    FDIDestroy.argtypes = [HFDI]
+    FDIDestroy.restype = BOOL
+else:
+    FDICreate = FDIIsCabinet = FDICopy = FDIDestroy = None
 
 
 
@@ -330,6 +376,8 @@ class FDIFileManager(object):
         if excinfo is None:
             excinfo = []
         self._excinfo = excinfo
+        self._lock = threading.Lock()
+        self.stats = None #a CabinetStats, if the cabinet has one
         self.fileno = 100
         self.open =  PFNOPEN(self.pyopen)
         self.read =  PFNREAD(self.pyread)
@@ -344,9 +392,10 @@ class FDIFileManager(object):
             raise tmp[1]
 
     def map(self, f):
-        fd = self.fileno
-        self.fileno+=1
-        self.filemap[fd] = f
+        with self._lock:
+            fd = self.fileno
+            self.fileno+=1
+            self.filemap[fd] = f
         return fd
 
     def unmap(self, fd):
@@ -366,55 +415,77 @@ class FDIFileManager(object):
 
     @FileErrwrap
     def pyread(self, fd, buffer, count):
-        data = self.filemap[fd].read(count)
-        l = len(data)
-        memmove(buffer, data, l)
+        f = self.filemap[fd]
+        t = _clock()
+        if hasattr(f, "readinto") and not PY2:
+            #read directly into the C buffer
+            l = f.readinto(memoryview((c_ubyte * count).from_address(buffer)).cast("B"))
+        else:
+            data = f.read(count)
+            l = len(data)
+            memmove(buffer, data, l)
+        if self.stats is not None:
+            self.stats.record("io_read", l, _clock() - t)
         return l
 
     @FileErrwrap
     def pywrite(self, fd, buffer, count):
+        t = _clock()
         tmp = string_at(buffer, count)
         self.filemap[fd].write(tmp)
+        if self.stats is not None:
+            self.stats.record("io_write", count, _clock() - t)
         return count
 
     @FileErrwrap
     def pylseek(self, fd, offset, origin):
+        if self.stats is not None:
+            self.stats.record("io_seek")
         self.filemap[fd].seek(offset, origin)
         return self.filemap[fd].tell()
 
 class FileProxy(object):
-    """A class that allows proxying of a file, thereby supporting many filepointers"""
-    def __init__(self, f):
-        self.f = f
+    """A file-like view of a cabinet source with its own position, thereby
+    supporting many filepointers
+    """
+    def __init__(self, source):
+        self.source = source
         self.fp = 0
         
     def close(self):
-        if self.f:
-            self.f = None
+        self.source = None
             
+    def readinto(self, b):
+        data = self.source.read_at(self.fp, len(b))
+        l = len(data)
+        b[:l] = data
+        self.fp += l
+        return l
+
     def read(self, size=None):
-        self.f.seek(self.fp)
-        if size is not None:
-            r = self.f.read(size)
-        else:
-            r = self.f.read()
-        self.fp = self.fp + len(r)
+        if size is None or size < 0:
+            size = max(self.source.size() - self.fp, 0)
+        r = bytes(self.source.read_at(self.fp, size))
+        self.fp += len(r)
         return r
         
     def seek(self, offset, whence=0):
-        self.f.seek(offset, whence)
-        self.fp = self.f.tell()
+        if whence == 1:
+            offset += self.fp
+        elif whence == 2:
+            offset += self.source.size()
+        self.fp = offset
         
     def tell(self):
         return self.fp
         
 
 class FDIObjectFileManager(FDIFileManager):
-    """a subclass which enables us to use a file object as a source"""
+    """a subclass which enables us to use a cabinet source as a file"""
     fname = "_file_"
-    def setfile(self, f):
-        """set the buffer associated with this object and return its name"""
-        self.file = f
+    def setfile(self, source):
+        """set the source associated with this object and return its name"""
+        self.file = source
         return self.fname
     
     #open creates a file object out of a stored string
@@ -426,295 +497,3817 @@ class FDIObjectFileManager(FDIFileManager):
         
 def FileManager(fn):
     """Create a suitable file manager object to deal with the argument
-    be it a filename, or a file like object"""
-    if hasattr(fn, "read"):
-        #oh, the filename really is a file object
-        result = FDIObjectFileManager()
-        fn = result.setfile(fn)
-    else:
-        result = FDIFileManager()
+    be it a filename, a file like object or a buffer"""
+    if isinstance(fn, string_types):
+        return FDIFileManager(), fn
+    #oh, the filename really is a file object or a buffer
+    result = FDIObjectFileManager()
+    fn = result.setfile(open_source(fn))
     return result, fn
 
-def is_cabinetfile(filename):
-    """Returns True if the given file is a cabinet.
-    The argument can be a filename or a file object.
-    """
-    a = FDIAllocator()
-    e = ERF()
-    ci = FDICABINETINFO()
-    f = FDIFileManager()
-    if hasattr(filename, "read"):
-        fileobj = filename
-    else:
-        fileobj = open(filename, "rb")
-    fd = f.map(fileobj)
-        
-    hfdi = FDICreate(a.malloc, a.free, f.open, f.read, f.write, f.close, f.seek, 0, byref(e))
-    try:
-        if FDIIsCabinet(hfdi, fd, byref(ci)):
-            return ci
-        f.raise_error()
-        e.raise_error()
-        return False
-    finally:
-        FDIDestroy(hfdi)
 
+###############################################
+#Cabinet input.  A source provides read_at(offset, size) and size().  Sources
+#over a buffer, such as bytes or an mmap, return memoryview slices of it so that
+#compressed data is never copied.
 
-class CabinetFile(object):
-    """A class for reading cabinets.  Similar to zipfile.ZipFile.
-    Only single-file cabinets are supported
+class FileSource(object):
+    """A source reading from a seekable file object.  Reads are positional
+    with os.pread() when the file has a descriptor, so they do not disturb each
+    other.  Otherwise seek() and read() are done under a lock.
     """
-    def __init__(self, filename, mode='r'):
-        self.a = FDIAllocator()
-        self.e = ERF()
+    def __init__(self, fileobj, owned=False):
+        self.fileobj = fileobj
+        self.owned = owned
+        self._lock = threading.Lock()
+        self._fd = None
+        if hasattr(os, "pread"):
+            try:
+                self._fd = fileobj.fileno()
+            except (AttributeError, EnvironmentError, io.UnsupportedOperation):
+                pass
 
-        self.f, self.filename = FileManager(filename)                              
-        self.head, self.tail = os.path.split(os.path.normpath(self.filename))
-        if self.head:
-            self.head += "\\"
-        if not PY2:
-            self.head = self.head.encode(sys.getfilesystemencoding())
-            self.tail = self.tail.encode(sys.getfilesystemencoding())
-            
-        self.hfdi = FDICreate(self.a.malloc, self.a.free,
-                              self.f.open, self.f.read, self.f.write, self.f.close, self.f.seek,
-                              0, byref(self.e))
+    def read_at(self, offset, size):
+        if self._fd is not None:
+            data = os.pread(self._fd, size, offset)
+            if len(data) < size:
+                #short read, keep going until end of file
+                pieces = [data]
+                while data and size > 0:
+                    offset += len(data)
+                    size -= len(data)
+                    data = os.pread(self._fd, size, offset)
+                    pieces.append(data)
+                data = b"".join(pieces)
+            return data
+        with self._lock:
+            self.fileobj.seek(offset)
+            return self.fileobj.read(size)
 
-    def __del__(self):
-        #must have a del method to ensure that we call FDIDestroy
-        if FDIDestroy: #module is not being torn down
-            self.close()
+    def size(self):
+        if self._fd is not None:
+            return os.fstat(self._fd).st_size
+        with self._lock:
+            return self.fileobj.seek(0, 2) or self.fileobj.tell()
 
     def close(self):
-        if self.hfdi:
-            FDIDestroy(self.hfdi)
-            self.hfdi = None
+        if self.owned and self.fileobj is not None:
+            self.fileobj.close()
+        self.fileobj = self._fd = None
 
 
-    def __FDICopy(self, callback):
-        #perform the actual fdicopy call, catching exceptions etc.
-        excinfo = []
-        def wrap(fdint, pnotify):
-            try:
-                return callback(fdint, pnotify)
-            except Exception:
-                excinfo[:] = sys.exc_info()
-                return -1
+class BufferSource(object):
+    """A zero copy source over an object supporting the buffer protocol"""
+    def __init__(self, buf, owned=False):
+        self.buf = buf
+        self.view = memoryview(buf)
+        if self.view.ndim != 1 or self.view.itemsize != 1:
+            self.view = self.view.cast("B")
+        self.owned = owned
 
-        self.e.clear()
-        r = FDICopy(self.hfdi, self.tail, self.head, 0, PFNFDINOTIFY(wrap), None, None)
-        if not r:
-            if excinfo:
-                raise excinfo[1]
-            self.f.raise_error() #maybe it is a filer error
-            self.e.raise_error() #or an error in the error state
-        return r
+    def read_at(self, offset, size):
+        return self.view[offset:offset + size]
 
-    def namelist(self):
-        """Return a list of file names in the archive."""
-        names = []
-        def callback(fdint, pnotify):
-            notify = pnotify.contents
-            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
-                return 0
-            if fdint == fdintCOPY_FILE:
-                names.append(notify.psz1)
-                return 0 #don't copy
-            return -1
+    def size(self):
+        return len(self.view)
 
-        self.__FDICopy(callback)
-        return names
+    def close(self):
+        try:
+            if self.view is not None:
+                self.view.release()
+            if self.owned:
+                self.buf.close()
+        except BufferError:
+            pass #slices are still in use, leave it to the garbage collector
+        self.view = self.buf = None
 
-    def infolist(self):
-        """Return a list of class CabinetInfo instances for files in the
-        archive.
-        """
-        infos = []
-        def callback(fdint, pnotify):
-            notify = pnotify.contents
-            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
-                return 0
-            if fdint == fdintCOPY_FILE:
-                i = CabinetInfo(notify.psz1, DecodeFATTime(notify.date, notify.time))
-                i.file_size = notify.cb
-                i.external_attr = notify.attribs
-                infos.append(i)
-                return 0 #don't copy
-            return -1
-        
-        self.__FDICopy(callback)
-        return infos
-        
-    def printdir(self):
-        """Print a table of contents for the archive."""
-        print("%-46s %19s %12s" % ("File Name", "Modified    ", "Size"))
-        for cinfo in self.infolist():
-            date = "%d-%02d-%02d %02d:%02d:%02d" % cinfo.date_time
-            print("%-46s %s %12d" % (cinfo.filename, date, cinfo.file_size))
 
-    def getinfo(self, name):
-        """Return the instance of CabinetInfo given 'name'."""
-        infos = self.infolist()
-        mine = [i for i in infos if i.filename == name]
-        if not mine:
-            return None
-        return mine[0]
+def _copy_into(buf, offset, start, data):
+    #copy the part of data, which starts at start, that falls in buf, which
+    #starts at offset
+    a = max(start, offset)
+    b = min(start + len(data), offset + len(buf))
+    if a < b:
+        buf[a - offset:b - offset] = memoryview(data)[a - start:b - start]
 
-    def read(self, name):
-        """Return file bytes (as a string) for name."""
-        result = []
-        names = [name] if isinstance(name, basestring) else name
-        def callback(fdint, pnotify):
-            notify = pnotify.contents
-            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
-                return 0
-            if fdint == fdintCOPY_FILE:
-                if notify.psz1 in names:
-                    sio = StringIO()
-                    fd = self.f.map(sio)
-                    return fd #signals that we want to copy!
-                return 0 #don't copy
-            if fdint == fdintCLOSE_FILE_INFO:
-                sio = self.f.unmap(notify.hf)
-                result.append(sio.getvalue()) #store the file outside
-                return 1
-            return -1
+class RangeSource(object):
+    """A source over a read_range(offset, length) function returning bytes,
+    such as range requests to an object store.  A read fetches exactly the
+    bytes it is missing, with one request for each gap in the cache.  Reads in
+    a range given to advise(), such as a folder's CFDATA blocks, also fetch up
+    to readahead bytes ahead, at most a quarter of the cache and never past the
+    end of the range, and fill any gap left behind them.  So listing a cabinet
+    fetches only its header and directory, and reading a member only its
+    folder.
 
-        self.__FDICopy(callback)
-        return result[0] if isinstance(name, basestring) else result
-        
-    def extract(self, target, names=[]):
-        """extract files into a target directory.
-        Optionally, a set of names may be given
+    The data is cached in pages of page_size bytes, least recently used first
+    out when the cache holds more than cache_size bytes.  The first
+    header_size bytes are kept for good.  size is the size of the file, or None
+    to take the cabinet size from its header.  requests and fetched count the
+    calls to read_range and the bytes they returned.
+    """
+    def __init__(self, read_range, size=None, page_size=64 * 1024, readahead=4 * 1024 * 1024,
+                 cache_size=32 * 1024 * 1024, header_size=64 * 1024):
+        self.read_range = read_range
+        self.page_size = page_size
+        self.readahead = max(min(readahead, cache_size // 4), page_size)
+        self.cache_size = cache_size
+        self.header_pages = -(-header_size // page_size)
+        self.requests = self.fetched = 0
+        self._lock = threading.Lock()
+        self._pinned = {}
+        self._pages = OrderedDict() #page number: (start in the page, data)
+        self._cached = 0 #bytes in _pages
+        self._advised = []
+        self._size = size
+        if size is None:
+            hdr = bytes(self.read_at(0, _CFHEADER.size))
+            if len(hdr) < _CFHEADER.size or hdr[:4] != CAB_SIGNATURE:
+                raise CabinetError(FDIERROR_NOT_A_CABINET, "not a cabinet file")
+            self._size = _CFHEADER.unpack(hdr)[2]
+
+    def advise(self, offset, size):
+        """Tell the source that the range will be read, such as a folder's
+        CFDATA blocks, so reads in it fetch ahead up to its end
         """
-        def callback(fdint, pnotify):
-            notify = pnotify.contents
-            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
-                return 0
-            if fdint == fdintCOPY_FILE:
-                if not names or notify.psz1 in names:
-                    pname = os.path.join(target, notify.psz1)
-                    dir = os.path.dirname(pname)
-                    if not os.path.exists(dir):
-                        os.makedirs(dir)
-                    f = open(pname, "wb")
-                    return self.f.map(f)
-                return 0
-            if fdint == fdintCLOSE_FILE_INFO:
-                f = self.f.unmap(notify.hf)
-                f.close()
-                return 1
-            return -1
-            
-        self.__FDICopy(callback)
+        with self._lock:
+            self._advised = [(offset, offset + size)] + self._advised[:7]
+
+    def _page(self, i):
+        #the cached (start, data) of a page or None, with the lock held
+        piece = self._pinned.get(i)
+        if piece is None:
+            piece = self._pages.get(i)
+            if piece is not None:
+                self._pages[i] = self._pages.pop(i) #most recently used
+        return piece
+
+    def _store(self, i, start, data):
+        #cache data at start in page i, joined to what is cached there if the
+        #two touch, else replacing it
+        with self._lock:
+            pages = self._pinned if i < self.header_pages else self._pages
+            old = pages.pop(i, None)
+            if old is not None:
+                if pages is self._pages:
+                    self._cached -= len(old[1])
+                ostart, odata = old
+                if ostart <= start + len(data) and start <= ostart + len(odata):
+                    lo = min(start, ostart)
+                    buf = bytearray(max(start + len(data), ostart + len(odata)) - lo)
+                    buf[ostart - lo:ostart - lo + len(odata)] = odata
+                    buf[start - lo:start - lo + len(data)] = data
+                    start, data = lo, bytes(buf)
+            pages[i] = (start, data)
+            if pages is self._pages:
+                self._cached += len(data)
+                while self._cached > self.cache_size and len(self._pages) > 1:
+                    self._cached -= len(self._pages.popitem(last=False)[1][1])
+
+    def _fetch(self, lo, hi):
+        #fetch the bytes lo..hi with one request and cache them
+        data = bytes(self.read_range(lo, hi - lo))
+        with self._lock:
+            self.requests += 1
+            self.fetched += len(data)
+        ps = self.page_size
+        pos = lo
+        while pos < lo + len(data):
+            i = pos // ps
+            stop = min((i + 1) * ps, lo + len(data))
+            self._store(i, pos - i * ps, data[pos - lo:stop - lo])
+            pos = stop
+        return data
+
+    def read_at(self, offset, size):
+        if self._size is not None:
+            size = min(size, self._size - offset)
+        if size <= 0 or offset < 0:
+            return b""
+        ps = self.page_size
+        end = offset + size
+        first, last = offset // ps, (end - 1) // ps
+        with self._lock:
+            pieces = [self._page(i) for i in range(first, last + 1)]
+            ahead = end #where to read ahead to
+            behind = None #where the advised range starts
+            for start, stop in self._advised:
+                if start <= offset < stop:
+                    #to a page boundary, so the cached pages are whole
+                    ahead = min(-(-(end + self.readahead) // ps) * ps, stop)
+                    behind = start
+                    break
+        if len(pieces) == 1 and pieces[0] is not None:
+            start, data = pieces[0]
+            pos = offset - first * ps - start
+            if pos >= 0 and pos + size <= len(data):
+                return data[pos:pos + size]
+
+        #the gaps in the cache, as absolute [lo, hi) ranges
+        missing = []
+        for i, piece in enumerate(pieces, first):
+            lo, hi = max(offset, i * ps), min(end, (i + 1) * ps)
+            if piece is not None:
+                pstart = i * ps + piece[0]
+                pend = pstart + len(piece[1])
+                if pstart <= lo and hi <= pend:
+                    continue
+                if pstart <= lo < pend:
+                    lo = pend
+                elif pstart < hi <= pend:
+                    hi = pstart
+            if missing and missing[-1][1] == lo:
+                missing[-1][1] = hi
+            else:
+                missing.append([lo, hi])
+        if behind is not None and missing and missing[0][0] > behind:
+            #fill a gap back to what is cached, left by reads that skipped
+            #ahead, such as of the CFDATA headers only
+            lo = missing[0][0]
+            limit = max(behind, lo - self.readahead)
+            with self._lock:
+                for i in range((lo - 1) // ps, limit // ps - 1, -1):
+                    piece = self._pinned.get(i) or self._pages.get(i)
+                    if piece is not None and i * ps + piece[0] < lo:
+                        missing[0][0] = max(min(i * ps + piece[0] + len(piece[1]), lo), limit)
+                        break
+        if ahead > end and missing and missing[-1][1] == end:
+            #read ahead, up to whatever is already cached
+            stop = ahead
+            with self._lock:
+                for i in range(last, (stop - 1) // ps + 1):
+                    piece = self._pinned.get(i) or self._pages.get(i)
+                    if piece is not None and i * ps + piece[0] + len(piece[1]) > end:
+                        stop = max(min(stop, i * ps + piece[0]), end)
+                        break
+            missing[-1][1] = stop
+
+        buf = bytearray(size)
+        for i, piece in enumerate(pieces, first):
+            if piece is not None:
+                _copy_into(buf, offset, i * ps + piece[0], piece[1])
+        for lo, hi in missing:
+            data = self._fetch(lo, hi)
+            _copy_into(buf, offset, lo, data)
+            if len(data) < hi - lo:
+                #the file ends early
+                size = min(size, max(lo + len(data) - offset, 0))
+        return bytes(buf[:size])
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        #the cache is dropped, the source can still be read
+        with self._lock:
+            self._pinned.clear()
+            self._pages.clear()
+            self._cached = 0
 
-    def testcabinet(self):
-        """verify that the archive is ok"""
-        def callback(fdint, pnotify):
-            #read and discard all data
-            notify = pnotify.contents
-            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
-                return 0
-            if fdint == fdintCOPY_FILE:
-                sio = StringIO()
-                fd = self.f.map(sio)
-                return fd #signals that we want to copy!
-            if fdint == fdintCLOSE_FILE_INFO:
-                sio = self.f.unmap(notify.hf)
-                sio.close()
-                return 1
-            return -1
 
+def open_source(filename, use_mmap=True):
+    """Return a source for a file name, a file object or a buffer, or the
+    object itself if it already is a source with read_at() and size().
+    Files opened by name are memory mapped if possible.
+    """
+    if hasattr(filename, "read_at"):
+        return filename
+    if hasattr(filename, "read"):
+        return FileSource(filename)
+    if not isinstance(filename, string_types):
+        return BufferSource(filename)
+    f = open(filename, "rb")
+    if use_mmap:
         try:
-            return self.__FDICopy(callback) != 0
-        except (CabinetError, IOError):
-            return False
-            
-class CabinetInfo(object):
-    """A simple class to encapsulate information about cabinet members"""
-    def __init__(self, filename=None, date_time=None):
-        self.filename, self.date_time = filename, date_time
-        self.file_size = 0
-        self.external_attr = 0
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            pass #empty file, or not mappable
+        else:
+            f.close()
+            return BufferSource(m, owned=True)
+    return FileSource(f, owned=True)
+
+
+###############################################
+#Pure python reading of the cabinet directory.  The CFHEADER, CFFOLDER and
+#CFFILE structures are parsed straight from the file, without cabinet.dll.
+
+CAB_SIGNATURE = b"MSCF"
+
+#CFHEADER flags
+cfhdrPREV_CABINET    = 0x0001
+cfhdrNEXT_CABINET    = 0x0002
+cfhdrRESERVE_PRESENT = 0x0004
+
+#special CFFILE iFolder values for files spanning cabinets
+ifoldCONTINUED_FROM_PREV     = 0xFFFD
+ifoldCONTINUED_TO_NEXT       = 0xFFFE
+ifoldCONTINUED_PREV_AND_NEXT = 0xFFFF
+
+_CFHEADER  = struct.Struct("<4sIIIIIBBHHHHH")
+_CFRESERVE = struct.Struct("<HBB")
+_CFFOLDER  = struct.Struct("<IHH")
+_CFFILE    = struct.Struct("<IIHHHH")
+_CFDATA    = struct.Struct("<IHH")
+
+
+def _xor_words(data):
+    """XOR together the little endian 32 bit words of data, whose length is a
+    multiple of 4
+    """
+    if numpy is not None:
+        return int(numpy.bitwise_xor.reduce(numpy.frombuffer(data, "<u4")))
+    if PY2:
+        x = 0
+        for (w,) in struct.unpack("<%dI" % (len(data) // 4), data):
+            x ^= w
+        return x
+    #fold the whole block as one big integer, halving it each round
+    x = int.from_bytes(data, "little")
+    words = len(data) // 4
+    while words > 1:
+        half = (words + 1) // 2
+        x = (x >> (32 * half)) ^ (x & ((1 << (32 * half)) - 1))
+        words = half
+    return x
+
+def cfdata_checksum(data, cbData, cbUncomp):
+    """Compute the checksum of a CFDATA block from its payload and sizes, as
+    defined by the cabinet SDK
+    """
+    n = len(data) & ~3
+    csum = _xor_words(memoryview(data)[:n]) if n else 0
+    #the trailing bytes are folded in most significant byte first
+    ul = 0
+    for b in bytearray(data[n:]):
+        ul = (ul << 8) | b
+    return csum ^ ul ^ (cbData | (cbUncomp << 16))
+
+def _decode_name(name, attribs):
+    """Decode a member name as stored in the cabinet"""
+    if PY2:
+        return name
+    if attribs & _A_NAME_IS_UTF:
+        try:
+            return name.decode("utf-8")
+        except UnicodeDecodeError:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "member name is not valid utf-8")
+    return name.decode("cp437")
+
+def _read_string(buf, pos):
+    """Read a null terminated string from buf, return it and the position after it"""
+    end = buf.find(b"\0", pos)
+    if end < 0:
+        raise CabinetError(FDIERROR_CORRUPT_CABINET, "unterminated string in header")
+    return buf[pos:end], end + 1
+
+
+class CabinetFolder(object):
+    """Information about a folder, the unit of compression in a cabinet"""
+    def __init__(self, index, coffCabStart, cCFData, typeCompress):
+        self.index = index
+        self.coffCabStart = coffCabStart
+        self.cCFData = cCFData
+        self.typeCompress = typeCompress
 
     def __repr__(self):
-        return "<CabinetInfo %s, size=%s, date=%r, attrib=%x>"%(self.filename, self.file_size, self.date_time, self.external_attr)
+        return "<CabinetFolder %d, offset=%d, blocks=%d, compression=%x>"%(
+            self.index, self.coffCabStart, self.cCFData, self.typeCompress)
 
-def DecodeFATTime(FATdate, FATtime):
-    """Convert the 2x16 bits of time in the FAT system to a tuple"""
-    day = FATdate & 0x1f
-    month = (FATdate >> 5) & 0xf
-    year = 1980 + (FATdate >> 9)
-    sec = 2 * (FATtime & 0x1f)
-    min = (FATtime >> 5) & 0x3f
-    hour = FATtime >> 11
-    return (year, day, month, hour, min, sec)
 
+class CabinetDirectory(object):
+    """The parsed header, folder and file tables of a cabinet"""
+    def __init__(self):
+        self.cbCabinet = 0
+        self.coffFiles = 0
+        self.versionMajor = self.versionMinor = 0
+        self.flags = 0
+        self.setID = 0
+        self.iCabinet = 0
+        self.cFiles = 0
+        self.cbCFHeader = self.cbCFFolder = self.cbCFData = 0
+        self.szCabinetPrev = self.szDiskPrev = None
+        self.szCabinetNext = self.szDiskNext = None
+        self.folders = []
+        self.infos = MemberTable()
 
-def main(args = None):
-    import textwrap
-    USAGE=textwrap.dedent("""\
-        Usage:
-            cabinet.py -l cabinet.cab        # Show listing of a cab file
-            cabinet.py -t cabinet.cab        # Test if a cab file is valid
-            cabinet.py -e cabinet.cab target # Extract cab file into target dir
-        """)
-        #    cabinet.py -c cabinet.cab src ... # Create cab file from sources
-        #""")
-    if args is None:
-        args = sys.argv[1:]
+    def cabinetinfo(self):
+        """Return the header information as a FDICABINETINFO structure"""
+        ci = FDICABINETINFO()
+        ci.cbCabinet = self.cbCabinet
+        ci.cFolders = len(self.folders)
+        ci.cFiles = self.cFiles
+        ci.setID = self.setID
+        ci.iCabinet = self.iCabinet
+        ci.fReserve = bool(self.flags & cfhdrRESERVE_PRESENT)
+        ci.hasprev = bool(self.flags & cfhdrPREV_CABINET)
+        ci.hasnext = bool(self.flags & cfhdrNEXT_CABINET)
+        return ci
 
-    if not args or args[0] not in ('-l', '-e', '-t'):
-        print(USAGE)
-        sys.exit(1)
 
-    if args[0] == '-l':
-        if len(args) != 2:
-            print(USAGE)
-            sys.exit(1)
-        zf = CabinetFile(args[1])
-        zf.printdir()
-        zf.close()
+class MemberTable(object):
+    """The CFFILE table of a cabinet, kept in columns: arrays of the sizes,
+    offsets, folders, dates, times and attributes, and the names in one blob.
+    Indexing and iterating give CabinetInfo objects, which are created on first
+    access and then kept.
+    """
+    def __init__(self):
+        self.sizes = array("I")
+        self.offsets = array("I")
+        self.folders = array("H")
+        self.dates = array("H")
+        self.times = array("H")
+        self.attribs = array("H")
+        self._names = bytearray() #null terminated, utf-8 encoded
+        self._ends = array("I")
+        self._infos = None #the CabinetInfo objects created so far
+        self._strings = None #the decoded names, kept along with _index
+        self._index = None
+        self._lock = threading.Lock()
 
-    elif args[0] == '-t':
-        if len(args) != 2:
-            print(USAGE)
-            sys.exit(1)
-        zf = CabinetFile(args[1])
-        print(zf.testcabinet())
-        print("Done testing")
+    def add(self, name, cbFile, uoffFolderStart, iFolder, date, time, attribs):
+        """Add an entry from the fields of a CFFILE entry, with name decoded"""
+        self.sizes.append(cbFile)
+        self.offsets.append(uoffFolderStart)
+        self.folders.append(iFolder)
+        self.dates.append(date)
+        self.times.append(time)
+        self.attribs.append(attribs)
+        self._names += name if PY2 else name.encode("utf-8")
+        self._names += b"\0"
+        self._ends.append(len(self._names))
+        if self._infos is not None:
+            self._infos.append(None)
+        self._index = self._strings = None
 
-    elif args[0] == '-e':
-        if len(args) != 3:
-            print(USAGE)
-            sys.exit(1)
+    def append(self, info):
+        """Add the entry for a CabinetInfo, which is kept"""
+        self.add(info.filename, info.file_size, info.folder_offset, info.folder_index,
+                 info.fat_date, info.fat_time, info.external_attr)
+        self._getinfos()[-1] = info
 
-        zf = CabinetFile(args[1])
-        out = args[2]
-        zf.extract(out)
-        zf.close()
+    def _getinfos(self):
+        with self._lock:
+            if self._infos is None:
+                self._infos = [None] * len(self.sizes)
+            return self._infos
 
-    elif False and args[0] == '-c':
-        # not supported
-        if len(args) < 3:
-            print(USAGE)
-            sys.exit(1)
+    def __len__(self):
+        return len(self.sizes)
 
-        def addToZip(zf, path, zippath):
-            if os.path.isfile(path):
-                zf.write(path, zippath, ZIP_DEFLATED)
-            elif os.path.isdir(path):
-                for nm in os.listdir(path):
-                    addToZip(zf,
-                            os.path.join(path, nm), os.path.join(zippath, nm))
-            # else: ignore
+    def name(self, i):
+        strings = self._strings
+        if strings is not None:
+            return strings[i]
+        start = self._ends[i - 1] if i else 0
+        name = self._names[start:self._ends[i] - 1]
+        return bytes(name) if PY2 else name.decode("utf-8")
 
-        zf = ZipFile(args[1], 'w', allowZip64=True)
-        for src in args[2:]:
-            addToZip(zf, src, os.path.basename(src))
+    def names(self):
+        """Return a list of all the names, without creating CabinetInfo objects"""
+        if not self._ends:
+            return []
+        names = self._names[:-1]
+        return (bytes(names) if PY2 else names.decode("utf-8")).split("\0")
 
-        zf.close()
+    def rows(self):
+        """Yield (name, size, offset, folder, date, time, attribs) for each entry"""
+        return zip(self._strings or self.names(), self.sizes, self.offsets, self.folders,
+                   self.dates, self.times, self.attribs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        infos = self._infos or self._getinfos()
+        info = infos[i]
+        if info is None:
+            if i < 0:
+                i += len(self)
+            info = _make_info(self.name(i), self.sizes[i], self.offsets[i], self.folders[i],
+                              self.dates[i], self.times[i], self.attribs[i])
+            with self._lock:
+                #another thread may have won
+                info = infos[i] = infos[i] or info
+        return info
+
+    def __iter__(self):
+        #create all the missing CabinetInfo objects in one pass
+        infos = self._getinfos()
+        if None in infos:
+            with self._lock:
+                for i, row in enumerate(self.rows()):
+                    if infos[i] is None:
+                        infos[i] = _make_info(*row)
+        return iter(infos[:])
+
+    def get(self, name, default=None):
+        """Return the CabinetInfo of the first member called name"""
+        index = self._index
+        if index is None:
+            names = self.names()
+            #the first of any duplicate names wins.  The names are kept, for
+            #the CabinetInfo objects to share.
+            index = dict(zip(reversed(names), range(len(names) - 1, -1, -1)))
+            self._strings, self._index = names, index
+        i = index.get(name)
+        return default if i is None else self[i]
+
+    def positions(self, infos):
+        """Return the positions in the table of the given CabinetInfo objects"""
+        ids = dict((id(info), i) for i, info in enumerate(self._getinfos()) if info is not None)
+        return [ids[id(info)] for info in infos]
+
+    def in_folder(self, iFolder):
+        """Return the CabinetInfo objects of the members in a folder"""
+        return [self[i] for i, f in enumerate(self.folders) if f == iFolder]
+
+
+def _make_info(name, cbFile, uoffFolderStart, iFolder, date, time, attribs):
+    #a CabinetInfo from the fields of a CFFILE entry
+    info = CabinetInfo(name, DecodeFATTime(date, time))
+    info.file_size = cbFile
+    info.external_attr = attribs
+    info.folder_index = iFolder
+    info.folder_offset = uoffFolderStart
+    info.fat_date, info.fat_time = date, time
+    return info
+
+def read_directory(read_at, header_only=False):
+    """Parse the directory of a cabinet, using read_at(offset, size) to get at the
+    data.  Returns a CabinetDirectory.  If header_only is true, the CFFILE table
+    is not read.
+    """
+    source_read_at = read_at
+    read_at = lambda offset, size: bytes(source_read_at(offset, size))
+    buf = read_at(0, _CFHEADER.size)
+    if len(buf) < _CFHEADER.size or buf[:4] != CAB_SIGNATURE:
+        raise CabinetError(FDIERROR_NOT_A_CABINET, "not a cabinet file")
+    d = CabinetDirectory()
+    (sig, reserved1, d.cbCabinet, reserved2, d.coffFiles, reserved3,
+     d.versionMinor, d.versionMajor, cFolders, d.cFiles, d.flags,
+     d.setID, d.iCabinet) = _CFHEADER.unpack(buf)
+    if d.versionMajor != 1:
+        raise CabinetError(FDIERROR_UNKNOWN_CABINET_VERSION,
+                           "cabinet version %d.%d"%(d.versionMajor, d.versionMinor))
+
+    #everything up to the CFFILE table: header, reserve, strings and folders
+    buf = read_at(0, d.coffFiles)
+    try:
+        pos = _CFHEADER.size
+        if d.flags & cfhdrRESERVE_PRESENT:
+            d.cbCFHeader, d.cbCFFolder, d.cbCFData = _CFRESERVE.unpack_from(buf, pos)
+            pos += _CFRESERVE.size + d.cbCFHeader
+        if d.flags & cfhdrPREV_CABINET:
+            d.szCabinetPrev, pos = _read_string(buf, pos)
+            d.szDiskPrev, pos = _read_string(buf, pos)
+        if d.flags & cfhdrNEXT_CABINET:
+            d.szCabinetNext, pos = _read_string(buf, pos)
+            d.szDiskNext, pos = _read_string(buf, pos)
+        for i in range(cFolders):
+            coffCabStart, cCFData, typeCompress = _CFFOLDER.unpack_from(buf, pos)
+            pos += _CFFOLDER.size + d.cbCFFolder
+            d.folders.append(CabinetFolder(i, coffCabStart, cCFData, typeCompress))
+    except struct.error:
+        raise CabinetError(FDIERROR_CORRUPT_CABINET, "truncated cabinet header")
+    if header_only:
+        return d
+
+    #the CFFILE table normally runs right up to the first CFDATA block
+    end = min([f.coffCabStart for f in d.folders if f.cCFData] or [d.cbCabinet])
+    buf = read_at(d.coffFiles, max(end - d.coffFiles, 0))
+    pos = 0
+    for i in range(d.cFiles):
+        zero = buf.find(b"\0", pos + _CFFILE.size)
+        while zero < 0:
+            more = read_at(d.coffFiles + len(buf), 4096)
+            if not more:
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "truncated CFFILE table")
+            buf += more
+            zero = buf.find(b"\0", pos + _CFFILE.size)
+        cbFile, uoffFolderStart, iFolder, date, time, attribs = _CFFILE.unpack_from(buf, pos)
+        name = _decode_name(buf[pos + _CFFILE.size:zero], attribs)
+        pos = zero + 1
+        d.infos.add(name, cbFile, uoffFolderStart, iFolder, date, time, attribs)
+    return d
+
+
+###############################################
+#A persistent cache of cabinet directories, so that listing a cabinet that has
+#not changed needs no cabinet I/O.
+
+def _file_key(path):
+    #the absolute path, size and mtime of a file, which identify its contents
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return path, st.st_size, getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))
+
+def _fold(name):
+    #a name folded to compare it ignoring case, beyond ascii where python can
+    return name.casefold() if hasattr(name, "casefold") else name.lower()
+
+def _glob(pattern):
+    #a regular expression matching the folded names matched by a glob pattern
+    return re.compile(fnmatch.translate(_fold(pattern)))
+
+
+class DirectoryCache(object):
+    """An on-disk cache of parsed cabinet directories in a SQLite database.
+    Entries are keyed by the absolute path of a cabinet and are valid as long
+    as its size and mtime are unchanged.  Pass it as the cache argument of
+    CabinetFile, or use search() to find members across all cached cabinets.
+    """
+    _HEADER = ("cbCabinet", "coffFiles", "versionMajor", "versionMinor", "flags", "setID",
+               "iCabinet", "cFiles", "cbCFHeader", "cbCFFolder", "cbCFData")
+    _VERSION = 2
+
+    def __init__(self, filename):
+        if sqlite3 is None:
+            raise ImportError("DirectoryCache requires the sqlite3 module")
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self.db:
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if version != self._VERSION:
+                self.db.executescript("""
+                    DROP TABLE IF EXISTS cabinets;
+                    DROP TABLE IF EXISTS folders;
+                    DROP TABLE IF EXISTS members;
+                    CREATE TABLE cabinets (id INTEGER PRIMARY KEY, path TEXT UNIQUE,
+                        size INTEGER, mtime INTEGER, %s);
+                    CREATE TABLE folders (cabinet INTEGER, idx INTEGER, coffCabStart INTEGER,
+                        cCFData INTEGER, typeCompress INTEGER);
+                    CREATE TABLE members (cabinet INTEGER, idx INTEGER, name TEXT, size INTEGER,
+                        offset INTEGER, folder INTEGER, date INTEGER, time INTEGER,
+                        attribs INTEGER, folded TEXT);
+                    CREATE INDEX folders_cabinet ON folders (cabinet);
+                    CREATE INDEX members_cabinet ON members (cabinet);
+                    PRAGMA user_version = %d;
+                    """ % (", ".join("%s INTEGER" % f for f in self._HEADER), self._VERSION))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def lookup(self, path):
+        """Return the cached CabinetDirectory of the cabinet at path, or None if
+        it is not cached or has changed
+        """
+        path, size, mtime = _file_key(path)
+        with self._lock:
+            row = self.db.execute("SELECT id, %s FROM cabinets WHERE path=? AND size=? AND mtime=?"
+                                  % ", ".join(self._HEADER), (path, size, mtime)).fetchone()
+            if row is None:
+                return None
+            d = CabinetDirectory()
+            for name, value in zip(self._HEADER, row[1:]):
+                setattr(d, name, value)
+            for i, coffCabStart, cCFData, typeCompress in self.db.execute(
+                    "SELECT idx, coffCabStart, cCFData, typeCompress FROM folders "
+                    "WHERE cabinet=? ORDER BY idx", (row[0],)):
+                d.folders.append(CabinetFolder(i, coffCabStart, cCFData, typeCompress))
+            members = self.db.execute("SELECT name, size, offset, folder, date, time, attribs "
+                                      "FROM members WHERE cabinet=? ORDER BY idx", (row[0],))
+            for fields in members:
+                d.infos.add(*fields)
+        return d
+
+    def store(self, path, directory):
+        """Cache the CabinetDirectory of the cabinet at path"""
+        path, size, mtime = _file_key(path)
+        with self._lock, self.db:
+            self._forget(path)
+            cur = self.db.execute("INSERT INTO cabinets (path, size, mtime, %s) VALUES (?, ?, ?, %s)"
+                                  % (", ".join(self._HEADER), ", ".join("?" * len(self._HEADER))),
+                                  [path, size, mtime] + [getattr(directory, f) for f in self._HEADER])
+            id = cur.lastrowid
+            self.db.executemany("INSERT INTO folders VALUES (?, ?, ?, ?, ?)",
+                                [(id, f.index, f.coffCabStart, f.cCFData, f.typeCompress)
+                                 for f in directory.folders])
+            self.db.executemany("INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(id, i) + row + (_fold(row[0]),)
+                                 for i, row in enumerate(directory.infos.rows())])
+
+    def _forget(self, path):
+        for (id,) in self.db.execute("SELECT id FROM cabinets WHERE path=?", (path,)).fetchall():
+            self.db.execute("DELETE FROM members WHERE cabinet=?", (id,))
+            self.db.execute("DELETE FROM folders WHERE cabinet=?", (id,))
+            self.db.execute("DELETE FROM cabinets WHERE id=?", (id,))
+
+    def prune(self):
+        """Drop the entries of cabinets that no longer exist or have changed.
+        Returns the number of entries dropped.
+        """
+        with self._lock:
+            rows = self.db.execute("SELECT path, size, mtime FROM cabinets").fetchall()
+        stale = []
+        for path, size, mtime in rows:
+            try:
+                if _file_key(path)[1:] == (size, mtime):
+                    continue
+            except OSError:
+                pass
+            stale.append(path)
+        with self._lock, self.db:
+            for path in stale:
+                self._forget(path)
+        return len(stale)
+
+    def search(self, pattern):
+        """Yield (cabinet path, CabinetInfo) for each cached member whose name
+        matches the glob pattern, ignoring case like select()
+        """
+        match = _glob(pattern).match
+        with self._lock:
+            self.db.create_function("cabinet_glob", 1, lambda folded: match(folded) is not None)
+            rows = self.db.execute(
+                "SELECT cabinets.path, members.name, members.size, members.offset, "
+                "members.folder, members.date, members.time, members.attribs "
+                "FROM members JOIN cabinets ON members.cabinet = cabinets.id "
+                "WHERE cabinet_glob(members.folded) ORDER BY cabinets.path, members.idx"
+                ).fetchall()
+        for row in rows:
+            yield row[0], _make_info(*row[1:])
+
+
+###############################################
+#Native decompression.  Each compression type has a decompressor class which is
+#created once per folder and decodes one CFDATA block at a time.
+
+#Decompressors that support random access provide getstate() and setstate(),
+#which save and restore the decoder state between two CFDATA blocks, and a
+#statesize attribute, the approximate size of such a state in bytes.
+
+class NoneDecompressor(object):
+    """Decompressor for folders stored without compression"""
+    statesize = 0
+
+    def __init__(self, typeCompress):
+        pass
+
+    def getstate(self):
+        return None
+
+    def setstate(self, state):
+        pass
+
+    def decompress(self, data, size):
+        if len(data) != size:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "stored block size mismatch")
+        return bytes(data)
+
+
+class MSZIPDecompressor(object):
+    """Decompressor for MSZIP folders.  Each CFDATA block is a 'CK' signature
+    followed by a raw deflate stream, which may refer back into the previous
+    32K of output.
+    """
+    HISTORY = 32768
+    statesize = HISTORY
+
+    def __init__(self, typeCompress):
+        self.history = b""
+
+    def getstate(self):
+        return self.history
+
+    def setstate(self, state):
+        self.history = state
+
+    def decompress(self, data, size):
+        if data[:2] != b"CK":
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "bad MSZIP block signature")
+        d = zlib.decompressobj(-15, zdict=self.history)
+        try:
+            out = d.decompress(data[2:]) + d.flush()
+        except zlib.error as e:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, str(e))
+        if len(out) != size:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "MSZIP block size mismatch")
+        if len(out) >= self.HISTORY:
+            self.history = out[-self.HISTORY:]
+        else:
+            self.history = (self.history + out)[-self.HISTORY:]
+        return out
+
+
+#LZX.  The bit stream is a sequence of little endian 16 bit words, read most
+#significant bit first.  Each CFDATA block holds one 32K output frame.
+
+LZX_BLOCKTYPE_VERBATIM     = 1
+LZX_BLOCKTYPE_ALIGNED      = 2
+LZX_BLOCKTYPE_UNCOMPRESSED = 3
+
+LZX_MIN_MATCH              = 2
+LZX_NUM_CHARS              = 256
+LZX_PRETREE_NUM_ELEMENTS   = 20
+LZX_ALIGNED_NUM_ELEMENTS   = 8
+LZX_NUM_PRIMARY_LENGTHS    = 7
+LZX_NUM_SECONDARY_LENGTHS  = 249
+LZX_FRAME_SIZE             = 32768
+
+#number of position slots for window sizes 15 to 21
+_lzx_position_slots = {15: 30, 16: 32, 17: 34, 18: 36, 19: 38, 20: 42, 21: 50}
+
+#extra bits and base offset for each position slot
+_lzx_extra_bits = [min(max(i // 2 - 1, 0), 17) for i in range(52)]
+_lzx_position_base = [0]
+for _bits in _lzx_extra_bits[:-1]:
+    _lzx_position_base.append(_lzx_position_base[-1] + (1 << _bits))
+
+_HUFFBITS = 16 #the longest code length, and the width of the lookup tables
+
+def _build_huffman_table(lengths, nsyms):
+    """Build a lookup table for the canonical huffman code with the given code
+    lengths.  The table is indexed by the next 16 bits of input and each entry
+    holds (symbol << 5) | code length.  Unused entries are 0.
+    """
+    table = [0] * (1 << _HUFFBITS)
+    order = sorted((l, s) for s, l in enumerate(lengths[:nsyms]) if l)
+    code = 0
+    prev = 0
+    for l, s in order:
+        code <<= l - prev
+        prev = l
+        fill = 1 << (_HUFFBITS - l)
+        start = code << (_HUFFBITS - l)
+        if start + fill > len(table):
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "overfull huffman table")
+        table[start:start + fill] = [(s << 5) | l] * fill
+        code += 1
+    return table
+
+
+class _LZXBits(object):
+    """The bit reader for one LZX frame.  The hot loop in LZXDecompressor
+    copies the state into locals and stores it back when done.
+    """
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.reset(pos)
+
+    def reset(self, pos):
+        #start reading 16 bit words at byte offset pos
+        data = self.data
+        n = max(len(data) - pos, 0) // 2
+        self.words = list(struct.unpack_from("<%dH" % n, data, pos)) + [0, 0, 0, 0]
+        self.base = pos
+        self.wpos = 0
+        self.bitbuf = 0
+        self.bitcount = 0
+
+    def read(self, n):
+        while self.bitcount < n:
+            self.bitbuf = ((self.bitbuf & ((1 << self.bitcount) - 1)) << 16) | self.words[self.wpos]
+            self.wpos += 1
+            self.bitcount += 16
+        self.bitcount -= n
+        return (self.bitbuf >> self.bitcount) & ((1 << n) - 1)
+
+    def readsym(self, table):
+        while self.bitcount < _HUFFBITS:
+            self.bitbuf = ((self.bitbuf & ((1 << self.bitcount) - 1)) << 16) | self.words[self.wpos]
+            self.wpos += 1
+            self.bitcount += 16
+        e = table[(self.bitbuf >> (self.bitcount - _HUFFBITS)) & 0xFFFF]
+        if not e:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "invalid huffman code")
+        self.bitcount -= e & 31
+        return e >> 5
+
+
+class LZXDecompressor(object):
+    """Decompressor for LZX folders.  The window and the code lengths persist
+    across blocks and CFDATA frames for the whole folder.
+    """
+    def __init__(self, typeCompress):
+        window_bits = LZXCompressionWindowFromTCOMP(typeCompress)
+        if window_bits not in _lzx_position_slots:
+            raise CabinetError(FDIERROR_BAD_COMPR_TYPE, "bad LZX window size %d" % window_bits)
+        self.window_size = self.statesize = 1 << window_bits
+        self.window = bytearray(self.window_size)
+        self.window_posn = 0
+        self.main_elements = LZX_NUM_CHARS + _lzx_position_slots[window_bits] * 8
+        #the code lengths are delta coded against those of the previous block
+        self.main_lengths = [0] * (self.main_elements + 32)
+        self.length_lengths = [0] * (LZX_NUM_SECONDARY_LENGTHS + 32)
+        self.aligned_lengths = [0] * LZX_ALIGNED_NUM_ELEMENTS
+        self.main_table = self.length_table = self.aligned_table = None
+        self.R0 = self.R1 = self.R2 = 1
+        self.header_read = False
+        self.block_type = 0
+        self.block_length = 0
+        self.block_remaining = 0
+        self.raw_pos = None
+        self.pad_pending = False
+        self.intel_started = False
+        self.intel_filesize = 0
+        self.intel_curpos = 0
+
+    def getstate(self):
+        return (bytes(self.window), self.window_posn, tuple(self.main_lengths),
+                tuple(self.length_lengths), tuple(self.aligned_lengths),
+                self.R0, self.R1, self.R2, self.header_read,
+                self.block_type, self.block_length, self.block_remaining, self.pad_pending,
+                self.intel_started, self.intel_filesize, self.intel_curpos)
+
+    def setstate(self, state):
+        (window, self.window_posn, main_lengths, length_lengths, aligned_lengths,
+         self.R0, self.R1, self.R2, self.header_read,
+         self.block_type, self.block_length, self.block_remaining, self.pad_pending,
+         self.intel_started, self.intel_filesize, self.intel_curpos) = state
+        self.window[:] = window
+        self.main_lengths = list(main_lengths)
+        self.length_lengths = list(length_lengths)
+        self.aligned_lengths = list(aligned_lengths)
+        #the huffman tables are not saved, rebuild them for the current block
+        self.main_table = self.length_table = self.aligned_table = None
+        if self.block_type in (LZX_BLOCKTYPE_VERBATIM, LZX_BLOCKTYPE_ALIGNED):
+            self.main_table = _build_huffman_table(self.main_lengths, self.main_elements)
+            self.length_table = _build_huffman_table(self.length_lengths,
+                                                     LZX_NUM_SECONDARY_LENGTHS)
+        if self.block_type == LZX_BLOCKTYPE_ALIGNED:
+            self.aligned_table = _build_huffman_table(self.aligned_lengths,
+                                                      LZX_ALIGNED_NUM_ELEMENTS)
+
+    def _read_lengths(self, bits, lengths, first, last):
+        #read code lengths first..last, coded with a pretree
+        size = len(lengths)
+        prelens = [bits.read(4) for i in range(LZX_PRETREE_NUM_ELEMENTS)]
+        pretree = _build_huffman_table(prelens, LZX_PRETREE_NUM_ELEMENTS)
+        x = first
+        while x < last:
+            z = bits.readsym(pretree)
+            if z == 17:
+                run = bits.read(4) + 4
+                lengths[x:x + run] = [0] * run
+            elif z == 18:
+                run = bits.read(5) + 20
+                lengths[x:x + run] = [0] * run
+            elif z == 19:
+                run = bits.read(1) + 4
+                z = (lengths[x] - bits.readsym(pretree)) % 17
+                lengths[x:x + run] = [z] * run
+            else:
+                run = 1
+                lengths[x] = (lengths[x] - z) % 17
+            x += run
+        del lengths[size:]
+
+    def _read_block_header(self, bits):
+        if self.block_type == LZX_BLOCKTYPE_UNCOMPRESSED and self.raw_pos is not None:
+            #resume the bit stream after the uncompressed data and its padding
+            bits.reset(self.raw_pos + (self.block_length & 1))
+        self.block_type = bits.read(3)
+        self.block_length = self.block_remaining = (bits.read(16) << 8) | bits.read(8)
+        if self.block_type == LZX_BLOCKTYPE_ALIGNED:
+            self.aligned_lengths = [bits.read(3) for i in range(LZX_ALIGNED_NUM_ELEMENTS)]
+            self.aligned_table = _build_huffman_table(self.aligned_lengths,
+                                                      LZX_ALIGNED_NUM_ELEMENTS)
+        if self.block_type in (LZX_BLOCKTYPE_VERBATIM, LZX_BLOCKTYPE_ALIGNED):
+            self._read_lengths(bits, self.main_lengths, 0, LZX_NUM_CHARS)
+            self._read_lengths(bits, self.main_lengths, LZX_NUM_CHARS, self.main_elements)
+            self.main_table = _build_huffman_table(self.main_lengths, self.main_elements)
+            if self.main_lengths[0xE8]:
+                self.intel_started = True
+            self._read_lengths(bits, self.length_lengths, 0, LZX_NUM_SECONDARY_LENGTHS)
+            self.length_table = _build_huffman_table(self.length_lengths,
+                                                     LZX_NUM_SECONDARY_LENGTHS)
+        elif self.block_type == LZX_BLOCKTYPE_UNCOMPRESSED:
+            self.intel_started = True
+            #align to the next 16 bit boundary, skipping a whole word if aligned
+            consumed = bits.wpos * 16 - bits.bitcount
+            pos = bits.base + 2 * (consumed // 16 + 1)
+            data = bits.data
+            if pos + 12 > len(data):
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX data overrun")
+            self.R0, self.R1, self.R2 = struct.unpack_from("<3I", data, pos)
+            self.raw_pos = pos + 12
+        else:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "bad LZX block type %d" % self.block_type)
+
+    def decompress(self, data, size):
+        bits = _LZXBits(data)
+        if self.block_type == LZX_BLOCKTYPE_UNCOMPRESSED:
+            if self.block_remaining:
+                self.raw_pos = 0 #the uncompressed block continues in this frame
+            else:
+                self.raw_pos = None
+                if self.pad_pending:
+                    #the padding byte of the block ended up in this frame
+                    bits.reset(1)
+        self.pad_pending = False
+
+        window = self.window
+        start = self.window_posn
+        end = start + size
+        if end > self.window_size:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX frame overruns window")
+        try:
+            if not self.header_read:
+                if bits.read(1):
+                    self.intel_filesize = (bits.read(16) << 16) | bits.read(16)
+                self.header_read = True
+            while self.window_posn < end:
+                if self.block_remaining == 0:
+                    self._read_block_header(bits)
+                run = min(self.block_remaining, end - self.window_posn)
+                if self.block_type == LZX_BLOCKTYPE_UNCOMPRESSED:
+                    pos = self.raw_pos
+                    chunk = data[pos:pos + run]
+                    if len(chunk) < run:
+                        raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX data overrun")
+                    window[self.window_posn:self.window_posn + run] = chunk
+                    self.raw_pos = pos + run
+                    self.window_posn += run
+                    self.block_remaining -= run
+                else:
+                    self._decode_run(bits, run)
+        except IndexError:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX data overrun")
+        if self.block_type == LZX_BLOCKTYPE_UNCOMPRESSED and not self.block_remaining \
+                and self.block_length & 1 and self.raw_pos >= len(data):
+            self.pad_pending = True
+
+        out = window[start:end]
+        if self.window_posn == self.window_size:
+            self.window_posn = 0
+        if self.intel_started and self.intel_filesize and size > 10 \
+                and self.intel_curpos < (1 << 30):
+            self._e8_translate(out)
+        if self.intel_filesize:
+            self.intel_curpos += size
+        return bytes(out)
+
+    def _decode_run(self, bits, run):
+        #decode 'run' bytes of a verbatim or aligned block into the window
+        window = self.window
+        posn = self.window_posn
+        end = posn + run
+        window_size = self.window_size
+        main_table = self.main_table
+        length_table = self.length_table
+        aligned_table = self.aligned_table if self.block_type == LZX_BLOCKTYPE_ALIGNED else None
+        extra_bits = _lzx_extra_bits
+        position_base = _lzx_position_base
+        R0, R1, R2 = self.R0, self.R1, self.R2
+        words = bits.words
+        wpos = bits.wpos
+        bitbuf = bits.bitbuf
+        bitcount = bits.bitcount
+        nwords = len(words) - 2
+
+        while posn < end:
+            if bitcount < 16:
+                bitbuf = ((bitbuf & ((1 << bitcount) - 1)) << 16) | words[wpos]
+                wpos += 1
+                bitcount += 16
+            e = main_table[(bitbuf >> (bitcount - 16)) & 0xFFFF]
+            if not e:
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "invalid huffman code")
+            bitcount -= e & 31
+            sym = e >> 5
+            if sym < 256:
+                window[posn] = sym
+                posn += 1
+                continue
+
+            sym -= 256
+            length = sym & 7
+            if length == LZX_NUM_PRIMARY_LENGTHS:
+                if bitcount < 16:
+                    bitbuf = ((bitbuf & ((1 << bitcount) - 1)) << 16) | words[wpos]
+                    wpos += 1
+                    bitcount += 16
+                e = length_table[(bitbuf >> (bitcount - 16)) & 0xFFFF]
+                if not e:
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET, "invalid huffman code")
+                bitcount -= e & 31
+                length += e >> 5
+            length += LZX_MIN_MATCH
+
+            slot = sym >> 3
+            if slot > 2:
+                extra = extra_bits[slot]
+                offset = position_base[slot] - 2
+                if aligned_table is not None and extra >= 3:
+                    if extra > 3:
+                        extra -= 3
+                        while bitcount < extra:
+                            bitbuf = ((bitbuf & ((1 << bitcount) - 1)) << 16) | words[wpos]
+                            wpos += 1
+                            bitcount += 16
+                        bitcount -= extra
+                        offset += ((bitbuf >> bitcount) & ((1 << extra) - 1)) << 3
+                    if bitcount < 16:
+                        bitbuf = ((bitbuf & ((1 << bitcount) - 1)) << 16) | words[wpos]
+                        wpos += 1
+                        bitcount += 16
+                    e = aligned_table[(bitbuf >> (bitcount - 16)) & 0xFFFF]
+                    if not e:
+                        raise CabinetError(FDIERROR_CORRUPT_CABINET, "invalid huffman code")
+                    bitcount -= e & 31
+                    offset += e >> 5
+                elif extra:
+                    while bitcount < extra:
+                        bitbuf = ((bitbuf & ((1 << bitcount) - 1)) << 16) | words[wpos]
+                        wpos += 1
+                        bitcount += 16
+                    bitcount -= extra
+                    offset += (bitbuf >> bitcount) & ((1 << extra) - 1)
+                R2 = R1
+                R1 = R0
+                R0 = offset
+            elif slot == 0:
+                offset = R0
+            elif slot == 1:
+                offset = R1
+                R1 = R0
+                R0 = offset
+            else:
+                offset = R2
+                R2 = R0
+                R0 = offset
+
+            if posn + length > end:
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX match overruns frame")
+            src = posn - offset
+            if src < 0:
+                #the match starts in the wrapped around part of the window
+                src += window_size
+                if src < 0:
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX match offset too large")
+                n = min(length, window_size - src)
+                window[posn:posn + n] = window[src:src + n]
+                if n < length:
+                    window[posn + n:posn + length] = window[0:length - n]
+            elif offset >= length:
+                window[posn:posn + length] = window[src:src + length]
+            else:
+                #overlapping match, repeat the pattern
+                pattern = window[src:posn]
+                window[posn:posn + length] = (pattern * (length // offset + 1))[:length]
+            posn += length
+
+        if wpos > nwords:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "LZX data overrun")
+        bits.wpos = wpos
+        bits.bitbuf = bitbuf
+        bits.bitcount = bitcount
+        self.R0, self.R1, self.R2 = R0, R1, R2
+        self.block_remaining -= posn - self.window_posn
+        self.window_posn = posn
+
+    def _e8_translate(self, out):
+        #undo the encoder's translation of x86 CALL targets to absolute offsets
+        curpos = self.intel_curpos
+        filesize = self.intel_filesize
+        limit = len(out) - 10
+        unpack_from, pack_into = _E8.unpack_from, _E8.pack_into
+        i = out.find(b"\xe8", 0, limit)
+        while i >= 0:
+            pos = curpos + i
+            abs_off = unpack_from(out, i + 1)[0]
+            if -pos <= abs_off < filesize:
+                pack_into(out, i + 1, abs_off - pos if abs_off >= 0 else abs_off + filesize)
+            i = out.find(b"\xe8", i + 5, limit)
+
+_E8 = struct.Struct("<i")
+
+
+#Quantum.  An adaptive arithmetic coder with 16 bit registers, over a bit
+#stream read most significant bit first.  Each CFDATA block holds one 32K
+#output frame, and the coder is restarted for every frame.
+
+QTM_FRAME_SIZE = 32768
+
+#extra bits and base offset for each position slot, and likewise for the
+#match lengths of selector 6
+_qtm_extra_bits = [max(i - 2, 0) >> 1 for i in range(42)]
+_qtm_position_base = [0]
+for _bits in _qtm_extra_bits[:-1]:
+    _qtm_position_base.append(_qtm_position_base[-1] + (1 << _bits))
+_qtm_length_extra = [max(i - 2, 0) >> 2 for i in range(26)] + [0]
+_qtm_length_base = [0]
+for _bits in _qtm_length_extra[:25]:
+    _qtm_length_base.append(_qtm_length_base[-1] + (1 << _bits))
+_qtm_length_base.append(254)
+
+
+class _QuantumModel(object):
+    """An adaptive model for the Quantum arithmetic coder.  The symbols and
+    their cumulative frequencies are kept in two flat lists, sorted by
+    decreasing frequency, with a zero frequency sentinel at the end.
+    """
+    __slots__ = ("shiftsleft", "entries", "syms", "cumfreq")
+
+    def __init__(self, start, entries):
+        self.shiftsleft = 4
+        self.entries = entries
+        self.syms = list(range(start, start + entries)) + [0]
+        self.cumfreq = list(range(entries, -1, -1))
+
+    def update(self):
+        #rescale the frequencies once the total grows too large
+        syms, cumfreq = self.syms, self.cumfreq
+        entries = self.entries
+        self.shiftsleft -= 1
+        if self.shiftsleft:
+            for i in range(entries - 1, -1, -1):
+                cumfreq[i] >>= 1
+                if cumfreq[i] <= cumfreq[i + 1]:
+                    cumfreq[i] = cumfreq[i + 1] + 1
+            return
+        self.shiftsleft = 50
+        #convert to frequencies, halve them and sort by decreasing frequency.
+        #This must be a selection sort, its (in)stability is part of the format.
+        for i in range(entries):
+            cumfreq[i] = (cumfreq[i] - cumfreq[i + 1] + 1) >> 1
+        for i in range(entries - 1):
+            for j in range(i + 1, entries):
+                if cumfreq[i] < cumfreq[j]:
+                    cumfreq[i], cumfreq[j] = cumfreq[j], cumfreq[i]
+                    syms[i], syms[j] = syms[j], syms[i]
+        for i in range(entries - 1, -1, -1):
+            cumfreq[i] += cumfreq[i + 1]
+
+
+class QuantumDecompressor(object):
+    """Decompressor for Quantum folders.  The models and the window persist
+    across frames for the whole folder.
+    """
+    def __init__(self, typeCompress):
+        window_bits = CompressionMemoryFromTCOMP(typeCompress)
+        if not (tcompQUANTUM_MEM_LO >> tcompSHIFT_QUANTUM_MEM <= window_bits
+                <= tcompQUANTUM_MEM_HI >> tcompSHIFT_QUANTUM_MEM):
+            raise CabinetError(FDIERROR_BAD_COMPR_TYPE, "bad Quantum window size %d" % window_bits)
+        self.window_size = 1 << window_bits
+        self.window = bytearray(self.window_size)
+        self.window_posn = 0
+        i = window_bits * 2
+        self.literal_models = [_QuantumModel(0, 64), _QuantumModel(64, 64),
+                               _QuantumModel(128, 64), _QuantumModel(192, 64)]
+        self.model4 = _QuantumModel(0, min(i, 24))
+        self.model5 = _QuantumModel(0, min(i, 36))
+        self.model6 = _QuantumModel(0, i)
+        self.model6len = _QuantumModel(0, 27)
+        self.model7 = _QuantumModel(0, 7)
+
+    def _symbol(self, model):
+        #decode one symbol, then update the model and renormalize
+        cumfreq = model.cumfreq
+        H, L, C = self.H, self.L, self.C
+        total = cumfreq[0]
+        symf = (((C - L + 1) * total - 1) // (((H - L) & 0xFFFF) + 1)) & 0xFFFF
+        i = 1
+        entries = model.entries
+        while i < entries and cumfreq[i] > symf:
+            i += 1
+        sym = model.syms[i - 1]
+        span = H - L + 1
+        H = (L + (cumfreq[i - 1] * span) // total - 1) & 0xFFFF
+        L = (L + (cumfreq[i] * span) // total) & 0xFFFF
+        for k in range(i):
+            cumfreq[k] += 8
+        if cumfreq[0] > 3800:
+            model.update()
+
+        buf = self.buf
+        p = self.bitpos
+        while True:
+            if (L ^ H) & 0x8000:
+                if L & 0x4000 and not H & 0x4000:
+                    #underflow
+                    C ^= 0x4000
+                    L &= 0x3FFF
+                    H |= 0x4000
+                else:
+                    break
+            L = (L << 1) & 0xFFFF
+            H = ((H << 1) | 1) & 0xFFFF
+            C = ((C << 1) | ((buf[p >> 3] >> (7 - (p & 7))) & 1)) & 0xFFFF
+            p += 1
+        self.bitpos = p
+        self.H, self.L, self.C = H, L, C
+        return sym
+
+    def _read_bits(self, n):
+        if not n:
+            return 0
+        p = self.bitpos
+        v = _QTMBITS.unpack_from(self.buf, p >> 3)[0]
+        self.bitpos = p + n
+        return (v >> (32 - (p & 7) - n)) & ((1 << n) - 1)
+
+    def decompress(self, data, size):
+        #as in other cabinet readers, each frame's input is followed by a 0xFF
+        #byte, which is what the bit reader sees once the payload runs out
+        self.buf = bytearray(data)
+        self.buf += b"\xff" + b"\0" * 8
+        self.bitpos = 0
+        self.H, self.L = 0xFFFF, 0
+        self.C = self._read_bits(16)
+
+        window = self.window
+        window_size = self.window_size
+        posn = start = self.window_posn
+        out = bytearray()
+        todo = size
+        literal_models = self.literal_models
+        symbol = self._symbol
+        read_bits = self._read_bits
+        try:
+            while todo > 0:
+                selector = symbol(self.model7)
+                if selector < 4:
+                    window[posn] = symbol(literal_models[selector])
+                    posn += 1
+                    todo -= 1
+                    if posn == window_size:
+                        out += window[start:]
+                        posn = start = 0
+                    continue
+
+                if selector == 4:
+                    sym = symbol(self.model4)
+                    length = 3
+                elif selector == 5:
+                    sym = symbol(self.model5)
+                    length = 4
+                elif selector == 6:
+                    sym = symbol(self.model6len)
+                    length = _qtm_length_base[sym] + read_bits(_qtm_length_extra[sym]) + 5
+                    sym = symbol(self.model6)
+                else:
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET, "bad Quantum selector")
+                offset = _qtm_position_base[sym] + read_bits(_qtm_extra_bits[sym]) + 1
+                todo -= length
+                if todo < 0:
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET, "Quantum match overruns frame")
+                if offset > window_size:
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET, "Quantum match offset too large")
+                src = posn - offset
+                if src >= 0 and offset >= length and posn + length <= window_size:
+                    window[posn:posn + length] = window[src:src + length]
+                    posn += length
+                    if posn == window_size:
+                        out += window[start:]
+                        posn = start = 0
+                else:
+                    #overlapping, or wrapping around the window
+                    for k in range(length):
+                        window[posn] = window[(posn - offset) & (window_size - 1)]
+                        posn += 1
+                        if posn == window_size:
+                            out += window[start:]
+                            posn = start = 0
+        except IndexError:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "Quantum data overrun")
+        out += window[start:posn]
+        self.window_posn = posn
+        self.buf = None
+        return bytes(out)
+
+_QTMBITS = struct.Struct(">I")
+
+
+#decompressor classes by compression type
+_decompressors = {
+    tcompTYPE_NONE:    NoneDecompressor,
+    tcompTYPE_MSZIP:   MSZIPDecompressor,
+    tcompTYPE_QUANTUM: QuantumDecompressor,
+    tcompTYPE_LZX:     LZXDecompressor,
+}
+
+
+class BlockCache(object):
+    """A least recently used cache of decompressed CFDATA blocks, keyed by
+    (cabinet identity, folder, block), holding at most budget bytes.  The
+    module level block_cache is shared by all CabinetFile objects.  hits,
+    misses and evictions count the lookups and dropped blocks.
+    """
+    def __init__(self, budget=32 * 1024 * 1024):
+        self.budget = budget
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._blocks[key] = self._blocks.pop(key) #most recently used
+            return block
+
+    def put(self, key, block):
+        if len(block) > self.budget:
+            return
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._blocks[key] = block
+            self.size += len(block)
+            while self.size > self.budget:
+                key, old = self._blocks.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+    def discard(self, identity):
+        """Drop all blocks of the cabinet with the given identity"""
+        with self._lock:
+            for key in [k for k in self._blocks if k[0] == identity]:
+                self.size -= len(self._blocks.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return the counters and the current size as a dict"""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    blocks=len(self._blocks), size=self.size, budget=self.budget)
+
+    def __repr__(self):
+        return "<BlockCache %d/%d bytes, %d hits, %d misses>" % (self.size, self.budget,
+                                                                 self.hits, self.misses)
+
+block_cache = BlockCache()
+
+def _shared_block_cache():
+    return block_cache
+
+
+class CabinetStats(object):
+    """Counters of the work done by CabinetFile objects, opted into with
+    CabinetFile(..., stats=CabinetStats()).  Each event has a count, a number
+    of bytes and the wall time spent in it:
+
+    io_read      reads of cabinet data, directly or through cabinet.dll
+    io_seek      seeks by cabinet.dll
+    io_write     writes of extracted members and of new cabinets
+    decode       CFDATA blocks decompressed, in uncompressed bytes
+    cache_hit    blocks taken from the block cache instead
+    folder       decompressors started on a folder
+    callback     notifications from cabinet.dll
+    compress     runs of blocks compressed when writing, timed without workers
+    read, extract, manifest, transcode, testcabinet, write
+                 calls of those operations
+
+    hook, if given, is called as hook(event, nbytes, seconds) for each event,
+    to forward them elsewhere.  A CabinetStats may be shared by many cabinets.
+    Work done in worker processes is not counted.
+    """
+    EVENTS = ("io_read", "io_seek", "io_write", "decode", "cache_hit", "folder", "callback",
+              "compress", "read", "extract", "manifest", "transcode", "testcabinet", "write")
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = dict((event, [0, 0, 0.0]) for event in self.EVENTS)
+
+    def record(self, event, nbytes=0, seconds=0.0):
+        with self._lock:
+            counter = self._counters.get(event)
+            if counter is None:
+                counter = self._counters[event] = [0, 0, 0.0]
+            counter[0] += 1
+            counter[1] += nbytes
+            counter[2] += seconds
+        if self.hook is not None:
+            self.hook(event, nbytes, seconds)
+
+    def snapshot(self):
+        """Return the counters as a flat dict, with the keys event_count,
+        event_bytes and event_seconds for each event.
+        """
+        result = {}
+        with self._lock:
+            for event, (n, nbytes, seconds) in self._counters.items():
+                result[event + "_count"] = n
+                result[event + "_bytes"] = nbytes
+                result[event + "_seconds"] = seconds
+        return result
+
+    def __repr__(self):
+        with self._lock:
+            busy = ", ".join("%s=%d" % (event, counter[0])
+                             for event, counter in sorted(self._counters.items()) if counter[0])
+        return "<CabinetStats %s>" % (busy or "idle")
+
+
+def _timed(event):
+    #a decorator recording the wall time of a CabinetFile method in its stats
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if stats is None:
+                return method(self, *args, **kwargs)
+            t = _clock()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats.record(event, 0, _clock() - t)
+        return wrapper
+    return decorator
+
+
+class FolderIndex(object):
+    """The CFDATA blocks of a folder.  offsets and cbData locate each block's
+    payload in the file and csums are their stored checksums.  uoffsets holds
+    the uncompressed offset of each block followed by the folder's total size.
+    checkpoints maps a block number to the decompressor state before that
+    block, spacing is the distance between them.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.offsets = []
+        self.cbData = []
+        self.csums = []
+        self.uoffsets = [0]
+        self.checkpoints = {}
+        self.spacing = 0
+        #for CabinetSet: the volume of each block, and the pieces of blocks
+        #split across volumes
+        self.volumes = []
+        self.parts = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def block_at(self, offset):
+        """Return the number of the block containing an uncompressed offset"""
+        return min(bisect.bisect_right(self.uoffsets, offset) - 1, len(self.offsets))
+
+    def __repr__(self):
+        return "<FolderIndex %d: %d blocks, %d bytes, %d checkpoints>" % (
+            self.folder.index, len(self.offsets), self.uoffsets[-1], len(self.checkpoints))
+
+
+def _errmsg(e):
+    #the message of a CabinetError(code, message) or an I/O error, or the type
+    #and message of any other exception
+    if isinstance(e, CabinetError) and e.args:
+        return str(e.args[-1])
+    if isinstance(e, EnvironmentError):
+        return str(e)
+    return "%s: %s" % (type(e).__name__, e)
+
+_instance_ids = count()
+
+def _makedirs(path):
+    #create a directory and its parents, tolerating concurrent creation
+    if path and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def _folder_job(cls, filename, options, folder_index, members, method, args):
+    """Worker process job: call the method of a cabinet, such as _read_folder,
+    for the members (positions in infolist()) of one folder, with the extra
+    args.  cls is CabinetFile or CabinetSet.
+    """
+    cf = cls(filename, **options)
+    try:
+        d = cf._getdirectory()
+        folder = d.folders[folder_index]
+        infos = [d.infos[i] for i in members]
+        return getattr(cf, method)(folder, infos, *args)
+    finally:
+        cf.close()
+
+_MAX_FOLDER_SIZE = 0xFFFF * CB_MAX_CHUNK #the most a folder's CFDATA blocks can hold
+
+def _compress_blocks(typeCompress, level, history, data):
+    """Compress data into CFDATA blocks of up to CB_MAX_CHUNK bytes each, and
+    return them packed, with their checksums.  history is the data preceding
+    it in the folder, which MSZIP blocks may refer back to.  Worker processes
+    run this for runs of blocks when writing.
+    """
+    blocks = []
+    window = MSZIPDecompressor.HISTORY
+    for i in range(0, len(data), CB_MAX_CHUNK):
+        chunk = data[i:i + CB_MAX_CHUNK]
+        if typeCompress == tcompTYPE_MSZIP:
+            if i >= window:
+                zdict = data[i - window:i]
+            else:
+                zdict = history[len(history) - (window - i):] + data[:i]
+            c = zlib.compressobj(level, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL,
+                                 zlib.Z_DEFAULT_STRATEGY, zdict)
+            payload = b"CK" + c.compress(chunk) + c.flush()
+        else:
+            payload = chunk
+        csum = cfdata_checksum(payload, len(payload), len(chunk))
+        blocks.append(_CFDATA.pack(csum, len(payload), len(chunk)))
+        blocks.append(payload)
+    return b"".join(blocks)
+
+def _encode_name(name, attribs):
+    #the bytes of a member name and its attributes, flagged if not ascii
+    if not isinstance(name, bytes):
+        try:
+            name = name.encode("ascii")
+        except UnicodeError:
+            return name.encode("utf-8"), attribs | _A_NAME_IS_UTF
+    return name, attribs & ~_A_NAME_IS_UTF
+
+def _current(pname, info, incremental):
+    """Whether the file at pname already holds a member: True if it has the
+    member's size and time, or for incremental="content" if it has the size
+    and None when its contents need comparing, else False.
+    """
+    try:
+        st = os.stat(pname)
+    except OSError:
+        return False
+    if not stat.S_ISREG(st.st_mode) or st.st_size != info.file_size:
+        return False
+    if incremental == "content":
+        return None if info.file_size else True
+    return EncodeFATTime(time.localtime(st.st_mtime)) == (info.fat_date, info.fat_time)
+
+def _settime(pname, info):
+    #give an extracted file the member's time, if it is a valid one
+    try:
+        mtime = time.mktime(tuple(info.date_time) + (0, 0, -1))
+        os.utime(pname, (mtime, mtime))
+    except (OverflowError, ValueError, OSError):
+        pass
+
+def _member_filter(names):
+    """Return a function telling whether a member name is selected by names:
+    a name, a glob pattern with '*' or '?', which ignores case like
+    DirectoryCache.search(), a compiled regular expression, which is searched
+    for in the name, or a list or set of these.
+    """
+    if isinstance(names, string_types) or hasattr(names, "search"):
+        names = [names]
+    exact = set()
+    patterns = []
+    globs = []
+    for name in names:
+        if hasattr(name, "search"):
+            patterns.append(name)
+        elif "*" in name or "?" in name:
+            globs.append(_glob(name))
+        else:
+            exact.add(name)
+    if not patterns and not globs:
+        return exact.__contains__
+    def selected(name):
+        if name in exact or any(p.search(name) for p in patterns):
+            return True
+        folded = _fold(name)
+        return any(g.match(folded) for g in globs)
+    return selected
+
+_ARCHIVE_FORMATS = {"zip": None, "tar": "", "tar.gz": "gz", "tgz": "gz",
+                    "tar.bz2": "bz2", "tar.xz": "xz"}
+
+def _archive_format(filename):
+    #the archive format for a file name, by its extension, zip by default
+    name = filename.lower() if isinstance(filename, string_types) else ""
+    for format in sorted(_ARCHIVE_FORMATS, key=len, reverse=True):
+        if name.endswith("." + format):
+            return format
+    return "zip"
+
+def _posix_mode(attribs):
+    #unix permissions for the attributes of a member
+    mode = 0o444 if attribs & _A_RDONLY else 0o644
+    if attribs & _A_EXEC:
+        mode |= 0o111
+    return mode
+
+def _member_parts(name):
+    """Split a member name into its path components, dropping any drive
+    letter, leading separators and '..' components, so that it stays inside
+    the directory or archive it is extracted to.
+    """
+    parts = name.replace("\\", "/").split("/")
+    parts[0] = ntpath.splitdrive(parts[0])[1]
+    return [p for p in parts if p not in ("", ".", "..")]
+
+def _targetpath(target, name):
+    """Return the path to extract a member to"""
+    return os.path.join(target, *_member_parts(name))
+
+
+def _probe(source, offset=0, strict=False):
+    """Return the CabinetDirectory header of a cabinet at offset in a source,
+    or None if there is none.  The CFHEADER is checked before anything else is
+    read.  If strict, the cabinet must also fit in the source, which weeds out
+    chance "MSCF" bytes when searching.
+    """
+    hdr = bytes(source.read_at(offset, _CFHEADER.size))
+    if len(hdr) < _CFHEADER.size or hdr[:4] != CAB_SIGNATURE:
+        return None
+    (sig, reserved1, cbCabinet, reserved2, coffFiles, reserved3, versionMinor,
+     versionMajor, cFolders, cFiles, flags, setID, iCabinet) = _CFHEADER.unpack(hdr)
+    if versionMajor != 1:
+        return None
+    if strict:
+        if reserved1 or reserved2 or reserved3 or flags & ~0x7 or \
+                not _CFHEADER.size <= coffFiles <= cbCabinet <= source.size() - offset:
+            return None
+    try:
+        d = read_directory(lambda pos, size: source.read_at(offset + pos, size), header_only=True)
+    except CabinetError:
+        return None
+    if strict and any(f.coffCabStart > cbCabinet for f in d.folders):
+        return None
+    return d
+
+def is_cabinetfile(filename):
+    """Returns True if the given file is a cabinet.
+    The argument can be a filename, a file object or a buffer.  The header is
+    checked natively, the result is a FDICABINETINFO structure or False.
+    """
+    source = open_source(filename, use_mmap=False)
+    try:
+        d = _probe(source)
+        return d.cabinetinfo() if d is not None else False
+    finally:
+        if source is not filename:
+            source.close()
+
+def _signature_offsets(source):
+    #yield the offset of each "MSCF" in a source
+    find = getattr(source, "buf", None)
+    find = getattr(find, "find", None) #mmap and bytes search directly
+    if find is not None:
+        pos = find(CAB_SIGNATURE)
+        while pos >= 0:
+            yield pos
+            pos = find(CAB_SIGNATURE, pos + 1)
+        return
+    chunk = 1024 * 1024
+    pos = 0
+    while True:
+        data = bytes(source.read_at(pos, chunk + len(CAB_SIGNATURE) - 1))
+        i = data.find(CAB_SIGNATURE)
+        while i >= 0:
+            yield pos + i
+            i = data.find(CAB_SIGNATURE, i + 1)
+        if len(data) <= chunk:
+            return
+        pos += chunk
+
+def find_cabinets(filename, embedded=True):
+    """Return a list of (offset, FDICABINETINFO) for the cabinets in a file,
+    given as a file name, file object or buffer.  If embedded is true, they
+    are searched for at any offset, as in self extracting executables, else
+    only a cabinet at offset 0 is found.  An embedded cabinet can be read with
+    CabinetFile(buf[offset:offset + info.cbCabinet]).
+    """
+    source = open_source(filename, use_mmap=embedded)
+    try:
+        offsets = _signature_offsets(source) if embedded else [0]
+        found = []
+        for offset in offsets:
+            d = _probe(source, offset, strict=embedded)
+            if d is not None:
+                found.append((offset, d.cabinetinfo()))
+        return found
+    finally:
+        if source is not filename:
+            source.close()
+
+def _scan_file(path, embedded):
+    #the cabinets in a file, or none if it cannot be read
+    try:
+        return find_cabinets(path, embedded)
+    except EnvironmentError:
+        return []
+
+def _walk(paths, followlinks):
+    #the files in paths, which may be files or directory trees
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path, followlinks=followlinks):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    yield os.path.join(dirpath, name)
+        elif os.path.exists(path):
+            yield path
+
+def scan(paths, embedded=True, workers=None, followlinks=False):
+    """Search files and directory trees for cabinets, yielding a
+    (path, offset, FDICABINETINFO) tuple for each one as it is found.  paths is
+    a path or a list of them.  Files are searched by a pool of workers threads,
+    one per CPU if None, and memory mapped to find embedded cabinets.  With
+    embedded false only the start of each file is checked.  Files that cannot
+    be read are skipped.
+    """
+    if isinstance(paths, string_types):
+        paths = [paths]
+    files = _walk(paths, followlinks)
+    if workers is None:
+        workers = _cpu_count()
+    if workers <= 1 or futures is None:
+        for path in files:
+            for offset, info in _scan_file(path, embedded):
+                yield path, offset, info
+        return
+    #results are yielded in walk order, with a few files queued per worker
+    with futures.ThreadPoolExecutor(workers) as pool:
+        jobs = []
+        for path in files:
+            jobs.append((path, pool.submit(_scan_file, path, embedded)))
+            while len(jobs) > 4 * workers or (jobs and jobs[0][1].done()):
+                done, job = jobs.pop(0)
+                for offset, info in job.result():
+                    yield done, offset, info
+        for path, job in jobs:
+            for offset, info in job.result():
+                yield path, offset, info
+
+
+class CabinetFile(object):
+    """A class for reading cabinets.  Similar to zipfile.ZipFile.
+    Only single-file cabinets are supported, use CabinetSet for spanned sets.
+
+    The cabinet may be given as a file name, a file object or any object
+    supporting the buffer protocol, such as bytes.  Files given by name are
+    memory mapped unless use_mmap is false.  Compressed data is not copied
+    when reading from a buffer or a memory map.
+
+    Reading a member decodes its folder from the nearest checkpoint before it.
+    A checkpoint of the decompressor state is saved every checkpoint_interval
+    CFDATA blocks, or further apart if needed to keep all of them within
+    checkpoint_memory bytes.  Set checkpoint_memory to 0 to disable them.
+
+    cache may be a DirectoryCache, in which case the directory of a cabinet
+    given by name is taken from it when the file is unchanged.
+
+    Decompressed blocks are kept in block_cache, by default the module level
+    BlockCache shared by all CabinetFile objects.  Pass False to disable it.
+
+    stats may be a CabinetStats, which then counts the I/O, decoding and other
+    work done for this cabinet.
+
+    With mode 'w' a new cabinet is created, and the members added with write()
+    and writestr() are compressed into it when it is closed.  compression is
+    tcompTYPE_MSZIP or tcompTYPE_NONE.  A new folder is started once a folder
+    holds folder_size bytes, and blocks are compressed by workers processes,
+    or threads with executor "thread", one per CPU if workers is None.  A file
+    object to write to must be seekable.
+    """
+    def __init__(self, filename, mode='r', checkpoint_interval=16,
+                 checkpoint_memory=64 * 1024 * 1024, use_mmap=True, cache=None,
+                 block_cache=None, compression=tcompTYPE_MSZIP, compresslevel=6,
+                 folder_size=None, workers=1, executor="process", stats=None):
+        self.mode = mode
+        self.hfdi = None
+        self._source = None
+        self._fp = None
+        self._filePassed = not isinstance(filename, string_types)
+        self._directory = None
+        self._indexes = {}
+        self.checkpoint_interval = max(1, checkpoint_interval)
+        self.checkpoint_memory = checkpoint_memory
+        self._checkpoint_bytes = 0
+        self.use_mmap = use_mmap
+        self.cache = cache
+        if block_cache is None:
+            block_cache = _shared_block_cache()
+        elif block_cache is False:
+            block_cache = None
+        self.block_cache = block_cache
+        self.stats = stats
+        self._identity_key = None
+        self._lock = threading.RLock()
+        self._fdi_lock = threading.Lock()
+        #checked after the attributes close() needs, as __del__ calls it anyway
+        if mode not in ("r", "w"):
+            raise ValueError("mode must be 'r' or 'w', not %r" % (mode,))
+        if mode == "w":
+            self._init_writer(filename, compression, compresslevel, folder_size,
+                              workers, executor)
+            return
+        self.a = FDIAllocator()
+        self.e = ERF()
+
+        self.f, self.filename = FileManager(filename)
+        self.f.stats = stats
+        if self._filePassed:
+            self._source = self.f.file
+        self.head, self.tail = os.path.split(os.path.normpath(self.filename))
+        if self.head:
+            self.head += "\\"
+        if not PY2:
+            self.head = self.head.encode(sys.getfilesystemencoding())
+            self.tail = self.tail.encode(sys.getfilesystemencoding())
+            
+        if FDICreate:
+            self.hfdi = FDICreate(self.a.malloc, self.a.free,
+                                  self.f.open, self.f.read, self.f.write, self.f.close, self.f.seek,
+                                  0, byref(self.e))
+
+    def __del__(self):
+        #must have a del method to ensure that we call FDIDestroy.  A cabinet
+        #being written that was never closed is left unfinished.
+        if not hasattr(self, "_fdi_lock"):
+            return #__init__ failed before there was anything to close
+        if self._fp is not None:
+            fp, self._fp = self._fp, None
+            if not self._filePassed:
+                fp.close()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the cabinet.  In mode 'w' this writes it."""
+        if self._fp is not None:
+            fp = self._fp
+            try:
+                self._write_cabinet(fp)
+            finally:
+                self._fp = None
+                if not self._filePassed:
+                    fp.close()
+        if self.hfdi and FDIDestroy: #module is not being torn down
+            FDIDestroy(self.hfdi)
+        self.hfdi = None
+        if self.block_cache is not None and self._filePassed and self._identity_key is not None:
+            #nobody else can use these blocks
+            self.block_cache.discard(self._identity_key)
+            self._identity_key = None
+        if self._source is not None and not self._filePassed:
+            self._source.close()
+            self._source = None
+
+    def _identity(self):
+        """A key identifying the contents of this cabinet in the block cache.
+        Cabinets opened by name share it while the file is unchanged.
+        """
+        if self._identity_key is None:
+            if self._filePassed:
+                self._identity_key = ("object", next(_instance_ids))
+            else:
+                self._identity_key = _file_key(self.filename)
+        return self._identity_key
+
+    def _getsource(self):
+        source = self._source
+        if source is None:
+            with self._lock:
+                if self._source is None:
+                    self._source = open_source(self.filename, self.use_mmap)
+                source = self._source
+        return source
+
+    def _read_at(self, offset, size):
+        return self._read_source(self._getsource(), offset, size)
+
+    def _read_source(self, source, offset, size):
+        #read from a source, counting it in the stats
+        stats = self.stats
+        if stats is None:
+            return source.read_at(offset, size)
+        t = _clock()
+        data = source.read_at(offset, size)
+        stats.record("io_read", len(data), _clock() - t)
+        return data
+
+    def _getdirectory(self):
+        #the directory is parsed once, on first use, or taken from the cache
+        if self.mode != "r":
+            raise ValueError("reading a cabinet requires mode 'r'")
+        if self._directory is None:
+            with self._lock:
+                if self._directory is None:
+                    d = None
+                    if self.cache is not None and not self._filePassed:
+                        d = self.cache.lookup(self.filename)
+                    if d is None:
+                        d = read_directory(self._read_at)
+                        if self.cache is not None and not self._filePassed:
+                            self.cache.store(self.filename, d)
+                    self._directory = d
+        return self._directory
+
+    def __FDICopy(self, callback):
+        #perform the actual fdicopy call, catching exceptions etc.
+        if not self.hfdi:
+            raise NotImplementedError("cabinet.dll is not available")
+        excinfo = []
+        stats = self.stats
+        def wrap(fdint, pnotify):
+            t = _clock()
+            try:
+                return callback(fdint, pnotify)
+            except Exception:
+                excinfo[:] = sys.exc_info()
+                return -1
+            finally:
+                if stats is not None:
+                    stats.record("callback", 0, _clock() - t)
+
+        with self._fdi_lock: #an FDI context is not reentrant
+            self.e.clear()
+            r = FDICopy(self.hfdi, self.tail, self.head, 0, PFNFDINOTIFY(wrap), None, None)
+            if not r:
+                if excinfo:
+                    raise excinfo[1]
+                self.f.raise_error() #maybe it is a filer error
+                self.e.raise_error() #or an error in the error state
+        return r
+
+    def namelist(self):
+        """Return a list of file names in the archive."""
+        return self._getdirectory().infos.names()
+
+    def infolist(self):
+        """Return a list of class CabinetInfo instances for files in the
+        archive.
+        """
+        return list(self._getdirectory().infos)
+
+    def select(self, names):
+        """Return the names of the members selected by names, in cabinet order.
+        names is a name, a glob pattern such as "*.dll", a compiled regular
+        expression, or a list or set of these, as for extract().
+        """
+        selected = _member_filter(names)
+        return [name for name in self._getdirectory().infos.names() if selected(name)]
+        
+    def printdir(self):
+        """Print a table of contents for the archive."""
+        print("%-46s %19s %12s" % ("File Name", "Modified    ", "Size"))
+        for cinfo in self.infolist():
+            date = "%d-%02d-%02d %02d:%02d:%02d" % cinfo.date_time
+            print("%-46s %s %12d" % (cinfo.filename, date, cinfo.file_size))
+
+    def getinfo(self, name):
+        """Return the instance of CabinetInfo given 'name'."""
+        return self._getdirectory().infos.get(name)
+
+    def _native(self, folders):
+        #can we decode these folders ourselves, or do we need cabinet.dll?
+        for folder in folders:
+            if CompressionTypeFromTCOMP(folder.typeCompress) not in _decompressors:
+                if self.hfdi:
+                    return False
+                raise CabinetError(FDIERROR_BAD_COMPR_TYPE,
+                                   "unsupported compression type %x"%folder.typeCompress)
+        return True
+
+    def getindex(self, folder):
+        """Return the FolderIndex of a folder, or of the folder with that index,
+        reading the CFDATA headers on first use.
+        """
+        if not isinstance(folder, CabinetFolder):
+            folder = self._getdirectory().folders[folder]
+        index = self._indexes.get(folder.index)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(folder.index)
+                if index is None:
+                    index = self._indexes[folder.index] = self._build_index(folder)
+        return index
+
+    def _block_parts(self, index, i):
+        """Return the CFDATA records making up block i of a folder index, as
+        (source, offset, cbData, cbUncomp, csum) tuples.  Only blocks split
+        across the volumes of a CabinetSet have more than one.
+        """
+        return [(self._getsource(), index.offsets[i], index.cbData[i],
+                 index.uoffsets[i + 1] - index.uoffsets[i], index.csums[i])]
+
+    def _read_block(self, index, i):
+        #return the payload of block i
+        pieces = []
+        for source, offset, cbData, cbUncomp, csum in self._block_parts(index, i):
+            data = self._read_source(source, offset, cbData)
+            if len(data) < cbData:
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "truncated CFDATA block")
+            pieces.append(data)
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+    def _save_checkpoint(self, index, i, decomp):
+        #store the decompressor state before block i, if the budget allows
+        with self._lock:
+            if i not in index.checkpoints and \
+                    self._checkpoint_bytes + decomp.statesize <= self.checkpoint_memory:
+                index.checkpoints[i] = decomp.getstate()
+                self._checkpoint_bytes += decomp.statesize
+
+    def _build_index(self, folder):
+        d = self._getdirectory()
+        advise = getattr(self._getsource(), "advise", None)
+        if advise is not None:
+            #the folder's blocks run up to the next folder
+            ends = [f.coffCabStart for f in d.folders if f.coffCabStart > folder.coffCabStart]
+            advise(folder.coffCabStart, min(ends or [d.cbCabinet]) - folder.coffCabStart)
+        hsize = _CFDATA.size + d.cbCFData
+        index = FolderIndex(folder)
+        pos = folder.coffCabStart
+        for i in range(folder.cCFData):
+            hdr = self._read_at(pos, _CFDATA.size)
+            if len(hdr) < _CFDATA.size:
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "truncated CFDATA header")
+            csum, cbData, cbUncomp = _CFDATA.unpack(hdr)
+            pos += hsize
+            index.offsets.append(pos)
+            index.cbData.append(cbData)
+            index.csums.append(csum)
+            index.uoffsets.append(index.uoffsets[-1] + cbUncomp)
+            pos += cbData
+        return index
+
+    def _decoder_at(self, folder, index, i):
+        """Return a new decompressor for a folder and the number of the block
+        it is positioned at, the nearest checkpoint at or before block i.
+        """
+        decomp = _decompressors[CompressionTypeFromTCOMP(folder.typeCompress)](folder.typeCompress)
+        statesize = getattr(decomp, "statesize", None)
+        if statesize == 0:
+            return decomp, i #stateless, any block will do
+        if statesize is None:
+            return decomp, 0
+        if not index.spacing:
+            #space the checkpoints so that the whole folder fits the budget
+            budget = max(self.checkpoint_memory, 1)
+            index.spacing = max(self.checkpoint_interval, len(index) * statesize // budget + 1)
+        first = i - i % index.spacing
+        while first and first not in index.checkpoints:
+            first -= index.spacing
+        if first:
+            decomp.setstate(index.checkpoints[first])
+        return decomp, first
+
+    def _iter_folder(self, folder, start=0):
+        """Yield the decompressed blocks of a folder from block 'start' on.
+        Blocks are taken from the block cache when possible.  Otherwise decoding
+        resumes from the nearest checkpoint and saves new ones on the way.
+        """
+        index = self.getindex(folder)
+        cache = self.block_cache
+        stats = self.stats
+        if cache is not None:
+            key = (self._identity(), folder.index)
+        decomp = None
+        pos = 0 #the block the decompressor is positioned at
+        for i in range(start, len(index)):
+            if cache is not None:
+                block = cache.get(key + (i,))
+                if block is not None:
+                    if stats is not None:
+                        stats.record("cache_hit", len(block))
+                    yield block
+                    continue
+            if decomp is None or pos != i:
+                #after cached blocks, a checkpoint may be closer than the decoder
+                restored, restored_pos = self._decoder_at(folder, index, i)
+                if decomp is None or pos > i or restored_pos > pos:
+                    decomp, pos = restored, restored_pos
+                    statesize = getattr(decomp, "statesize", None)
+                    if stats is not None:
+                        stats.record("folder")
+            while pos <= i:
+                if statesize and pos and not pos % index.spacing and pos not in index.checkpoints \
+                        and self._checkpoint_bytes + statesize <= self.checkpoint_memory:
+                    self._save_checkpoint(index, pos, decomp)
+                data = self._read_block(index, pos)
+                t = _clock()
+                block = decomp.decompress(data, index.uoffsets[pos + 1] - index.uoffsets[pos])
+                if stats is not None:
+                    stats.record("decode", len(block), _clock() - t)
+                if cache is not None:
+                    cache.put(key + (pos,), block)
+                pos += 1
+            yield block
+
+    def _iter_member_data(self, folder, members):
+        """Decode a folder and yield (info, data) pieces of the given members in
+        folder order, followed by (info, None) when a member is complete.
+        Decoding stops after the end of the last member.
+        """
+        pending = []
+        for info in sorted(members, key=lambda i: i.folder_offset):
+            if info.file_size:
+                pending.append(info)
+            else:
+                yield info, None
+        pending.reverse()
+        active = []
+        pos = start = 0
+        if pending:
+            index = self.getindex(folder)
+            start = index.block_at(pending[-1].folder_offset)
+            pos = index.uoffsets[start]
+        blocks = self._iter_folder(folder, start)
+        while pending or active:
+            block = next(blocks, None)
+            if block is None:
+                raise CabinetError(FDIERROR_CORRUPT_CABINET, "member extends past end of folder")
+            view = memoryview(block)
+            end = pos + len(block)
+            while pending and pending[-1].folder_offset < end:
+                active.append(pending.pop())
+            done = []
+            for info in active:
+                start = max(info.folder_offset, pos)
+                stop = min(info.folder_offset + info.file_size, end)
+                if stop > start:
+                    yield info, view[start - pos:stop - pos]
+                if info.folder_offset + info.file_size <= end:
+                    done.append(info)
+            for info in done:
+                active.remove(info)
+                yield info, None
+            pos = end
+
+    def _plan(self, infos):
+        #group members by folder, in folder order
+        d = self._getdirectory()
+        byfolder = {}
+        for info in infos:
+            if info.folder_index >= len(d.folders):
+                raise CabinetError(FDIERROR_WRONG_CABINET,
+                                   "%r continues in another cabinet of the set, use CabinetSet"
+                                   % info.filename)
+            byfolder.setdefault(info.folder_index, []).append(info)
+        return [(d.folders[i], byfolder[i]) for i in sorted(byfolder)]
+
+    def _iter_range(self, folder, start, stop):
+        """Yield the decompressed bytes start..stop of a folder as memoryviews"""
+        if start >= stop:
+            return
+        index = self.getindex(folder)
+        first = index.block_at(start)
+        pos = index.uoffsets[first]
+        for block in self._iter_folder(folder, first):
+            end = pos + len(block)
+            if end > start:
+                yield memoryview(block)[max(start - pos, 0):min(stop, end) - pos]
+            if end >= stop:
+                return
+            pos = end
+        raise CabinetError(FDIERROR_CORRUPT_CABINET, "member extends past end of folder")
+
+    def open(self, name, mode="r"):
+        """Return a readable file-like object for the member name, which may
+        also be a CabinetInfo.  The member is decompressed as it is read.
+        """
+        if mode != "r":
+            raise ValueError("open() requires mode 'r'")
+        info = name if isinstance(name, CabinetInfo) else self.getinfo(name)
+        if info is None:
+            raise KeyError("There is no item named %r in the archive" % name)
+        d = self._getdirectory()
+        if info.folder_index >= len(d.folders):
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "member %r has no folder" % info.filename)
+        folder = d.folders[info.folder_index]
+        if not self._native([folder]):
+            return BytesIO(self._fdi_read([info.filename])[0])
+        return CabinetExtFile(self, folder, info)
+
+    def _read_folder(self, folder, members):
+        #return the data of members of one folder, in the same order
+        data = {}
+        pieces = {}
+        for info, chunk in self._iter_member_data(folder, members):
+            if chunk is None:
+                data[info] = b"".join(pieces.pop(info, []))
+            else:
+                pieces.setdefault(info, []).append(bytes(chunk))
+        return [data[info] for info in members]
+
+    def _extract_folder(self, folder, members, target, incremental=False):
+        """Write members of one folder to the target directory, and return
+        whether each was written.  If incremental, the files get the members'
+        times, and with "content" existing files of the right size are compared
+        with the data and only rewritten from the first difference on.
+        """
+        files = {}
+        written = {}
+        try:
+            for info, chunk in self._iter_member_data(folder, members):
+                f = files.get(info)
+                if f is None:
+                    pname = _targetpath(target, info.filename)
+                    _makedirs(os.path.dirname(pname))
+                    if incremental == "content" and _current(pname, info, incremental) is None:
+                        f = files[info] = open(pname, "r+b")
+                        written[info] = False
+                    else:
+                        f = files[info] = open(pname, "wb")
+                        written[info] = True
+                if chunk is None:
+                    files.pop(info).close()
+                    if incremental:
+                        _settime(_targetpath(target, info.filename), info)
+                    continue
+                if not written[info]:
+                    #still comparing, start writing at the first difference
+                    old = f.read(len(chunk))
+                    if old == chunk:
+                        continue
+                    f.seek(-len(old), 1)
+                    written[info] = True
+                if self.stats is None:
+                    f.write(chunk)
+                else:
+                    t = _clock()
+                    f.write(chunk)
+                    self.stats.record("io_write", len(chunk), _clock() - t)
+        finally:
+            for f in files.values():
+                f.close()
+        return [written[info] for info in members]
+
+    def _options(self):
+        #keyword arguments to reopen this cabinet with in a worker process
+        return dict(checkpoint_interval=self.checkpoint_interval,
+                    checkpoint_memory=self.checkpoint_memory, use_mmap=self.use_mmap)
+
+    def _hash_folder(self, folder, members, algorithms):
+        #return the hex digests of members of one folder, in the same order
+        hashers = {}
+        for info, chunk in self._iter_member_data(folder, members):
+            h = hashers.get(info)
+            if h is None:
+                h = hashers[info] = [hashlib.new(a) for a in algorithms]
+            if chunk is not None:
+                for hasher in h:
+                    hasher.update(chunk)
+        return [tuple(hasher.hexdigest() for hasher in hashers[info]) for info in members]
+
+    def _run_plan(self, plan, method, args, workers, executor):
+        """Call a method such as _read_folder(folder, members, *args) for the
+        members of each folder in plan, in a pool of workers when workers is
+        not 1.  Returns a dict mapping each member's CabinetInfo to its result.
+        """
+        result = {}
+        if workers is None:
+            workers = _cpu_count()
+        workers = min(workers, len(plan))
+        if workers <= 1 or futures is None:
+            for folder, members in plan:
+                result.update(zip(members, getattr(self, method)(folder, members, *args)))
+            return result
+
+        #largest folders first, to balance the load
+        plan = sorted(plan, key=lambda p: -sum(info.file_size for info in p[1]))
+        if executor == "process":
+            if self._filePassed:
+                raise ValueError("process workers need a cabinet file name")
+            table = self._getdirectory().infos
+            options = self._options()
+            pool = futures.ProcessPoolExecutor(workers)
+            submit = lambda folder, members: pool.submit(
+                _folder_job, type(self), self.filename, options, folder.index,
+                table.positions(members), method, args)
+        elif executor == "thread":
+            pool = futures.ThreadPoolExecutor(workers)
+            submit = lambda folder, members: pool.submit(
+                getattr(self, method), folder, members, *args)
+        else:
+            raise ValueError("executor must be 'thread' or 'process', not %r" % (executor,))
+        with pool:
+            jobs = [(submit(folder, members), members) for folder, members in plan]
+            for job, members in jobs:
+                result.update(zip(members, job.result()))
+        return result
+
+    def read(self, name):
+        """Return file bytes (as a string) for name.  name may also be a list
+        of names, in which case a list of strings is returned.
+        """
+        result = self.read_many([name] if isinstance(name, string_types) else name)
+        return result[0] if isinstance(name, string_types) else result
+
+    @_timed("read")
+    def read_many(self, names, workers=1, executor="thread"):
+        """Return a list with the bytes of each of names, which may come from
+        select().  Only the folders holding them are decoded, each up to the end
+        of its last member, in parallel by the given number of workers, one per
+        CPU if None.  executor is "thread" or "process".  Process workers reopen
+        the cabinet by its file name.
+        """
+        names = list(names)
+        infos = []
+        for n in names:
+            info = self.getinfo(n)
+            if info is None:
+                raise KeyError("There is no item named %r in the archive" % n)
+            infos.append(info)
+        plan = self._plan(set(infos))
+        if not self._native([folder for folder, members in plan]):
+            return self._fdi_read(names)
+        data = self._run_plan(plan, "_read_folder", (), workers, executor)
+        return [data.get(info, b"") for info in infos]
+
+    def _members(self, names):
+        #the CabinetInfo of the members selected by names, else of all those
+        #stored in this cabinet
+        d = self._getdirectory()
+        if names:
+            selected = _member_filter(names)
+            return [d.infos[i] for i, name in enumerate(d.infos.names()) if selected(name)]
+        return [d.infos[i] for i, f in enumerate(d.infos.folders) if f < len(d.folders)]
+
+    @_timed("extract")
+    def extract(self, target, names=[], workers=1, executor="thread", incremental=False):
+        """extract files into a target directory.
+        Optionally, the members to extract may be selected with names, as for
+        select().  Only the folders holding them are decoded, each up to the
+        end of its last selected member.  workers and executor are as
+        for read_many(), each worker writes its members directly to target.
+        If incremental is true, members whose file already has their size and
+        time are skipped, and folders with nothing to write are not decoded.
+        incremental="content" compares the data of files of the right size
+        instead of the time.  Returns an ExtractReport.
+        """
+        infos = self._members(names)
+        report = ExtractReport()
+        if incremental:
+            current = [_current(_targetpath(target, info.filename), info, incremental)
+                       for info in infos]
+            report.skipped = [info.filename for info, c in zip(infos, current) if c]
+            infos = [info for info, c in zip(infos, current) if not c]
+        if not infos:
+            return report
+        plan = self._plan(infos)
+        if not self._native([folder for folder, members in plan]):
+            self._fdi_extract(target, set(info.filename for info in infos))
+            report.written = [info.filename for info in infos]
+            return report
+        written = self._run_plan(plan, "_extract_folder", (target, incremental), workers,
+                                 executor)
+        for info in infos:
+            (report.written if written[info] else report.skipped).append(info.filename)
+        return report
+
+    @_timed("manifest")
+    def manifest(self, algorithms=("sha256",), names=None, workers=1, executor="thread"):
+        """Return a list of (CabinetInfo, digests) for the members, in cabinet
+        order, where digests maps each of the hashlib algorithms to the hex
+        digest of the member's data.  Each folder is decoded once and hashed as
+        it is decoded, without holding the members in memory.  names selects
+        members as for select(), workers and executor are as for read_many().
+        """
+        if isinstance(algorithms, string_types):
+            algorithms = (algorithms,)
+        algorithms = tuple(algorithms)
+        for algorithm in algorithms:
+            hashlib.new(algorithm) #unknown algorithms raise ValueError here
+        infos = self._members(names)
+        plan = self._plan(infos)
+        if self._native([folder for folder, members in plan]):
+            digests = self._run_plan(plan, "_hash_folder", (algorithms,), workers, executor)
+        else:
+            data = self._fdi_read([info.filename for info in infos])
+            digests = dict((info, tuple(hashlib.new(a, d).hexdigest() for a in algorithms))
+                           for info, d in zip(infos, data))
+        return [(info, dict(zip(algorithms, digests[info]))) for info in infos]
+
+    def _iter_member_chunks(self, folder, members):
+        """Yield (info, chunks) for the members of one folder, in folder order,
+        where chunks iterates over the member's data.  Each must be consumed
+        before the next is taken.  Members sharing data are read separately.
+        """
+        members = sorted(members, key=lambda i: i.folder_offset)
+        end = 0
+        for info in members:
+            if info.file_size and info.folder_offset < end:
+                #overlapping members, rare enough to decode each on its own
+                for info in members:
+                    f = self.open(info)
+                    yield info, iter(lambda: f.read(CB_MAX_CHUNK), b"")
+                return
+            end = max(end, info.folder_offset + info.file_size)
+        data = [info for info in members if info.file_size]
+        if not data:
+            for info in members:
+                yield info, iter(())
+            return
+        index = self.getindex(folder)
+        first = index.block_at(data[0].folder_offset)
+        blocks = self._iter_folder(folder, first)
+        current = [memoryview(b""), index.uoffsets[first]] #a block and its offset
+        def chunks(start, stop):
+            while start < stop:
+                block, pos = current
+                if pos + len(block) <= start:
+                    block = next(blocks, None)
+                    if block is None:
+                        raise CabinetError(FDIERROR_CORRUPT_CABINET,
+                                           "member extends past end of folder")
+                    current[:] = [memoryview(block), pos + len(current[0])]
+                    continue
+                piece = block[start - pos:min(stop, pos + len(block)) - pos]
+                yield piece
+                start += len(piece)
+        for info in members:
+            member = chunks(info.folder_offset, info.folder_offset + info.file_size)
+            yield info, member
+            for chunk in member:
+                pass #in case it was not read to the end
+
+    @_timed("transcode")
+    def transcode(self, output, format=None, names=None, compression=zipfile.ZIP_DEFLATED):
+        """Write the members to a zip or tar archive, decoding each folder once
+        and streaming the data into the archive, without temporary files.
+        output is a file name or a writable file object, which need not be
+        seekable.  format is "zip", "tar", "tar.gz", "tar.bz2" or "tar.xz",
+        by default from the extension of output, else "zip".  compression is
+        the zipfile compression method.  names selects members as for
+        select().  Names, made safe to extract like those of extract(), times
+        and attributes are kept.  Returns the number of members written.
+        """
+        if format is None:
+            format = _archive_format(output)
+        if format not in _ARCHIVE_FORMATS:
+            raise ValueError("unknown archive format %r" % (format,))
+        infos = self._members(names)
+        plan = self._plan(infos)
+        if format == "zip":
+            archive = zipfile.ZipFile(output, "w", compression, allowZip64=True)
+        else:
+            mode = "w|" + _ARCHIVE_FORMATS[format] #a stream, output need not seek
+            if isinstance(output, string_types):
+                archive = tarfile.open(output, mode)
+            else:
+                archive = tarfile.open(fileobj=output, mode=mode)
+        count = 0
+        with archive:
+            for folder, members in plan:
+                if self._native([folder]):
+                    streams = self._iter_member_chunks(folder, members)
+                else:
+                    streams = ((info, [self._fdi_read([info.filename])[0]]) for info in members)
+                for info, chunks in streams:
+                    name = "/".join(_member_parts(info.filename))
+                    if not name:
+                        continue #nothing left of the name to store it under
+                    count += 1
+                    perms = _posix_mode(info.external_attr)
+                    if format == "zip":
+                        zinfo = zipfile.ZipInfo(name, tuple(info.date_time))
+                        zinfo.compress_type = compression
+                        zinfo.create_system = 3 #unix, so the permissions are used
+                        dosattrs = info.external_attr & (_A_RDONLY | _A_HIDDEN | _A_SYSTEM | _A_ARCH)
+                        zinfo.external_attr = (stat.S_IFREG | perms) << 16 | dosattrs
+                        zinfo.file_size = info.file_size #for the zip64 decision
+                        if PY2:
+                            archive.writestr(zinfo, b"".join(bytes(c) for c in chunks))
+                            continue
+                        with archive.open(zinfo, "w") as f:
+                            for chunk in chunks:
+                                f.write(chunk)
+                    else:
+                        tinfo = tarfile.TarInfo(name)
+                        tinfo.size = info.file_size
+                        tinfo.mode = perms
+                        try:
+                            tinfo.mtime = int(time.mktime(tuple(info.date_time) + (0, 0, -1)))
+                        except (OverflowError, ValueError):
+                            pass
+                        archive.addfile(tinfo, _ChunkReader(chunks))
+        return count
+
+    @_timed("testcabinet")
+    def testcabinet(self, checksums=True, decompress=True):
+        """verify that the archive is ok.  Returns a CabinetReport, which is
+        true if no problems were found.  If checksums is true, the CFDATA
+        checksums are verified.  If decompress is false, the folders are not
+        decoded and only the structure of the cabinet is checked.
+        """
+        report = CabinetReport()
+        try:
+            d = self._getdirectory()
+            if decompress and not self._native(d.folders):
+                if not self._fdi_testcabinet():
+                    report.errors.append("FDICopy failed")
+                decompress = False
+        except Exception as e:
+            #a damaged cabinet is reported, whatever the parser raised
+            report.errors.append(_errmsg(e))
+            return report
+        for folder in d.folders:
+            report.folders.append(self._testfolder(folder, checksums, decompress))
+        return report
+
+    def _testfolder(self, folder, checksums, decompress):
+        result = FolderReport(folder)
+        try:
+            index = self.getindex(folder)
+        except Exception as e:
+            result.errors.append(_errmsg(e))
+            return result
+        decomp = None
+        stats = self.stats
+        if decompress:
+            try:
+                decomp = _decompressors[CompressionTypeFromTCOMP(folder.typeCompress)](
+                    folder.typeCompress)
+            except Exception as e:
+                result.errors.append(_errmsg(e)) #the checksums are still checked
+            else:
+                if stats is not None:
+                    stats.record("folder")
+        for i in range(len(index)):
+            cbUncomp = index.uoffsets[i + 1] - index.uoffsets[i]
+            block = BlockReport(i, index.offsets[i], index.cbData[i], cbUncomp, index.csums[i])
+            result.blocks.append(block)
+            if cbUncomp > CB_MAX_CHUNK:
+                block.errors.append("uncompressed size %d too large" % cbUncomp)
+            try:
+                pieces = []
+                truncated = False
+                for source, offset, cbData, partUncomp, csum in self._block_parts(index, i):
+                    if offset + cbData > source.size():
+                        truncated = True
+                        break
+                    if not checksums and not decomp:
+                        continue
+                    data = self._read_source(source, offset, cbData)
+                    pieces.append(data)
+                    if checksums and csum:
+                        checksum = cfdata_checksum(data, cbData, partUncomp)
+                        if block.checksum is None:
+                            block.checksum = checksum
+                        if checksum != csum:
+                            block.errors.append("checksum mismatch")
+                if truncated:
+                    block.errors.append("truncated block")
+                    break
+                if decomp:
+                    t = _clock()
+                    decomp.decompress(pieces[0] if len(pieces) == 1 else b"".join(pieces),
+                                      cbUncomp)
+                    if stats is not None:
+                        stats.record("decode", cbUncomp, _clock() - t)
+            except Exception as e:
+                block.errors.append(_errmsg(e))
+                decomp = None #the decoder state is lost, stop decoding
+        for info in self._getdirectory().infos.in_folder(folder.index):
+            if info.folder_offset + info.file_size > index.uoffsets[-1]:
+                result.errors.append("member %r extends past end of folder" % info.filename)
+        return result
+
+    def _fdi_read(self, names):
+        #read the named members with FDICopy
+        result = {}
+        wanted = set(names)
+        def callback(fdint, pnotify):
+            notify = pnotify.contents
+            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
+                return 0
+            if fdint == fdintCOPY_FILE:
+                name = _decode_name(notify.psz1, notify.attribs)
+                if name in wanted and name not in result:
+                    sio = BytesIO()
+                    sio.name = name
+                    fd = self.f.map(sio)
+                    return fd #signals that we want to copy!
+                return 0 #don't copy
+            if fdint == fdintCLOSE_FILE_INFO:
+                sio = self.f.unmap(notify.hf)
+                result[sio.name] = sio.getvalue() #store the file outside
+                return 1
+            return -1
+
+        self.__FDICopy(callback)
+        return [result.get(n, b"") for n in names]
+        
+    def _fdi_extract(self, target, names):
+        def callback(fdint, pnotify):
+            notify = pnotify.contents
+            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
+                return 0
+            if fdint == fdintCOPY_FILE:
+                name = _decode_name(notify.psz1, notify.attribs)
+                if not names or name in names:
+                    pname = _targetpath(target, name)
+                    _makedirs(os.path.dirname(pname))
+                    f = open(pname, "wb")
+                    return self.f.map(f)
+                return 0
+            if fdint == fdintCLOSE_FILE_INFO:
+                f = self.f.unmap(notify.hf)
+                f.close()
+                return 1
+            return -1
+            
+        self.__FDICopy(callback)
+
+    def _fdi_testcabinet(self):
+        def callback(fdint, pnotify):
+            #read and discard all data
+            notify = pnotify.contents
+            if fdint in [fdintCABINET_INFO, fdintENUMERATE]:
+                return 0
+            if fdint == fdintCOPY_FILE:
+                sio = BytesIO()
+                fd = self.f.map(sio)
+                return fd #signals that we want to copy!
+            if fdint == fdintCLOSE_FILE_INFO:
+                sio = self.f.unmap(notify.hf)
+                sio.close()
+                return 1
+            return -1
+
+        return self.__FDICopy(callback) != 0
+
+    #writing
+
+    def _init_writer(self, filename, compression, compresslevel, folder_size,
+                     workers, executor):
+        if compression not in (tcompTYPE_NONE, tcompTYPE_MSZIP):
+            raise ValueError("only MSZIP and uncompressed cabinets can be written")
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be 'thread' or 'process', not %r" % (executor,))
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.folder_size = folder_size
+        self.workers = workers
+        self.executor = executor
+        self._pending = [] #(CabinetInfo, file name or data) to write on close
+        if self._filePassed:
+            self._fp = filename
+            self.filename = getattr(filename, "name", "_file_")
+        else:
+            self._fp = open(filename, "wb")
+            self.filename = filename
+
+    def _add(self, info, source):
+        if self._fp is None:
+            raise ValueError("write() requires mode 'w' and an open cabinet")
+        if info.file_size > _MAX_FOLDER_SIZE:
+            raise ValueError("%r is too large for a cabinet" % info.filename)
+        if len(self._pending) == 0xFFFF:
+            raise ValueError("a cabinet holds at most 65535 files")
+        self._pending.append((info, source))
+
+    def _new_info(self, arcname, date_time, attribs):
+        #normalize the member name to the cabinet's backslash separators
+        arcname = os.path.splitdrive(arcname)[1].replace(os.sep, "\\").replace("/", "\\")
+        arcname = arcname.lstrip("\\")
+        if not arcname or len(_encode_name(arcname, 0)[0]) >= CB_MAX_FILENAME:
+            raise ValueError("bad member name %r" % arcname)
+        info = CabinetInfo(arcname, tuple(date_time[:6]))
+        info.external_attr = attribs
+        info.fat_date, info.fat_time = EncodeFATTime(date_time)
+        return info
+
+    def write(self, filename, arcname=None):
+        """Add the file filename to the cabinet as arcname, by default its
+        path.  The file is read when the cabinet is closed.
+        """
+        st = os.stat(filename)
+        if not os.path.isfile(filename):
+            raise ValueError("%r is not a file" % filename)
+        attribs = _A_ARCH
+        if not os.access(filename, os.W_OK):
+            attribs |= _A_RDONLY
+        if os.access(filename, os.X_OK) and os.name != "nt":
+            attribs |= _A_EXEC
+        info = self._new_info(filename if arcname is None else arcname,
+                              time.localtime(st.st_mtime), attribs)
+        info.file_size = st.st_size
+        self._add(info, filename)
+
+    def writestr(self, name, data):
+        """Add a member holding the bytes data.  name may also be a CabinetInfo,
+        giving the date_time and external_attr of the member.
+        """
+        if isinstance(name, CabinetInfo):
+            info = self._new_info(name.filename, name.date_time or time.localtime(),
+                                  name.external_attr)
+        else:
+            info = self._new_info(name, time.localtime(), _A_ARCH)
+        data = memoryview(data)
+        if data.ndim != 1 or data.itemsize != 1:
+            data = data.cast("B")
+        info.file_size = len(data)
+        self._add(info, data)
+
+    def _member_pieces(self, info, source, size):
+        #the data of a pending member, in pieces of up to size bytes
+        if not isinstance(source, string_types):
+            for pos in range(0, len(source), size):
+                yield source[pos:pos + size]
+            return
+        done = 0
+        with open(source, "rb") as f:
+            while True:
+                piece = f.read(size)
+                if not piece:
+                    break
+                done += len(piece)
+                if done > info.file_size:
+                    break
+                yield piece
+        if done != info.file_size:
+            raise CabinetError(FDIERROR_TARGET_FILE, "%s changed while it was written" % source)
+
+    def _folder_runs(self, members, size):
+        #the data of a folder's members, in runs of size bytes along with the
+        #history preceding each run
+        history = b""
+        buf = bytearray()
+        for info, source in members:
+            for piece in self._member_pieces(info, source, size):
+                buf += piece
+                while len(buf) >= size:
+                    data = bytes(buf[:size])
+                    del buf[:size]
+                    yield history, data
+                    history = data[-MSZIPDecompressor.HISTORY:]
+        if buf:
+            yield history, bytes(buf)
+
+    def _compress_runs(self, runs, pool, inflight):
+        #the CFDATA blocks for each run, in order, keeping up to inflight runs
+        #queued in the pool if there is one
+        stats = self.stats
+        if pool is None:
+            for history, data in runs:
+                t = _clock()
+                blocks = _compress_blocks(self.compression, self.compresslevel, history, data)
+                if stats is not None:
+                    stats.record("compress", len(data), _clock() - t)
+                yield blocks
+            return
+        jobs = []
+        for history, data in runs:
+            if stats is not None:
+                stats.record("compress", len(data))
+            jobs.append(pool.submit(_compress_blocks, self.compression,
+                                    self.compresslevel, history, data))
+            if len(jobs) > inflight:
+                yield jobs.pop(0).result()
+        for job in jobs:
+            yield job.result()
+
+    def _plan_folders(self):
+        #split the pending members into folders, setting their offsets
+        limit = self.folder_size or _MAX_FOLDER_SIZE
+        folders = []
+        size = 0
+        for info, source in self._pending:
+            if not folders or info.file_size and (
+                    size >= limit or size + info.file_size > _MAX_FOLDER_SIZE):
+                folders.append([])
+                size = 0
+            info.folder_index = len(folders) - 1
+            info.folder_offset = size
+            folders[-1].append((info, source))
+            size += info.file_size
+        return folders
+
+    @_timed("write")
+    def _write_cabinet(self, fp):
+        """Write the pending members to fp.  The header and the CFFOLDER and
+        CFFILE tables are written last, when the folder offsets are known.
+        """
+        folders = self._plan_folders()
+        files = []
+        for info, source in self._pending:
+            name, attribs = _encode_name(info.filename, info.external_attr)
+            files.append(_CFFILE.pack(info.file_size, info.folder_offset, info.folder_index,
+                                      info.fat_date, info.fat_time, attribs))
+            files.append(name + b"\0")
+        files = b"".join(files)
+        coffFiles = _CFHEADER.size + _CFFOLDER.size * len(folders)
+        base = fp.tell()
+        fp.write(b"\0" * (coffFiles + len(files)))
+        offset = coffFiles + len(files)
+
+        workers = _cpu_count() if self.workers is None else self.workers
+        pool = None
+        if workers > 1 and futures is not None:
+            if self.executor == "process":
+                pool = futures.ProcessPoolExecutor(workers)
+            else:
+                pool = futures.ThreadPoolExecutor(workers)
+        cffolders = []
+        try:
+            for members in folders:
+                coffCabStart = offset
+                nbytes = sum(info.file_size for info, source in members)
+                runs = self._folder_runs(members, 32 * CB_MAX_CHUNK)
+                for blocks in self._compress_runs(runs, pool, 2 * workers):
+                    t = _clock()
+                    fp.write(blocks)
+                    if self.stats is not None:
+                        self.stats.record("io_write", len(blocks), _clock() - t)
+                    offset += len(blocks)
+                cCFData = (nbytes + CB_MAX_CHUNK - 1) // CB_MAX_CHUNK
+                cffolders.append(_CFFOLDER.pack(coffCabStart, cCFData, self.compression))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        header = _CFHEADER.pack(CAB_SIGNATURE, 0, offset, 0, coffFiles, 0, 3, 1,
+                                len(folders), len(self._pending), 0, 0, 0)
+        fp.seek(base)
+        fp.write(header + b"".join(cffolders) + files)
+        fp.seek(base + offset)
+        fp.flush()
+        self._pending = []
+
+class CabinetSet(CabinetFile):
+    """A set of cabinets spanning several volumes, read as a single cabinet.
+    filename names any volume of the set.  The others are found through the
+    szCabinetPrev and szCabinetNext names in the headers, in the same directory.
+    The directories of all volumes are merged, with folders continued across
+    volumes joined into one.  Volumes are opened as their data is needed, and
+    at most pool_size of them are kept open.
+    """
+    def __init__(self, filename, mode='r', pool_size=4, **options):
+        if not isinstance(filename, string_types):
+            raise ValueError("a CabinetSet must be opened by file name")
+        if mode != "r":
+            raise ValueError("a CabinetSet can only be read")
+        CabinetFile.__init__(self, filename, mode, **options)
+        if self.hfdi and FDIDestroy:
+            #FDICopy is not used, the spanned folders are decoded natively
+            FDIDestroy(self.hfdi)
+            self.hfdi = None
+        self.pool_size = max(1, pool_size)
+        self._pool = OrderedDict()
+        self._users = {} #the number of reads using each open source
+        self._dropped = set() #sources dropped from the pool while in use
+        self.volumes = self._find_volumes()
+        self._sources = [_VolumeSource(self, v) for v in range(len(self.volumes))]
+        self._volume_directories = None
+
+    def _find_volumes(self):
+        #follow the chain of volumes back to the first, then on to the last
+        path = self.filename
+        d = self._read_volume_header(path)
+        seen = set([path])
+        while d.flags & cfhdrPREV_CABINET:
+            path = self._volume_path(path, d.szCabinetPrev)
+            if path in seen:
+                raise CabinetError(FDIERROR_WRONG_CABINET, "cabinet set loops at %r" % path)
+            seen.add(path)
+            d = self._read_volume_header(path)
+        volumes = [path]
+        setID, iCabinet = d.setID, d.iCabinet
+        while d.flags & cfhdrNEXT_CABINET:
+            path = self._volume_path(path, d.szCabinetNext)
+            d = self._read_volume_header(path)
+            iCabinet += 1
+            if d.setID != setID or d.iCabinet != iCabinet:
+                raise CabinetError(FDIERROR_WRONG_CABINET,
+                                   "%r is not cabinet %d of set %d" % (path, iCabinet, setID))
+            volumes.append(path)
+        return volumes
+
+    def _read_volume_header(self, path):
+        source = open_source(path, use_mmap=False)
+        try:
+            return read_directory(lambda offset, size: self._read_source(source, offset, size),
+                                  header_only=True)
+        finally:
+            source.close()
+
+    def _volume_path(self, path, name):
+        #the path of the volume with the given name, next to path
+        name = _decode_name(name, 0)
+        dirname = os.path.dirname(path)
+        result = os.path.join(dirname, name)
+        if os.path.exists(result):
+            return result
+        #names in the headers are often not of the same case as the files
+        lower = name.lower()
+        for entry in os.listdir(dirname or "."):
+            if entry.lower() == lower:
+                return os.path.join(dirname, entry)
+        raise CabinetError(FDIERROR_CABINET_NOT_FOUND, "cabinet %r not found" % result)
+
+    def _volume(self, v):
+        """Return the source of volume number v.  It opens the volume through
+        the pool for each read, so it stays valid when the volume is dropped.
+        """
+        return self._sources[v]
+
+    def _acquire(self, v):
+        #take the open source of volume v from the pool, opening it if needed.
+        #The least recently used volume is dropped from the pool when it is
+        #full, and closed once no read is using it.
+        closing = []
+        with self._lock:
+            source = self._pool.pop(v, None)
+            if source is None:
+                source = open_source(self.volumes[v], self.use_mmap)
+                while len(self._pool) >= self.pool_size:
+                    dropped = self._pool.popitem(last=False)[1]
+                    if self._users.get(dropped):
+                        self._dropped.add(dropped)
+                    else:
+                        closing.append(dropped)
+            self._pool[v] = source
+            self._users[source] = self._users.get(source, 0) + 1
+        for dropped in closing:
+            dropped.close()
+        return source
+
+    def _release(self, source):
+        with self._lock:
+            n = self._users[source] - 1
+            if n:
+                self._users[source] = n
+                return
+            del self._users[source]
+            if source not in self._dropped:
+                return
+            self._dropped.discard(source)
+        source.close()
+
+    def _getsource(self):
+        return self._volume(0)
+
+    def _identity(self):
+        if self._identity_key is None:
+            self._identity_key = tuple(_file_key(path) for path in self.volumes)
+        return self._identity_key
+
+    def _options(self):
+        options = CabinetFile._options(self)
+        options["pool_size"] = self.pool_size
+        return options
+
+    def close(self):
+        CabinetFile.close(self)
+        with self._lock:
+            sources = list(self._pool.values()) + list(self._dropped)
+            self._pool.clear()
+            self._dropped.clear()
+        for source in sources:
+            source.close()
+
+    def _getdirectory(self):
+        if self._directory is None:
+            with self._lock:
+                if self._directory is None:
+                    self._directory = self._merge_directories()
+        return self._directory
+
+    def _merge_directories(self):
+        merged = None
+        last = None #the last folder of the previous volume
+        self._volume_directories = []
+        for v in range(len(self.volumes)):
+            volume = self._volume(v)
+            d = read_directory(lambda offset, size: self._read_source(volume, offset, size))
+            self._volume_directories.append(d)
+            if merged is None:
+                merged = CabinetDirectory()
+                for name in ("cbCabinet", "versionMajor", "versionMinor", "flags", "setID",
+                             "iCabinet", "cbCFHeader", "cbCFFolder", "cbCFData"):
+                    setattr(merged, name, getattr(d, name))
+                merged.flags &= ~(cfhdrPREV_CABINET | cfhdrNEXT_CABINET)
+            else:
+                merged.cbCabinet += d.cbCabinet
+
+            #the first folder continues the last one of the previous volume
+            #if any file in it does
+            continued = last is not None and d.folders and any(
+                i in (ifoldCONTINUED_FROM_PREV, ifoldCONTINUED_PREV_AND_NEXT)
+                for i in d.infos.folders)
+            local = []
+            for folder in d.folders:
+                if continued and not local:
+                    target = last
+                    target.cCFData += folder.cCFData
+                else:
+                    target = CabinetFolder(len(merged.folders), folder.coffCabStart,
+                                           folder.cCFData, folder.typeCompress)
+                    target.segments = []
+                    merged.folders.append(target)
+                target.segments.append((v, folder))
+                local.append(target)
+            if local:
+                last = local[-1]
+
+            for info in d.infos:
+                i = info.folder_index
+                if i in (ifoldCONTINUED_FROM_PREV, ifoldCONTINUED_PREV_AND_NEXT):
+                    continue #listed by the previous volume
+                if i == ifoldCONTINUED_TO_NEXT:
+                    i = len(local) - 1
+                if not 0 <= i < len(local):
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET,
+                                       "member %r has no folder" % info.filename)
+                info.folder_index = local[i].index
+                merged.infos.append(info)
+        merged.cFiles = len(merged.infos)
+        return merged
+
+    def _build_index(self, folder):
+        index = FolderIndex(folder)
+        pending = [] #the pieces of a block split across volumes
+        for n, (v, segment) in enumerate(folder.segments):
+            source = self._volume(v)
+            hsize = _CFDATA.size + self._volume_directories[v].cbCFData
+            pos = segment.coffCabStart
+            for k in range(segment.cCFData):
+                hdr = self._read_source(source, pos, _CFDATA.size)
+                if len(hdr) < _CFDATA.size:
+                    raise CabinetError(FDIERROR_CORRUPT_CABINET, "truncated CFDATA header")
+                csum, cbData, cbUncomp = _CFDATA.unpack(hdr)
+                pending.append((v, pos + hsize, cbData, cbUncomp, csum))
+                pos += hsize + cbData
+                if not cbUncomp and k == segment.cCFData - 1 and n < len(folder.segments) - 1:
+                    continue #the block goes on in the next volume
+                v0, offset, cb, cu, csum = pending[0]
+                if len(pending) > 1:
+                    index.parts[len(index)] = pending
+                index.volumes.append(v0)
+                index.offsets.append(offset)
+                index.cbData.append(sum(p[2] for p in pending))
+                index.csums.append(csum)
+                index.uoffsets.append(index.uoffsets[-1] + cbUncomp)
+                pending = []
+        if pending:
+            raise CabinetError(FDIERROR_CORRUPT_CABINET, "split CFDATA block has no continuation")
+        return index
+
+    def _block_parts(self, index, i):
+        parts = index.parts.get(i)
+        if parts is None:
+            return [(self._volume(index.volumes[i]), index.offsets[i], index.cbData[i],
+                     index.uoffsets[i + 1] - index.uoffsets[i], index.csums[i])]
+        return [(self._volume(v), offset, cbData, cbUncomp, csum)
+                for v, offset, cbData, cbUncomp, csum in parts]
+
+
+class _VolumeSource(object):
+    """The source of one volume of a CabinetSet, reading through its pool"""
+    def __init__(self, cabset, v):
+        self.cabset = cabset
+        self.v = v
+
+    def read_at(self, offset, size):
+        source = self.cabset._acquire(self.v)
+        try:
+            return source.read_at(offset, size)
+        finally:
+            self.cabset._release(source)
+
+    def size(self):
+        source = self.cabset._acquire(self.v)
+        try:
+            return source.size()
+        finally:
+            self.cabset._release(source)
+
+
+class _ChunkReader(io.RawIOBase):
+    """A file-like object reading from an iterator of bytes-like chunks"""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        b = memoryview(b)
+        if b.ndim != 1 or b.itemsize != 1:
+            b = b.cast("B")
+        n = 0
+        while n < len(b):
+            if not len(self._chunk):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._chunk = memoryview(chunk)
+            k = min(len(b) - n, len(self._chunk))
+            b[n:n + k] = self._chunk[:k]
+            self._chunk = self._chunk[k:]
+            n += k
+        return n
+
+
+class CabinetExtFile(io.RawIOBase):
+    """A file-like object for reading a cabinet member, returned by
+    CabinetFile.open().  CFDATA blocks are decoded on demand, so at most one
+    block and the decompressor window are held in memory.  Seeking restarts
+    decoding from the nearest checkpoint.
+    """
+    def __init__(self, cabinet, folder, info):
+        #each stream keeps its own position and decoder, so streams of the
+        #same CabinetFile may be read from different threads
+        io.RawIOBase.__init__(self)
+        self.name = info.filename
+        self._cabinet = cabinet
+        self._folder = folder
+        self._info = info
+        self._pos = 0
+        self._chunks = None
+        self._chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._info.file_size
+        elif whence != io.SEEK_SET:
+            raise ValueError("invalid whence (%r)" % whence)
+        if offset < 0:
+            raise ValueError("negative seek position %r" % offset)
+        if offset != self._pos:
+            self._pos = offset
+            self._chunks = None
+            self._chunk = memoryview(b"")
+        return self._pos
+
+    def _next_chunk(self):
+        #the remainder of the current block, or the next one
+        if not len(self._chunk):
+            if self._chunks is None:
+                info = self._info
+                self._chunks = self._cabinet._iter_range(self._folder,
+                                                         info.folder_offset + self._pos,
+                                                         info.folder_offset + info.file_size)
+            self._chunk = next(self._chunks, None)
+            if self._chunk is None:
+                self._chunks = None
+                self._chunk = memoryview(b"")
+        return self._chunk
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        b = memoryview(b)
+        if b.ndim != 1 or b.itemsize != 1:
+            b = b.cast("B")
+        n = 0
+        while n < len(b):
+            chunk = self._next_chunk()
+            if not len(chunk):
+                break
+            k = min(len(b) - n, len(chunk))
+            b[n:n + k] = chunk[:k]
+            self._chunk = chunk[k:]
+            self._pos += k
+            n += k
+        return n
+
+    def readall(self):
+        pieces = []
+        while True:
+            chunk = self._next_chunk()
+            if not len(chunk):
+                return b"".join(pieces)
+            pieces.append(chunk.tobytes())
+            self._pos += len(chunk)
+            self._chunk = chunk[len(chunk):]
+
+    def close(self):
+        self._chunks = None
+        self._chunk = memoryview(b"")
+        io.RawIOBase.close(self)
+
+
+def _running_loop():
+    #the event loop running the calling coroutine
+    get_running_loop = getattr(asyncio, "get_running_loop", None) #python 3.7
+    if get_running_loop is None:
+        return asyncio.get_event_loop()
+    return get_running_loop()
+
+
+class AsyncCabinetFile(object):
+    """An asyncio interface to a CabinetFile.  The methods return awaitables,
+    the blocking work runs in executor, a concurrent.futures executor.  If none
+    is given, a thread pool of max_workers threads is created, which limits how
+    many calls run at once.  Share one executor between AsyncCabinetFile
+    objects to limit them together.  Other arguments are passed to CabinetFile,
+    or cabinet may be an open CabinetFile or CabinetSet.
+    """
+    def __init__(self, filename, executor=None, max_workers=4, **options):
+        if asyncio is None or futures is None:
+            raise ImportError("AsyncCabinetFile requires asyncio and concurrent.futures")
+        if isinstance(filename, CabinetFile):
+            self.cabinet = filename
+        else:
+            self.cabinet = CabinetFile(filename, **options)
+        self._own_executor = executor is None
+        if executor is None:
+            executor = futures.ThreadPoolExecutor(max_workers)
+        self.executor = executor
+
+    def _run(self, func, *args):
+        #run func in the executor, returning an asyncio future
+        loop = _running_loop()
+        return loop.run_in_executor(self.executor, func, *args)
+
+    def __aenter__(self):
+        future = _running_loop().create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, *exc_info):
+        return self.close()
+
+    def close(self):
+        """Close the cabinet, and the executor if it was created here"""
+        def close():
+            self.cabinet.close()
+            if self._own_executor:
+                self.executor.shutdown(wait=False)
+        return self._run(close)
+
+    def infolist(self):
+        return self._run(self.cabinet.infolist)
+
+    def namelist(self):
+        return self._run(self.cabinet.namelist)
+
+    def getinfo(self, name):
+        return self._run(self.cabinet.getinfo, name)
+
+    def select(self, names):
+        return self._run(self.cabinet.select, names)
+
+    def read(self, name):
+        return self._run(self.cabinet.read, name)
+
+    def read_many(self, names):
+        return self._run(self.cabinet.read_many, names)
+
+    def extract(self, target, names=[], incremental=False):
+        return self._run(self.cabinet.extract, target, names, 1, "thread", incremental)
+
+    def manifest(self, algorithms=("sha256",), names=None):
+        return self._run(self.cabinet.manifest, algorithms, names)
+
+    def transcode(self, output, format=None, names=None):
+        return self._run(self.cabinet.transcode, output, format, names)
+
+    def testcabinet(self, checksums=True, decompress=True):
+        return self._run(self.cabinet.testcabinet, checksums, decompress)
+
+    def open(self, name, chunk_size=CB_MAX_CHUNK):
+        """Return an AsyncMemberReader for the member name"""
+        return AsyncMemberReader(self, name, chunk_size)
+
+
+class AsyncMemberReader(object):
+    """Reads a member of an AsyncCabinetFile as it is decompressed.  Use
+    'await reader.read(size)', or 'async for chunk in reader' to get chunks of
+    up to chunk_size bytes.
+    """
+    def __init__(self, cabinet, name, chunk_size=CB_MAX_CHUNK):
+        self.cabinet = cabinet
+        self.name = name
+        self.chunk_size = chunk_size
+        self._stream = None
+
+    def _getstream(self):
+        #open the member on first use, this reads the directory
+        if self._stream is None:
+            self._stream = self.cabinet.cabinet.open(self.name)
+        return self._stream
+
+    def read(self, size=-1):
+        return self.cabinet._run(lambda: self._getstream().read(size))
+
+    def _next_chunk(self):
+        chunk = self._getstream().read(self.chunk_size)
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.cabinet._run(self._next_chunk)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+    def __aenter__(self):
+        future = _running_loop().create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, *exc_info):
+        return self.cabinet._run(self.close)
+
+
+class CabinetReport(object):
+    """The result of CabinetFile.testcabinet().  True if no problems were found.
+    folders holds a FolderReport for each folder, errors any cabinet wide problems.
+    """
+    def __init__(self):
+        self.folders = []
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors and all(f.ok for f in self.folders)
+
+    def __bool__(self):
+        return self.ok
+    __nonzero__ = __bool__
+
+    def problems(self):
+        """Return a list of strings describing each problem found"""
+        result = list(self.errors)
+        for folder in self.folders:
+            result.extend("folder %d: %s" % (folder.index, e) for e in folder.errors)
+            for block in folder.blocks:
+                result.extend("folder %d block %d: %s" % (folder.index, block.index, e)
+                              for e in block.errors)
+        return result
+
+    def __repr__(self):
+        return "<CabinetReport %s: %d folders, %d blocks>" % (
+            "ok" if self.ok else "failed", len(self.folders),
+            sum(len(f.blocks) for f in self.folders))
+
+
+class ExtractReport(object):
+    """The result of CabinetFile.extract().  written and skipped hold the names
+    of the members written and of those whose files were already current.
+    """
+    def __init__(self):
+        self.written = []
+        self.skipped = []
+
+    def __repr__(self):
+        return "<ExtractReport: %d written, %d skipped>" % (len(self.written),
+                                                            len(self.skipped))
+
+
+class FolderReport(object):
+    """The test results of one folder and its CFDATA blocks"""
+    def __init__(self, folder):
+        self.index = folder.index
+        self.typeCompress = folder.typeCompress
+        self.blocks = []
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors and all(not b.errors for b in self.blocks)
+
+    def __repr__(self):
+        return "<FolderReport %d %s: %d blocks>" % (self.index, "ok" if self.ok else "failed",
+                                                    len(self.blocks))
+
+
+class BlockReport(object):
+    """The test results of one CFDATA block.  offset is the file offset of the
+    payload, csum the stored checksum and checksum the computed one, or None if
+    it was not verified.
+    """
+    def __init__(self, index, offset, cbData, cbUncomp, csum):
+        self.index = index
+        self.offset = offset
+        self.cbData = cbData
+        self.cbUncomp = cbUncomp
+        self.csum = csum
+        self.checksum = None
+        self.errors = []
+
+    def __repr__(self):
+        return "<BlockReport %d at %d %s>" % (self.index, self.offset,
+                                              "; ".join(self.errors) or "ok")
+
+
+class CabinetInfo(object):
+    """A simple class to encapsulate information about cabinet members"""
+    __slots__ = ("filename", "date_time", "file_size", "external_attr",
+                 "folder_index", "folder_offset", "fat_date", "fat_time")
+
+    def __init__(self, filename=None, date_time=None):
+        self.filename, self.date_time = filename, date_time
+        self.file_size = 0
+        self.external_attr = 0
+        self.folder_index = 0
+        self.folder_offset = 0
+        self.fat_date = self.fat_time = 0
+
+    def __repr__(self):
+        return "<CabinetInfo %s, size=%s, date=%r, attrib=%x>"%(self.filename, self.file_size, self.date_time, self.external_attr)
+
+def DecodeFATTime(FATdate, FATtime):
+    """Convert the 2x16 bits of time in the FAT system to a tuple"""
+    day = FATdate & 0x1f
+    month = (FATdate >> 5) & 0xf
+    year = 1980 + (FATdate >> 9)
+    sec = 2 * (FATtime & 0x1f)
+    min = (FATtime >> 5) & 0x3f
+    hour = FATtime >> 11
+    return (year, month, day, hour, min, sec)
+
+def EncodeFATTime(date_time):
+    """Convert a (year, month, day, hour, min, sec) tuple to the 2x16 bits of
+    time in the FAT system.  Times before 1980 are clamped to 1980.
+    """
+    year, month, day, hour, min, sec = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, min, sec = 1980, 1, 1, 0, 0, 0
+    FATdate = ((year - 1980) << 9) | (month << 5) | day
+    FATtime = (hour << 11) | (min << 5) | (sec // 2)
+    return FATdate, FATtime
+
+
+BATCH_COMMANDS = ("list", "test", "extract", "manifest")
+
+def _batch_job(command, path, target, options):
+    """Worker job of batch(): run a command on one cabinet and return its
+    result as a dict.  target is the directory to extract this cabinet to.
+    """
+    t = _clock()
+    stats = CabinetStats()
+    result = {"path": path, "command": command, "ok": True}
+    try:
+        cf = CabinetFile(path, stats=stats, **options)
+        try:
+            if command == "list":
+                result["members"] = [
+                    {"name": info.filename, "size": info.file_size,
+                     "date_time": "%d-%02d-%02d %02d:%02d:%02d" % tuple(info.date_time),
+                     "attribs": info.external_attr, "folder": info.folder_index}
+                    for info in cf.infolist()]
+            elif command == "test":
+                report = cf.testcabinet()
+                result["ok"] = report.ok
+                result["problems"] = report.problems()
+                result["folders"] = len(report.folders)
+                result["blocks"] = sum(len(f.blocks) for f in report.folders)
+            elif command == "extract":
+                result["target"] = target
+                report = cf.extract(target)
+                result["written"] = len(report.written)
+                result["skipped"] = len(report.skipped)
+            else:
+                result["members"] = [
+                    {"name": info.filename, "size": info.file_size, "sha256": digests["sha256"]}
+                    for info, digests in cf.manifest()]
+        finally:
+            cf.close()
+    except (CabinetError, EnvironmentError) as e:
+        result["ok"] = False
+        result["error"] = _errmsg(e)
+    except Exception as e:
+        #a bug or a damaged cabinet the parser missed, fail only this cabinet
+        result["ok"] = False
+        result["error"] = _errmsg(e)
+        result.setdefault("problems", []).append(repr(e))
+    result["seconds"] = _clock() - t
+    result["stats"] = dict((k, v) for k, v in stats.snapshot().items() if v)
+    return result
+
+def _batch_paths(paths):
+    #(cabinet path, name) from paths, directories searched for cabinets and
+    #@files listing one path per line.  The name is the path relative to the
+    #directory searched, or else the file name, without the extension.
+    def name(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    for path in paths:
+        if path.startswith("@"):
+            with open(path[1:]) as f:
+                for line in f:
+                    if line.strip():
+                        yield line.strip(), name(line.strip())
+        elif os.path.isdir(path):
+            for found, offset, info in scan(path, embedded=False):
+                yield found, os.path.splitext(os.path.relpath(found, path))[0]
+        else:
+            yield path, name(path)
+
+def _batch_targets(cabinets, target):
+    #(cabinet path, directory in target to extract it to), adding a number to
+    #the names of cabinets when they are already used, ignoring case
+    used = set()
+    for path, name in cabinets:
+        unique, n = name, 1
+        while os.path.normcase(unique).lower() in used:
+            n += 1
+            unique = "%s-%d" % (name, n)
+        used.add(os.path.normcase(unique).lower())
+        yield path, os.path.join(target, unique)
+
+def batch(command, paths, workers=None, executor="process", target=None, **options):
+    """Run a command on many cabinets in a pool of workers, one per CPU if
+    None, and yield a result dict for each as it completes.  command is one of
+    BATCH_COMMANDS: "list", "test", "extract" into a directory in target named
+    after each cabinet, or "manifest" with SHA-256 digests.  The directory is
+    the cabinet's path relative to the directory it was found in, or its file
+    name, without the extension and with a number added if it is taken.  paths are cabinet
+    files, directories to search for cabinets, or "@file" naming a file that
+    lists one path per line.  executor is "process" or "thread", and options
+    are passed on to CabinetFile.  Each result has the path, whether it is ok,
+    an error message if it failed, the seconds taken and the CabinetStats
+    counters.
+    """
+    if command not in BATCH_COMMANDS:
+        raise ValueError("unknown batch command %r" % (command,))
+    if command == "extract" and target is None:
+        raise ValueError("extract needs a target directory")
+    if isinstance(paths, string_types):
+        paths = [paths]
+    if command == "extract":
+        cabinets = _batch_targets(_batch_paths(paths), target)
+    else:
+        cabinets = ((path, None) for path, name in _batch_paths(paths))
+    if workers is None:
+        workers = _cpu_count()
+    if workers <= 1 or futures is None:
+        for path, cabtarget in cabinets:
+            yield _batch_job(command, path, cabtarget, options)
+        return
+    if executor == "process":
+        pool = futures.ProcessPoolExecutor(workers)
+    elif executor == "thread":
+        pool = futures.ThreadPoolExecutor(workers)
+    else:
+        raise ValueError("executor must be 'thread' or 'process', not %r" % (executor,))
+    with pool:
+        pending = set()
+        for path, cabtarget in cabinets:
+            pending.add(pool.submit(_batch_job, command, path, cabtarget, options))
+            if len(pending) >= 4 * workers:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for job in done:
+                    yield job.result()
+        for job in futures.as_completed(pending):
+            yield job.result()
+
+
+def main(args = None):
+    import textwrap
+    USAGE=textwrap.dedent("""\
+        Usage:
+            cabinet.py -l cabinet.cab        # Show listing of a cab file
+            cabinet.py -t cabinet.cab        # Test if a cab file is valid
+            cabinet.py -e cabinet.cab target # Extract cab file into target dir
+            cabinet.py -u cabinet.cab target # Extract only new and changed files
+            cabinet.py -c cabinet.cab src ... # Create cab file from sources
+            cabinet.py -s path ...           # Find cab files, also embedded ones
+            cabinet.py -a cabinet.cab archive [format]
+                # Convert to zip, tar, tar.gz, tar.bz2 or tar.xz, - writes a tar to stdout
+            cabinet.py -b command [-j workers] [-o target] path ...
+                # Run list, test, extract (into target) or manifest on many cab
+                # files, directories of them or @files listing them, in
+                # parallel, printing a JSON line for each
+        """)
+    if args is None:
+        args = sys.argv[1:]
+
+    if not args or args[0] not in ('-l', '-e', '-u', '-t', '-c', '-s', '-a', '-b'):
+        print(USAGE)
+        sys.exit(1)
+
+    if args[0] == '-l':
+        if len(args) != 2:
+            print(USAGE)
+            sys.exit(1)
+        zf = CabinetFile(args[1])
+        zf.printdir()
+        zf.close()
+
+    elif args[0] == '-t':
+        if len(args) != 2:
+            print(USAGE)
+            sys.exit(1)
+        zf = CabinetFile(args[1])
+        report = zf.testcabinet()
+        for problem in report.problems():
+            print(problem)
+        print(bool(report))
+        print("Done testing")
+
+    elif args[0] == '-e':
+        if len(args) != 3:
+            print(USAGE)
+            sys.exit(1)
+
+        zf = CabinetFile(args[1])
+        out = args[2]
+        zf.extract(out)
+        zf.close()
+
+    elif args[0] == '-u':
+        if len(args) != 3:
+            print(USAGE)
+            sys.exit(1)
+
+        zf = CabinetFile(args[1])
+        report = zf.extract(args[2], incremental=True)
+        zf.close()
+        for name in report.written:
+            print(name)
+        print("%d written, %d unchanged" % (len(report.written), len(report.skipped)))
+
+    elif args[0] == '-s':
+        if len(args) < 2:
+            print(USAGE)
+            sys.exit(1)
+        for path, offset, info in scan(args[1:]):
+            print("%s %d %d bytes, %d folders, %d files" % (
+                path, offset, info.cbCabinet, info.cFolders, info.cFiles))
+
+    elif args[0] == '-a':
+        if len(args) not in (3, 4):
+            print(USAGE)
+            sys.exit(1)
+
+        zf = CabinetFile(args[1])
+        format = args[3] if len(args) == 4 else None
+        if args[2] == '-':
+            zf.transcode(getattr(sys.stdout, "buffer", sys.stdout), format or "tar")
+        else:
+            zf.transcode(args[2], format)
+        zf.close()
+
+    elif args[0] == '-b':
+        if len(args) < 3 or args[1] not in BATCH_COMMANDS:
+            print(USAGE)
+            sys.exit(1)
+
+        command, workers, target = args[1], None, None
+        rest = args[2:]
+        while len(rest) > 1 and rest[0] in ('-j', '-o'):
+            if rest[0] == '-j':
+                workers = int(rest[1])
+            else:
+                target = rest[1]
+            rest = rest[2:]
+        if not rest or (command == "extract") != (target is not None):
+            print(USAGE)
+            sys.exit(1)
+        failed = 0
+        for result in batch(command, rest, workers, target=target):
+            failed += not result["ok"]
+            print(json.dumps(result, sort_keys=True))
+            sys.stdout.flush()
+        if failed:
+            sys.exit(1)
+
+    elif args[0] == '-c':
+        if len(args) < 3:
+            print(USAGE)
+            sys.exit(1)
+
+        def addToCab(cf, path, cabpath):
+            if os.path.isfile(path):
+                cf.write(path, cabpath)
+            elif os.path.isdir(path):
+                for nm in sorted(os.listdir(path)):
+                    addToCab(cf,
+                            os.path.join(path, nm), os.path.join(cabpath, nm))
+            # else: ignore
+
+        cf = CabinetFile(args[1], 'w', workers=None)
+        for src in args[2:]:
+            addToCab(cf, src, os.path.basename(os.path.normpath(src)))
+        cf.close()
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
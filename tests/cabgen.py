@@ -0,0 +1,167 @@
+"""Build cabinets and sets of cabinets spanning several volumes for the tests.
+
+This is independent of the writer in cabinet.py, so that the reader can be
+tested with layouts the writer does not make, such as folders continued across
+volumes and CFDATA blocks split between two volumes.
+"""
+import struct
+import zlib
+
+CB_BLOCK = 32768
+
+#iFolder values of members continued from or to other volumes
+CONTINUED_FROM_PREV = 0xFFFD
+CONTINUED_TO_NEXT = 0xFFFE
+CONTINUED_PREV_AND_NEXT = 0xFFFF
+
+
+def checksum(data, seed=0):
+    """The CFDATA checksum of data"""
+    data = bytearray(data)
+    n = len(data) // 4
+    c = seed
+    for w in struct.unpack("<%dI" % n, bytes(data[:n * 4])):
+        c ^= w
+    tail = data[n * 4:]
+    ul = 0
+    for b in tail:
+        ul = (ul << 8) | b
+    return c ^ ul
+
+def stored_blocks(data):
+    """Split data into uncompressed blocks, a list of (payload, cbUncomp)"""
+    return [(data[i:i + CB_BLOCK], len(data[i:i + CB_BLOCK]))
+            for i in range(0, len(data), CB_BLOCK)]
+
+def mszip_blocks(data):
+    """Compress data into MSZIP blocks, each using the previous as history"""
+    blocks = []
+    for i in range(0, len(data), CB_BLOCK):
+        chunk = data[i:i + CB_BLOCK]
+        history = data[max(0, i - CB_BLOCK):i]
+        if history:
+            c = zlib.compressobj(6, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, history)
+        else:
+            c = zlib.compressobj(6, zlib.DEFLATED, -15)
+        blocks.append((b"CK" + c.compress(chunk) + c.flush(), len(chunk)))
+    return blocks
+
+def _blocks(folder):
+    typeCompress, members = folder[:2]
+    if len(folder) > 2 and folder[2] is not None:
+        return folder[2]
+    data = b"".join(d for _, d in members)
+    if typeCompress & 0xF == 1:
+        return mszip_blocks(data)
+    return stored_blocks(data)
+
+def make_set(folders, cuts=(), names=None, setID=0x4242, reserve=None, date=0x5a21, time=0x6000):
+    """Return the volumes of a cabinet set as a list of bytes.
+
+    folders is a list of (typeCompress, members) or (typeCompress, members,
+    blocks), where members is a list of (name, data) and blocks a list of
+    (payload, cbUncomp) to use instead of compressing the data.  cuts maps the
+    index of a block, counted over all folders, to where a new volume starts:
+    None to start it with that block, or an offset to split the block's
+    payload between the two volumes.  names are the file names of the volumes,
+    written in the headers to link them.  reserve is (cbCFHeader, cbCFFolder,
+    cbCFData).  With no cuts this makes a single cabinet.
+    """
+    cuts = dict(cuts)
+    volumes = [[]]  #per volume, a list of (folder index, payload, cbUncomp)
+    k = 0
+    for fi, folder in enumerate(folders):
+        for payload, cbUncomp in _blocks(folder):
+            if k in cuts:
+                split = cuts[k]
+                if split is None:
+                    volumes.append([(fi, payload, cbUncomp)])
+                else:
+                    #the first part of a split block has cbUncomp 0
+                    volumes[-1].append((fi, payload[:split], 0))
+                    volumes.append([(fi, payload[split:], cbUncomp)])
+            else:
+                volumes[-1].append((fi, payload, cbUncomp))
+            k += 1
+    n = len(volumes)
+    if names is None:
+        names = ["disk%d.cab" % (v + 1) for v in range(n)]
+    cbCFHeader, cbCFFolder, cbCFData = reserve or (0, 0, 0)
+
+    result = []
+    uoff = [0] * len(folders)  #uncompressed offset reached in each folder
+    prev_end = [0] * len(folders)
+    for v, records in enumerate(volumes):
+        fids = []
+        for fi, _, _ in records:
+            if fi not in fids:
+                fids.append(fi)
+        #the uncompressed range of each folder decoded with this volume
+        ranges = {}
+        for fi in fids:
+            start = uoff[fi]
+            end = start + sum(u for f, _, u in records if f == fi)
+            uoff[fi] = end
+            if records[-1][0] == fi and records[-1][2] == 0 and v < n - 1:
+                end += volumes[v + 1][0][2]
+            ranges[fi] = (start, end, prev_end[fi])
+            prev_end[fi] = end
+
+        files = []
+        for i, fi in enumerate(fids):
+            start, end, before_end = ranges[fi]
+            offset = 0
+            for name, data in folders[fi][1]:
+                a, b = offset, offset + len(data)
+                offset = b
+                if data:
+                    if not (a < end and b > start):
+                        continue
+                elif not (before_end <= a < end or (a == end and v == n - 1)):
+                    continue
+                before, after = a < before_end, b > end
+                if before and after:
+                    iFolder = CONTINUED_PREV_AND_NEXT
+                elif before:
+                    iFolder = CONTINUED_FROM_PREV
+                elif after:
+                    iFolder = CONTINUED_TO_NEXT
+                else:
+                    iFolder = i
+                files.append(struct.pack("<IIHHHH", len(data), a, iFolder, date, time, 0x20) +
+                             name.encode("ascii") + b"\0")
+
+        flags = 0
+        strings = b""
+        if v > 0:
+            flags |= 1
+            strings += names[v - 1].encode("ascii") + b"\0disk\0"
+        if v < n - 1:
+            flags |= 2
+            strings += names[v + 1].encode("ascii") + b"\0disk\0"
+        reserved = b""
+        if reserve:
+            flags |= 4
+            reserved = struct.pack("<HBB", cbCFHeader, cbCFFolder, cbCFData) + b"\xCC" * cbCFHeader
+        coffFiles = 36 + len(reserved) + len(strings) + (8 + cbCFFolder) * len(fids)
+        pos = coffFiles + sum(len(f) for f in files)
+        cffolders = []
+        cfdata = []
+        for fi in fids:
+            blocks = [(p, u) for f, p, u in records if f == fi]
+            cffolders.append(struct.pack("<IHH", pos, len(blocks), folders[fi][0]) +
+                             b"\xAA" * cbCFFolder)
+            for payload, cbUncomp in blocks:
+                csum = checksum(struct.pack("<HH", len(payload), cbUncomp), checksum(payload))
+                record = (struct.pack("<IHH", csum, len(payload), cbUncomp) +
+                          b"\xBB" * cbCFData + payload)
+                cfdata.append(record)
+                pos += len(record)
+        header = struct.pack("<4sIIIIIBBHHHHH", b"MSCF", 0, pos, 0, coffFiles, 0, 3, 1,
+                             len(fids), len(files), flags, setID, v)
+        result.append(b"".join([header, reserved, strings] + cffolders + files + cfdata))
+    return result
+
+def make(folders, reserve=None, date=0x5a21, time=0x6000):
+    """Return a single cabinet holding folders, as for make_set()"""
+    return make_set(folders, reserve=reserve, date=date, time=time)[0]
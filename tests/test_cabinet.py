@@ -0,0 +1,945 @@
+"""Tests of CabinetFile, on cabinets made with cabgen or with the writer."""
+import hashlib
+import io
+import os
+import random
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+
+import cabinet
+import cabgen
+
+#a date with the day and the month told apart, and its FAT encoding
+DATE_TIME = (2011, 3, 13, 7, 6, 40)
+FAT_DATE = (2011 - 1980) << 9 | 3 << 5 | 13
+FAT_TIME = 7 << 11 | 6 << 5 | 40 // 2
+
+
+def _text(rnd, n):
+    words = [b"alpha", b"beta", b"gamma", b"delta", b"\n", b"cabinet", b"folder"]
+    return b" ".join(rnd.choice(words) for _ in range(n))[:n]
+
+def _random(rnd, n):
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(n)))
+
+def _members(seed):
+    rnd = random.Random(seed)
+    members = [("empty.txt", b""), ("small.txt", b"small\n")]
+    for i in range(8):
+        make = _random if i % 3 == 0 else _text
+        members.append(("dir\\file%d.%s" % (i, "bin" if make is _random else "txt"),
+                        make(rnd, rnd.randrange(1000, 80000))))
+    return members
+
+
+class CabinetTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.members = _members(2)
+        self.data = dict(self.members)
+        self.names = [name for name, _ in self.members]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make(self, name="test.cab", folders=None, **kwargs):
+        #a cabinet made with cabgen, by default of the members in two folders
+        if folders is None:
+            folders = [(cabinet.tcompTYPE_MSZIP, self.members[:6]),
+                       (cabinet.tcompTYPE_NONE, self.members[6:])]
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(cabgen.make(folders, **kwargs))
+        return path
+
+    def write(self, name="test.cab", members=None, **options):
+        #a cabinet made with the writer, by default of the members
+        path = os.path.join(self.tmp, name)
+        with cabinet.CabinetFile(path, "w", **options) as cab:
+            for arcname, data in members or self.members:
+                cab.writestr(arcname, data)
+        return path
+
+    def assertCabinetError(self, code, func, *args):
+        try:
+            func(*args)
+        except cabinet.CabinetError as e:
+            self.assertEqual(e.args[0], code, e)
+        else:
+            self.fail("no CabinetError was raised")
+
+
+class DirectoryTest(CabinetTest):
+    def test_list(self):
+        for reserve in (None, (20, 4, 8)):
+            path = self.make(reserve=reserve, date=FAT_DATE, time=FAT_TIME)
+            with cabinet.CabinetFile(path) as cab:
+                self.assertEqual(cab.namelist(), self.names)
+                infos = cab.infolist()
+                self.assertEqual([info.filename for info in infos], self.names)
+                for i, (info, (name, data)) in enumerate(zip(infos, self.members)):
+                    self.assertEqual(info.file_size, len(data))
+                    self.assertEqual(info.date_time, DATE_TIME)
+                    self.assertEqual(info.external_attr, 0x20)
+                    self.assertEqual(info.folder_index, 0 if i < 6 else 1)
+                self.assertEqual(cab.getinfo("small.txt").file_size, 6)
+                self.assertEqual(cab.getinfo("missing"), None)
+
+    def test_not_a_cabinet(self):
+        self.assertCabinetError(cabinet.FDIERROR_NOT_A_CABINET,
+                                lambda: cabinet.CabinetFile(b"not a cabinet" * 10).namelist())
+        with open(self.make(), "rb") as f:
+            blob = f.read()
+        for size in (20, 40, 100):
+            self.assertRaises(cabinet.CabinetError,
+                              lambda: cabinet.CabinetFile(blob[:size]).namelist())
+
+    def test_utf8_names(self):
+        #names flagged with _A_NAME_IS_UTF are decoded, and must be valid utf-8
+        name = u"d\u00e9j\u00e0.txt"
+        path = self.make(folders=[(cabinet.tcompTYPE_NONE, [("dXXjXX.txt", b"vu")])])
+        with open(path, "rb") as f:
+            blob = bytearray(f.read())
+        pos = blob.find(b"dXXjXX.txt\0")
+        struct.pack_into("<H", blob, pos - 2, 0x20 | cabinet._A_NAME_IS_UTF)
+        blob[pos:pos + 10] = name.encode("utf-8")
+        with cabinet.CabinetFile(bytes(blob)) as cab:
+            self.assertEqual(cab.namelist(), [name])
+            self.assertEqual(cab.read(name), b"vu")
+        blob[pos:pos + 10] = b"d\xc3(j\xc3 .txt"
+        self.assertCabinetError(cabinet.FDIERROR_CORRUPT_CABINET,
+                                lambda: cabinet.CabinetFile(bytes(blob)).namelist())
+
+    def test_without_cabinet_dll(self):
+        #what the native decoders do not handle needs cabinet.dll
+        if cabinet.FDICreate is not None:
+            self.skipTest("cabinet.dll is available")
+        with cabinet.CabinetFile(self.make()) as cab:
+            self.assertRaises(NotImplementedError, cab._CabinetFile__FDICopy, None)
+
+
+class DecodeTest(CabinetTest):
+    def check(self, path):
+        with cabinet.CabinetFile(path) as cab:
+            self.assertEqual(cab.namelist(), self.names)
+            for name, data in self.members:
+                self.assertEqual(cab.read(name), data, name)
+            self.assertEqual(cab.read(self.names[::-1]), [self.data[n] for n in self.names[::-1]])
+            report = cab.testcabinet()
+            self.assertTrue(report, report.errors)
+
+    def test_one_folder(self):
+        for typeCompress in (cabinet.tcompTYPE_NONE, cabinet.tcompTYPE_MSZIP):
+            self.check(self.make(folders=[(typeCompress, self.members)]))
+
+    def test_folders(self):
+        #MSZIP blocks refer back into the previous block, but not the previous folder
+        folders = [(cabinet.tcompTYPE_MSZIP, self.members[:4]),
+                   (cabinet.tcompTYPE_NONE, self.members[4:7]),
+                   (cabinet.tcompTYPE_MSZIP, self.members[7:])]
+        self.check(self.make(folders=folders, reserve=(0, 0, 4)))
+
+    def test_extract(self):
+        target = os.path.join(self.tmp, "out")
+        with cabinet.CabinetFile(self.make()) as cab:
+            cab.extract(target)
+        for name, data in self.members:
+            with open(os.path.join(target, *name.split("\\")), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_damaged(self):
+        path = self.make(folders=[(cabinet.tcompTYPE_MSZIP, self.members)])
+        with open(path, "rb") as f:
+            blob = bytearray(f.read())
+        with cabinet.CabinetFile(bytes(blob)) as cab:
+            start = cab._getdirectory().folders[0].coffCabStart
+        blob[start + 8:start + 10] = b"XX" #the CK signature of the first block
+        with cabinet.CabinetFile(bytes(blob)) as cab:
+            self.assertCabinetError(cabinet.FDIERROR_CORRUPT_CABINET, cab.read, "small.txt")
+
+
+class CheckpointTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        self.path = self.make(folders=[(cabinet.tcompTYPE_MSZIP, self.members)])
+
+    def test_checkpoints(self):
+        rnd = random.Random(5)
+        with cabinet.CabinetFile(self.path, checkpoint_interval=2, block_cache=False) as cab:
+            folder = cab._getdirectory().folders[0]
+            index = cab.getindex(folder)
+            self.assertTrue(len(index) > 4)
+            self.assertEqual(index.uoffsets[-1], sum(len(d) for d in self.data.values()))
+            for name in rnd.sample(self.names, len(self.names)):
+                self.assertEqual(cab.read(name), self.data[name])
+            self.assertTrue(index.checkpoints)
+            self.assertTrue(all(i % index.spacing == 0 for i in index.checkpoints))
+
+    def test_no_checkpoint_memory(self):
+        with cabinet.CabinetFile(self.path, checkpoint_memory=0, block_cache=False) as cab:
+            for name in reversed(self.names):
+                self.assertEqual(cab.read(name), self.data[name])
+            self.assertEqual(cab.getindex(cab._getdirectory().folders[0]).checkpoints, {})
+
+
+class OpenTest(CabinetTest):
+    def test_stream(self):
+        with cabinet.CabinetFile(self.make(), block_cache=False) as cab:
+            for name, data in self.members:
+                with cab.open(name) as f:
+                    chunks = []
+                    while True:
+                        chunk = f.read(1000)
+                        if not chunk:
+                            break
+                        chunks.append(chunk)
+                self.assertEqual(b"".join(chunks), data)
+            with cab.open(cab.getinfo("small.txt")) as f:
+                self.assertEqual(f.readline(), b"small\n")
+            self.assertRaises(KeyError, cab.open, "missing")
+            self.assertRaises(ValueError, cab.open, "small.txt", "w")
+
+    def test_seek(self):
+        name = "dir\\file4.txt"
+        data = self.data[name]
+        with cabinet.CabinetFile(self.make(), checkpoint_interval=1) as cab:
+            with cab.open(name) as f:
+                self.assertTrue(f.seekable())
+                for pos in (len(data) - 100, 3, len(data) // 2, len(data), 0):
+                    f.seek(pos)
+                    self.assertEqual(f.tell(), pos)
+                    self.assertEqual(f.read(5000), data[pos:pos + 5000])
+                f.seek(-10, io.SEEK_END)
+                self.assertEqual(f.read(), data[-10:])
+                f.seek(-20, io.SEEK_CUR)
+                self.assertEqual(f.read(5), data[-20:-15])
+
+
+class ParallelTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        folders = [(cabinet.tcompTYPE_MSZIP, self.members[i:i + 3]) for i in range(0, 10, 3)]
+        self.path = self.make(folders=folders)
+
+    def test_read_many(self):
+        names = list(reversed(self.names))
+        expected = [self.data[n] for n in names]
+        with cabinet.CabinetFile(self.path, block_cache=False) as cab:
+            self.assertEqual(len(cab._getdirectory().folders), 4)
+            self.assertEqual(cab.read_many(names), expected)
+            self.assertEqual(cab.read_many(names, workers=3), expected)
+            self.assertEqual(cab.read_many(names, workers=None), expected)
+            self.assertEqual(cab.read_many(names, workers=2, executor="process"), expected)
+            self.assertRaises(KeyError, cab.read_many, ["missing"])
+
+    def test_extract(self):
+        for executor in ("thread", "process"):
+            target = os.path.join(self.tmp, executor)
+            with cabinet.CabinetFile(self.path, block_cache=False) as cab:
+                cab.extract(target, workers=3, executor=executor)
+            for name, data in self.members:
+                with open(os.path.join(target, *name.split("\\")), "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+
+class ThreadTest(CabinetTest):
+    def read_concurrently(self, cab, threads=8, reads=20):
+        errors = []
+        def reader(seed):
+            rnd = random.Random(seed)
+            try:
+                for _ in range(reads):
+                    name = rnd.choice(self.names)
+                    pos = rnd.randrange(len(self.data[name]) + 1)
+                    if rnd.random() < 0.5:
+                        data = cab.read(name)[pos:]
+                    else:
+                        with cab.open(name) as f:
+                            f.seek(pos)
+                            data = f.read()
+                    if data != self.data[name][pos:]:
+                        errors.append(name)
+            except Exception as e:
+                errors.append(repr(e))
+        pool = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test_threads(self):
+        path = self.make()
+        with open(path, "rb") as f:
+            blob = f.read()
+        with cabinet.CabinetFile(path, checkpoint_interval=1, block_cache=False) as cab:
+            self.read_concurrently(cab)
+        with cabinet.CabinetFile(path, use_mmap=False, block_cache=False) as cab:
+            self.read_concurrently(cab)
+        with open(path, "rb") as f:
+            with cabinet.CabinetFile(f, block_cache=False) as cab:
+                self.read_concurrently(cab)
+        with cabinet.CabinetFile(blob) as cab:
+            self.read_concurrently(cab)
+
+
+class TestCabinetTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        with open(self.make(), "rb") as f:
+            self.blob = f.read()
+        with cabinet.CabinetFile(self.blob) as cab:
+            self.folders = cab._getdirectory().folders
+
+    def test_ok(self):
+        with cabinet.CabinetFile(self.blob) as cab:
+            report = cab.testcabinet()
+            self.assertTrue(report, report.problems())
+            self.assertEqual(len(report.folders), 2)
+            self.assertEqual(sum(len(f.blocks) for f in report.folders),
+                             sum(f.cCFData for f in self.folders))
+            self.assertTrue(cab.testcabinet(decompress=False))
+
+    def test_checksum(self):
+        #a flipped bit in a stored block is only found by the checksum
+        damaged = bytearray(self.blob)
+        damaged[self.folders[1].coffCabStart + 100] ^= 0x10
+        with cabinet.CabinetFile(bytes(damaged)) as cab:
+            self.assertFalse(cab.testcabinet())
+            self.assertFalse(cab.testcabinet(decompress=False))
+            self.assertTrue(cab.testcabinet(checksums=False))
+
+    def test_truncated(self):
+        start = self.folders[0].coffCabStart
+        for size in (len(self.blob) // 2, start - 10, 40):
+            with cabinet.CabinetFile(self.blob[:size]) as cab:
+                report = cab.testcabinet()
+                self.assertFalse(report)
+                self.assertTrue(report.problems())
+
+    def test_fuzz(self):
+        #whatever the damage, testcabinet() reports it instead of raising
+        rnd = random.Random(4)
+        for _ in range(200):
+            damaged = bytearray(self.blob)
+            for _ in range(rnd.randrange(1, 4)):
+                damaged[rnd.randrange(len(self.blob) // 4)] = rnd.getrandbits(8)
+            try:
+                cab = cabinet.CabinetFile(bytes(damaged))
+            except cabinet.CabinetError:
+                continue
+            with cab:
+                cab.testcabinet()
+
+
+class DirectoryCacheTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        if cabinet.sqlite3 is None:
+            self.skipTest("no sqlite3")
+        self.cache = cabinet.DirectoryCache(os.path.join(self.tmp, "cache.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        CabinetTest.tearDown(self)
+
+    def listing(self, path):
+        #the names listed through the cache, and the reads it took
+        stats = cabinet.CabinetStats()
+        with cabinet.CabinetFile(path, cache=self.cache, stats=stats) as cab:
+            names = cab.namelist()
+        return names, stats.snapshot()["io_read_count"]
+
+    def test_lookup(self):
+        path = self.make()
+        names, reads = self.listing(path)
+        self.assertEqual(names, self.names)
+        self.assertTrue(reads)
+        #a warm lookup does no cabinet I/O, and the members can still be read
+        self.assertEqual(self.listing(path), (self.names, 0))
+        with cabinet.CabinetFile(path, cache=self.cache) as cab:
+            self.assertEqual(cab.getinfo("small.txt").file_size, 6)
+            self.assertEqual(cab.read("dir\\file7.txt"), self.data["dir\\file7.txt"])
+
+    def test_invalidation(self):
+        path = self.make()
+        self.listing(path)
+        #a changed mtime
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime - 100))
+        self.assertEqual(self.cache.lookup(path), None)
+        names, reads = self.listing(path)
+        self.assertTrue(reads)
+        self.assertEqual(self.listing(path), (self.names, 0))
+        #a changed size
+        with open(path, "ab") as f:
+            f.write(b"\0" * 10)
+        self.assertEqual(self.cache.lookup(path), None)
+        names, reads = self.listing(path)
+        self.assertTrue(reads)
+        self.assertEqual(names, self.names)
+
+    def test_prune(self):
+        paths = [self.make("a.cab"), self.make("b.cab")]
+        for path in paths:
+            self.listing(path)
+        os.remove(paths[0])
+        self.assertEqual(self.cache.prune(), 1)
+        self.assertEqual(self.cache.prune(), 0)
+        self.assertEqual(self.cache.lookup(paths[1]).cFiles, len(self.names))
+
+    def test_search(self):
+        a = self.make("a.cab")
+        b = self.make("b.cab", folders=[(cabinet.tcompTYPE_NONE, [("DIR\\Other.TXT", b"x")])])
+        for path in (a, b):
+            self.listing(path)
+        found = [(os.path.basename(p), info.filename) for p, info in self.cache.search("*.txt")]
+        self.assertEqual(found, [("a.cab", name) for name in self.names if name.endswith(".txt")] +
+                         [("b.cab", "DIR\\Other.TXT")])
+        found = [info.filename for p, info in self.cache.search("dir\\file?.bin")]
+        self.assertEqual(found, ["dir\\file0.bin", "dir\\file3.bin", "dir\\file6.bin"])
+        self.assertEqual(list(self.cache.search("*.dll")), [])
+
+    def test_search_unicode(self):
+        #search() ignores case beyond ascii, like select()
+        name = u"\u00c4u\u00dfere.txt"
+        path = self.make(folders=[(cabinet.tcompTYPE_NONE, [("XXuXXere.txt", b"road")])])
+        with open(path, "rb") as f:
+            blob = bytearray(f.read())
+        pos = blob.find(b"XXuXXere.txt\0")
+        struct.pack_into("<H", blob, pos - 2, 0x20 | cabinet._A_NAME_IS_UTF)
+        blob[pos:pos + 12] = name.encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(bytes(blob))
+        self.listing(path)
+        with cabinet.CabinetFile(path) as cab:
+            for pattern in (u"\u00e4u\u00dfere.*", u"\u00c4U\u00dfERE.*", u"*\u00dfe?e.TXT"):
+                self.assertEqual([info.filename for p, info in self.cache.search(pattern)],
+                                 [name], pattern)
+                self.assertEqual(cab.select(pattern), [name], pattern)
+            if hasattr(name, "casefold"):
+                self.assertEqual(len(list(self.cache.search(u"\u00c4USSERE.*"))), 1)
+                self.assertEqual(cab.select(u"\u00c4USSERE.*"), [name])
+
+
+class BlockCacheTest(CabinetTest):
+    def test_budget(self):
+        cache = cabinet.BlockCache(budget=250)
+        for i in range(3):
+            cache.put(("cab", 0, i), b"%d" % i * 100)
+        #the oldest block is dropped to stay within the budget
+        self.assertEqual((len(cache), cache.size, cache.evictions), (2, 200, 1))
+        self.assertEqual(cache.get(("cab", 0, 0)), None)
+        #a lookup makes a block the most recently used
+        self.assertEqual(cache.get(("cab", 0, 1)), b"1" * 100)
+        cache.put(("cab", 0, 3), b"3" * 100)
+        self.assertEqual(cache.get(("cab", 0, 2)), None)
+        self.assertEqual(cache.get(("cab", 0, 1)), b"1" * 100)
+        #blocks larger than the budget are not kept
+        cache.put(("cab", 0, 4), b"4" * 300)
+        self.assertEqual(cache.get(("cab", 0, 4)), None)
+        self.assertEqual(cache.stats(), dict(hits=2, misses=3, evictions=2, blocks=2,
+                                             size=200, budget=250))
+        cache.discard("cab")
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_reads(self):
+        path = self.make()
+        cache = cabinet.BlockCache()
+        stats = cabinet.CabinetStats()
+        name = "dir\\file7.txt"
+        with cabinet.CabinetFile(path, block_cache=cache, stats=stats) as cab:
+            self.assertEqual(cab.read(name), self.data[name])
+            blocks = len(cache)
+            self.assertTrue(blocks)
+            self.assertEqual((cache.hits, cache.misses), (0, blocks))
+            decoded = stats.snapshot()["decode_count"]
+            #read again, from the cache
+            self.assertEqual(cab.read(name), self.data[name])
+            self.assertEqual((cache.hits, cache.misses), (blocks, blocks))
+            self.assertEqual(stats.snapshot()["decode_count"], decoded)
+            self.assertEqual(stats.snapshot()["cache_hit_count"], blocks)
+
+    def test_no_cache(self):
+        path = self.make()
+        shared = cabinet.block_cache.stats()
+        stats = cabinet.CabinetStats()
+        with cabinet.CabinetFile(path, block_cache=False, stats=stats) as cab:
+            self.assertEqual(cab.block_cache, None)
+            for _ in range(2):
+                self.assertEqual(cab.read_many(self.names), [self.data[n] for n in self.names])
+        counters = stats.snapshot()
+        self.assertEqual(counters["cache_hit_count"], 0)
+        self.assertEqual(counters["decode_bytes"], 2 * sum(map(len, self.data.values())))
+        self.assertEqual(cabinet.block_cache.stats(), shared)
+
+
+class AsyncTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        if cabinet.asyncio is None or not hasattr(cabinet.asyncio, "run"):
+            self.skipTest("no asyncio.run")
+
+    def run_async(self, func):
+        #run the coroutine function func with an AsyncCabinetFile
+        async def main():
+            async with cabinet.AsyncCabinetFile(self.make(), max_workers=2) as acf:
+                return await func(acf)
+        return cabinet.asyncio.run(main())
+
+    def test_infolist(self):
+        async def infolist(acf):
+            return await acf.infolist()
+        infos = self.run_async(infolist)
+        self.assertEqual([info.filename for info in infos], self.names)
+        self.assertEqual([info.file_size for info in infos], [len(d) for _, d in self.members])
+
+    def test_read(self):
+        async def read(acf):
+            return await cabinet.asyncio.gather(*[acf.read(name) for name in self.names])
+        self.assertEqual(self.run_async(read), [self.data[n] for n in self.names])
+
+    def test_extract(self):
+        target = os.path.join(self.tmp, "out")
+        async def extract(acf):
+            await acf.extract(target, ["small.txt", "dir\\file7.txt"])
+        self.run_async(extract)
+        self.assertEqual(sorted(os.listdir(target)), ["dir", "small.txt"])
+        with open(os.path.join(target, "dir", "file7.txt"), "rb") as f:
+            self.assertEqual(f.read(), self.data["dir\\file7.txt"])
+
+    def test_open(self):
+        name = "dir\\file3.bin"
+        async def stream(acf):
+            chunks = []
+            async with acf.open(name, chunk_size=5000) as reader:
+                async for chunk in reader:
+                    chunks.append(chunk)
+            return chunks
+        chunks = self.run_async(stream)
+        self.assertEqual(b"".join(chunks), self.data[name])
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) <= 5000 for chunk in chunks))
+
+
+class WriteTest(CabinetTest):
+    def check(self, path):
+        #read back a cabinet of the members, returning its number of folders
+        with cabinet.CabinetFile(path) as cab:
+            self.assertEqual(cab.namelist(), self.names)
+            for name, data in self.members:
+                self.assertEqual(cab.getinfo(name).file_size, len(data))
+                self.assertEqual(cab.read(name), data)
+            report = cab.testcabinet()
+            self.assertTrue(report, report.problems())
+            return len(cab._getdirectory().folders)
+
+    def test_stored(self):
+        path = self.write(compression=cabinet.tcompTYPE_NONE)
+        self.assertEqual(self.check(path), 1)
+
+    def test_mszip(self):
+        path = self.write()
+        self.assertEqual(self.check(path), 1)
+
+    def test_folders(self):
+        for compression in (cabinet.tcompTYPE_NONE, cabinet.tcompTYPE_MSZIP):
+            path = self.write(compression=compression, folder_size=100000)
+            self.assertTrue(self.check(path) > 1)
+
+    def test_workers(self):
+        path = self.write(folder_size=100000, workers=2)
+        self.assertTrue(self.check(path) > 1)
+
+    def test_write_file(self):
+        src = os.path.join(self.tmp, "src.bin")
+        with open(src, "wb") as f:
+            f.write(self.data["dir\\file0.bin"])
+        os.utime(src, (1300000000, 1300000000))
+        path = os.path.join(self.tmp, "file.cab")
+        with cabinet.CabinetFile(path, "w") as cab:
+            cab.write(src, "copy.bin")
+        with cabinet.CabinetFile(path) as cab:
+            self.assertEqual(cab.read("copy.bin"), self.data["dir\\file0.bin"])
+            #FAT times have a resolution of two seconds
+            fat = cabinet.EncodeFATTime(time.localtime(1300000000)[:6])
+            self.assertEqual(cab.getinfo("copy.bin").date_time, cabinet.DecodeFATTime(*fat))
+
+    def test_info(self):
+        info = cabinet.CabinetInfo("info.txt", DATE_TIME)
+        info.external_attr = cabinet._A_RDONLY | cabinet._A_ARCH
+        path = self.write(members=[(info, b"data")])
+        with cabinet.CabinetFile(path) as cab:
+            got = cab.getinfo("info.txt")
+            self.assertEqual(got.date_time, DATE_TIME)
+            self.assertEqual(got.external_attr, info.external_attr)
+        with open(path, "rb") as f:
+            self.assertTrue(struct.pack("<HHH", FAT_DATE, FAT_TIME, info.external_attr) in f.read())
+
+    def test_fat_time(self):
+        self.assertEqual(cabinet.EncodeFATTime(DATE_TIME), (FAT_DATE, FAT_TIME))
+        self.assertEqual(cabinet.DecodeFATTime(FAT_DATE, FAT_TIME), DATE_TIME)
+        for date_time in [(1980, 1, 1, 0, 0, 0), (1999, 12, 31, 23, 59, 58),
+                          (2024, 2, 29, 12, 30, 10), (2107, 12, 31, 23, 59, 58)]:
+            self.assertEqual(cabinet.DecodeFATTime(*cabinet.EncodeFATTime(date_time)), date_time)
+        #odd seconds are rounded down, and times before 1980 clamped
+        self.assertEqual(cabinet.DecodeFATTime(*cabinet.EncodeFATTime((2000, 5, 6, 7, 8, 9))),
+                         (2000, 5, 6, 7, 8, 8))
+        self.assertEqual(cabinet.DecodeFATTime(*cabinet.EncodeFATTime((1970, 5, 6, 7, 8, 9))),
+                         (1980, 1, 1, 0, 0, 0))
+
+    def test_utf8_names(self):
+        name = u"d\u00e9j\u00e0.txt"
+        path = self.write(members=[(name, b"vu"), ("plain.txt", b"")])
+        with cabinet.CabinetFile(path) as cab:
+            self.assertEqual(cab.namelist(), [name, "plain.txt"])
+            self.assertEqual(cab.read(name), b"vu")
+            self.assertTrue(cab.getinfo(name).external_attr & cabinet._A_NAME_IS_UTF)
+            self.assertFalse(cab.getinfo("plain.txt").external_attr & cabinet._A_NAME_IS_UTF)
+
+    def test_bad_mode(self):
+        self.assertRaises(ValueError, cabinet.CabinetFile, os.path.join(self.tmp, "x.cab"), "a")
+        with cabinet.CabinetFile(self.write()) as cab:
+            self.assertRaises(ValueError, cab.writestr, "more.txt", b"")
+        #an object whose __init__ failed early can still be collected
+        cabinet.CabinetFile.__new__(cabinet.CabinetFile).__del__()
+
+
+class StatsTest(CabinetTest):
+    def test_snapshot(self):
+        path = self.make()
+        stats = cabinet.CabinetStats()
+        with cabinet.CabinetFile(path, stats=stats, block_cache=False) as cab:
+            self.assertEqual(cab.read("dir\\file7.txt"), self.data["dir\\file7.txt"])
+            counters = stats.snapshot()
+            self.assertEqual(counters["read_count"], 1)
+            self.assertEqual(counters["folder_count"], 1)
+            self.assertTrue(counters["io_read_count"] > 0)
+            self.assertTrue(counters["io_read_bytes"] >= counters["decode_bytes"]
+                            >= len(self.data["dir\\file7.txt"]))
+            self.assertEqual(counters["extract_count"], 0)
+            for event in cabinet.CabinetStats.EVENTS:
+                self.assertTrue(counters[event + "_seconds"] >= 0)
+            target = os.path.join(self.tmp, "out")
+            cab.extract(target)
+        counters = stats.snapshot()
+        self.assertEqual(counters["extract_count"], 1)
+        self.assertEqual(counters["io_write_bytes"], sum(len(d) for d in self.data.values()))
+        self.assertEqual(counters["folder_count"], 3)
+        stats.reset()
+        self.assertEqual(set(stats.snapshot().values()), set([0]))
+
+    def test_hook(self):
+        events = []
+        stats = cabinet.CabinetStats(hook=lambda *event: events.append(event))
+        with cabinet.CabinetFile(self.make(), stats=stats, block_cache=False) as cab:
+            cab.read("small.txt")
+        counters = stats.snapshot()
+        self.assertTrue(events)
+        self.assertEqual(events[-1][0], "read")
+        for name in set(event for event, _, _ in events):
+            matching = [e for e in events if e[0] == name]
+            self.assertEqual(counters[name + "_count"], len(matching))
+            self.assertEqual(counters[name + "_bytes"], sum(e[1] for e in matching))
+
+
+class ScanTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        with open(self.make(), "rb") as f:
+            self.cab = f.read()
+        rnd = random.Random(7)
+        stub = b"MZ" + _random(rnd, 5000).replace(b"MSCF", b"mscf")
+        #a header that passes the signature and version checks but claims more
+        #data than the file holds
+        self.false = false = struct.pack("<4sIIIIIBBHHHHH", b"MSCF", 0, 10 ** 8, 0, 44, 0, 3, 1, 1, 1, 0, 0, 0)
+        self.offset = len(stub) + len(false) + 300
+        self.exe = stub + false + b"\0" * 300 + self.cab + b"MSCF trailing"
+
+    def write_file(self, name, data):
+        path = os.path.join(self.tmp, *name.split("/"))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_embedded(self):
+        found = cabinet.find_cabinets(self.exe)
+        self.assertEqual([offset for offset, info in found], [self.offset])
+        info = found[0][1]
+        self.assertEqual((info.cbCabinet, info.cFolders, info.cFiles),
+                         (len(self.cab), 2, len(self.names)))
+        with cabinet.CabinetFile(self.exe[self.offset:self.offset + info.cbCabinet]) as cab:
+            self.assertEqual(cab.read("dir\\file4.txt"), self.data["dir\\file4.txt"])
+        #only the start is checked without embedded
+        self.assertEqual(cabinet.find_cabinets(self.exe, embedded=False), [])
+        self.assertEqual([o for o, i in cabinet.find_cabinets(self.cab, embedded=False)], [0])
+        #two cabinets back to back, in a file
+        path = self.write_file("two.bin", self.exe + self.cab)
+        self.assertEqual([o for o, i in cabinet.find_cabinets(path)],
+                         [self.offset, len(self.exe)])
+
+    def test_false_signature(self):
+        blob = b"text mentioning MSCF, " * 10 + self.false + self.cab
+        self.assertEqual([o for o, i in cabinet.find_cabinets(blob)], [len(blob) - len(self.cab)])
+        self.assertEqual(cabinet.find_cabinets(b"MSCF" * 100), [])
+        #a real cabinet cut short is not one
+        self.assertEqual(cabinet.find_cabinets(b"\0" * 10 + self.cab[:-10]), [])
+
+    def test_is_cabinetfile(self):
+        path = self.write_file("test.cab", self.cab)
+        self.assertEqual(cabinet.is_cabinetfile(path).cFiles, len(self.names))
+        self.assertEqual(cabinet.is_cabinetfile(self.cab).cbCabinet, len(self.cab))
+        self.assertFalse(cabinet.is_cabinetfile(self.write_file("setup.exe", self.exe)))
+
+    def test_scan(self):
+        root = os.path.join(self.tmp, "root")
+        a = self.write_file("root/a.cab", self.cab)
+        exe = self.write_file("root/sub/setup.exe", self.exe)
+        self.write_file("root/sub/notes.txt", b"MSCF is the signature")
+        self.write_file("root/z/empty.bin", b"")
+        expected = [(a, 0), (exe, self.offset)]
+        for workers in (1, 3):
+            found = [(path, offset) for path, offset, info in cabinet.scan(root, workers=workers)]
+            self.assertEqual(found, expected)
+        found = [(path, offset) for path, offset, info in cabinet.scan([root], embedded=False)]
+        self.assertEqual(found, [(a, 0)])
+        self.assertEqual(list(cabinet.scan(os.path.join(self.tmp, "missing"))), [])
+
+
+class IncrementalTest(CabinetTest):
+    def extracted(self, target, name):
+        with open(os.path.join(target, *name.split("\\")), "rb") as f:
+            return f.read()
+
+    def test_incremental(self):
+        path = self.write(folder_size=100000)
+        target = os.path.join(self.tmp, "out")
+        stats = cabinet.CabinetStats()
+        with cabinet.CabinetFile(path, stats=stats, block_cache=False) as cab:
+            self.assertEqual(sorted(cab.extract(target, incremental=True).written), sorted(self.names))
+            #nothing to write decodes nothing
+            stats.reset()
+            report = cab.extract(target, incremental=True)
+            self.assertEqual(report.written, [])
+            self.assertEqual(sorted(report.skipped), sorted(self.names))
+            self.assertEqual(stats.snapshot()["decode_count"], 0)
+
+            #a file changed in place, with its size and time kept
+            changed = os.path.join(target, "dir", "file2.txt")
+            st = os.stat(changed)
+            with open(changed, "r+b") as f:
+                f.write(b"X")
+            os.utime(changed, (st.st_atime, st.st_mtime))
+            report = cab.extract(target, incremental=True)
+            self.assertEqual(report.written, [])
+            report = cab.extract(target, incremental="content")
+            self.assertEqual(report.written, ["dir\\file2.txt"])
+
+            #a removed file and a file of another size
+            os.remove(os.path.join(target, "small.txt"))
+            with open(os.path.join(target, "dir", "file3.bin"), "ab") as f:
+                f.write(b"more")
+            report = cab.extract(target, incremental=True)
+            self.assertEqual(sorted(report.written), ["dir\\file3.bin", "small.txt"])
+        for name, data in self.members:
+            self.assertEqual(self.extracted(target, name), data)
+        #the files written have the members' times
+        with cabinet.CabinetFile(path) as cab:
+            info = cab.getinfo("small.txt")
+        mtime = time.localtime(os.stat(os.path.join(target, "small.txt")).st_mtime)
+        self.assertEqual(cabinet.EncodeFATTime(mtime), (info.fat_date, info.fat_time))
+
+
+class SelectTest(CabinetTest):
+    def test_select(self):
+        with cabinet.CabinetFile(self.make()) as cab:
+            self.assertEqual(cab.select("*.bin"), [n for n in self.names if n.endswith(".bin")])
+            self.assertEqual(cab.select("DIR\\FILE?.TXT"), cab.select("dir\\file?.txt"))
+            self.assertEqual(cab.select(re.compile(r"small")), ["small.txt"])
+            self.assertEqual(cab.select(["empty.txt", "dir\\file1*"]),
+                             ["empty.txt", "dir\\file1.txt"])
+            self.assertEqual(cab.select(set(["small.txt", "missing.txt"])), ["small.txt"])
+            self.assertEqual(cab.select("nothing*"), [])
+
+    def test_extract(self):
+        target = os.path.join(self.tmp, "out")
+        stats = cabinet.CabinetStats()
+        #members of the first folder, which ends before its last member
+        with cabinet.CabinetFile(self.make(), stats=stats, block_cache=False) as cab:
+            cab.extract(target, ["small.txt", "dir\\file0.bin"])
+            first = cab.getindex(cab._getdirectory().folders[0])
+        self.assertEqual(sorted(os.listdir(target)), ["dir", "small.txt"])
+        self.assertEqual(os.listdir(os.path.join(target, "dir")), ["file0.bin"])
+        counters = stats.snapshot()
+        self.assertEqual(counters["folder_count"], 1)
+        self.assertTrue(6 + len(self.data["dir\\file0.bin"]) <= counters["decode_bytes"]
+                        < first.uoffsets[-1])
+
+
+class ManifestTest(CabinetTest):
+    def test_manifest(self):
+        with cabinet.CabinetFile(self.write(folder_size=100000)) as cab:
+            for workers in (1, 2):
+                manifest = cab.manifest(("sha256", "md5"), workers=workers)
+                self.assertEqual([info.filename for info, _ in manifest], self.names)
+                for info, digests in manifest:
+                    data = self.data[info.filename]
+                    self.assertEqual(info.file_size, len(data))
+                    self.assertEqual(digests["sha256"], hashlib.sha256(data).hexdigest())
+                    self.assertEqual(digests["md5"], hashlib.md5(data).hexdigest())
+            manifest = cab.manifest(names="*.bin")
+            self.assertEqual([info.filename for info, _ in manifest], cab.select("*.bin"))
+            self.assertEqual(list(manifest[0][1]), ["sha256"])
+            self.assertRaises(ValueError, cab.manifest, "nosuchhash")
+
+    def test_decodes_once(self):
+        stats = cabinet.CabinetStats()
+        with cabinet.CabinetFile(self.make(), stats=stats, block_cache=False) as cab:
+            cab.manifest()
+            blocks = sum(len(cab.getindex(f)) for f in cab._getdirectory().folders)
+        counters = stats.snapshot()
+        self.assertEqual(counters["folder_count"], 2)
+        self.assertEqual(counters["decode_count"], blocks)
+        self.assertEqual(counters["manifest_count"], 1)
+
+
+class TranscodeTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        self.path = self.write(folder_size=100000)
+
+    def test_zip(self):
+        output = os.path.join(self.tmp, "out.zip")
+        with cabinet.CabinetFile(self.path) as cab:
+            self.assertEqual(cab.transcode(output), len(self.names))
+        with zipfile.ZipFile(output) as z:
+            self.assertEqual(z.namelist(), [n.replace("\\", "/") for n in self.names])
+            for name, data in self.members:
+                self.assertEqual(z.read(name.replace("\\", "/")), data)
+            zinfo = z.getinfo("dir/file1.txt")
+        with cabinet.CabinetFile(self.path) as cab:
+            self.assertEqual(zinfo.date_time, cab.getinfo("dir\\file1.txt").date_time)
+
+    def test_tar(self):
+        output = io.BytesIO()
+        with cabinet.CabinetFile(self.path) as cab:
+            cab.transcode(output, "tar.gz", names="*.txt")
+        output.seek(0)
+        with tarfile.open(fileobj=output) as t:
+            names = [n for n in self.names if n.endswith(".txt")]
+            self.assertEqual(t.getnames(), [n.replace("\\", "/") for n in names])
+            for name in names:
+                self.assertEqual(t.extractfile(name.replace("\\", "/")).read(), self.data[name])
+
+    def test_names(self):
+        #names are made safe, as when they are extracted
+        members = [("..\\..\\evil.txt", b"1"), ("C:\\abs\\x.txt", b"2"), ("\\root.txt", b"3"),
+                   ("ok\\.\\y.txt", b"4")]
+        path = self.write("names.cab", members)
+        output = os.path.join(self.tmp, "names.zip")
+        target = os.path.join(self.tmp, "out")
+        with cabinet.CabinetFile(path) as cab:
+            cab.transcode(output)
+            cab.extract(target)
+        safe = ["evil.txt", "abs/x.txt", "root.txt", "ok/y.txt"]
+        with zipfile.ZipFile(output) as z:
+            self.assertEqual(z.namelist(), safe)
+        for name, (_, data) in zip(safe, members):
+            with open(os.path.join(target, *name.split("/")), "rb") as f:
+                self.assertEqual(f.read(), data)
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["names.cab", "names.zip", "out", "test.cab"])
+
+
+class BatchTest(CabinetTest):
+    def setUp(self):
+        CabinetTest.setUp(self)
+        self.paths = [self.write("a.cab"), self.write("b.cab", folder_size=100000)]
+        with open(os.path.join(self.tmp, "bad.cab"), "wb") as f:
+            f.write(b"MSCF" + b"\0" * 100)
+        self.paths.append(os.path.join(self.tmp, "bad.cab"))
+
+    def results(self, *args, **kwargs):
+        results = list(cabinet.batch(*args, **kwargs))
+        return dict((os.path.basename(r["path"]), r) for r in results)
+
+    def test_list(self):
+        #a directory is searched for files with a valid cabinet header
+        results = self.results("list", [self.tmp], executor="thread")
+        self.assertEqual(sorted(results), ["a.cab", "b.cab"])
+        results = self.results("list", self.paths, executor="thread")
+        self.assertEqual(sorted(results), ["a.cab", "b.cab", "bad.cab"])
+        self.assertTrue(results["a.cab"]["ok"])
+        self.assertEqual([m["name"] for m in results["b.cab"]["members"]], self.names)
+        self.assertFalse(results["bad.cab"]["ok"])
+        self.assertTrue(results["bad.cab"]["error"])
+
+    def test_test_and_manifest(self):
+        listing = os.path.join(self.tmp, "cabinets.txt")
+        with open(listing, "w") as f:
+            f.write("\n".join(self.paths[:2]) + "\n")
+        results = self.results("test", ["@" + listing], workers=2)
+        self.assertEqual(sorted(results), ["a.cab", "b.cab"])
+        self.assertTrue(all(r["ok"] for r in results.values()))
+        results = self.results("manifest", self.paths[:1], executor="thread")
+        digests = dict((m["name"], m["sha256"]) for m in results["a.cab"]["members"])
+        self.assertEqual(digests, dict((n, hashlib.sha256(d).hexdigest()) for n, d in self.members))
+
+    def test_extract(self):
+        target = os.path.join(self.tmp, "out")
+        results = self.results("extract", self.paths[:2], executor="thread", target=target)
+        self.assertTrue(all(r["ok"] for r in results.values()))
+        self.assertEqual(sorted(os.listdir(target)), ["a", "b"])
+        self.assertEqual(results["b.cab"]["target"], os.path.join(target, "b"))
+
+    def test_extract_same_names(self):
+        #cabinets of the same name from different directories do not collide
+        root = os.path.join(self.tmp, "root")
+        for sub in ("x", "y"):
+            os.makedirs(os.path.join(root, sub))
+            shutil.copy(self.paths[0], os.path.join(root, sub, "a.cab"))
+        target = os.path.join(self.tmp, "out")
+        results = list(cabinet.batch("extract", [root], workers=2, executor="thread",
+                                     target=target))
+        self.assertEqual(sorted(r["target"] for r in results),
+                         [os.path.join(target, "x", "a"), os.path.join(target, "y", "a")])
+        #listed by path, a number is added to names already taken
+        target = os.path.join(self.tmp, "out2")
+        paths = [self.paths[0], os.path.join(root, "x", "a.cab"), os.path.join(root, "y", "A.cab")]
+        os.rename(os.path.join(root, "y", "a.cab"), paths[2])
+        results = list(cabinet.batch("extract", paths, workers=1, target=target))
+        self.assertEqual([r["target"] for r in results],
+                         [os.path.join(target, name) for name in ("a", "a-2", "A-3")])
+        for r in results:
+            self.assertTrue(r["ok"], r)
+            self.assertEqual(r["written"], len(self.names))
+            with open(os.path.join(r["target"], "dir", "file5.txt"), "rb") as f:
+                self.assertEqual(f.read(), self.data["dir\\file5.txt"])
+
+    def test_unexpected_error(self):
+        #a failure the parser does not foresee only fails its own cabinet
+        infolist = cabinet.CabinetFile.infolist
+        def failing(cab):
+            if cab.filename.endswith("a.cab"):
+                raise RuntimeError("unexpected")
+            return infolist(cab)
+        cabinet.CabinetFile.infolist = failing
+        try:
+            results = self.results("list", self.paths[:2], executor="thread")
+        finally:
+            cabinet.CabinetFile.infolist = infolist
+        self.assertFalse(results["a.cab"]["ok"])
+        self.assertTrue("RuntimeError" in results["a.cab"]["problems"][0])
+        self.assertTrue(results["b.cab"]["ok"])
+
+
+if __name__ == "__main__":
+    unittest.main()
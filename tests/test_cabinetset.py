@@ -0,0 +1,149 @@
+"""Read sets of cabinets spanning several volumes, made with cabgen."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import cabinet
+import cabgen
+
+
+def _text(rnd, n):
+    words = [b"alpha", b"beta", b"gamma", b"delta", b"\n", b"cabinet", b"folder"]
+    return b" ".join(rnd.choice(words) for _ in range(n))[:n]
+
+def _random(rnd, n):
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(n)))
+
+
+class CabinetSetTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rnd = random.Random(11)
+        self.folders = [
+            (cabinet.tcompTYPE_MSZIP, [("a.txt", _text(rnd, 1000)),
+                                       ("big.bin", _random(rnd, 150000)),
+                                       ("b.txt", _text(rnd, 50000))]),
+            (cabinet.tcompTYPE_NONE, [("empty.txt", b""),
+                                      ("c.txt", _text(rnd, 70000))]),
+        ]
+        self.members = dict(m for _, members in self.folders for m in members)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_set(self, cuts, **kwargs):
+        volumes = cabgen.make_set(self.folders, cuts, **kwargs)
+        paths = []
+        for i, data in enumerate(volumes):
+            path = os.path.join(self.tmp, "disk%d.cab" % (i + 1))
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+        return paths
+
+    def check_set(self, paths, **options):
+        for start in paths:
+            with cabinet.CabinetSet(start, **options) as cs:
+                self.assertEqual(cs.volumes, paths)
+                self.assertEqual(sorted(cs.namelist()), sorted(self.members))
+                for name, data in self.members.items():
+                    self.assertEqual(cs.read(name), data, name)
+                self.assertTrue(len(cs._pool) <= cs.pool_size)
+
+    def test_continued_folders(self):
+        #big.bin starts in the first volume, runs through the second and ends
+        #in the third, and the second folder is divided between the last two
+        paths = self.write_set({1: None, 3: None, 8: None})
+        self.assertEqual(len(paths), 4)
+        self.check_set(paths)
+        self.check_set(paths, pool_size=1)
+
+    def test_split_blocks(self):
+        #blocks whose data is split between two volumes
+        paths = self.write_set({1: 100, 4: 1, 7: 2}, reserve=(0, 0, 3))
+        self.check_set(paths)
+
+    def test_seek_across_volumes(self):
+        paths = self.write_set({1: None, 3: 50, 4: None})
+        data = self.members["big.bin"]
+        with cabinet.CabinetSet(paths[-1], checkpoint_interval=1) as cs:
+            with cs.open("big.bin") as f:
+                for pos in (140000, 10, 70000, len(data)):
+                    f.seek(pos)
+                    self.assertEqual(f.read(5000), data[pos:pos + 5000])
+
+    def test_testcabinet_and_extract(self):
+        paths = self.write_set({2: None, 3: 7, 6: None})
+        target = os.path.join(self.tmp, "out")
+        with cabinet.CabinetSet(paths[1]) as cs:
+            report = cs.testcabinet()
+            self.assertTrue(report, report.problems())
+            self.assertTrue(cs.testcabinet(decompress=False))
+            cs.extract(target, workers=2)
+        for name, data in self.members.items():
+            with open(os.path.join(target, name), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_close(self):
+        paths = self.write_set({2: None, 5: None})
+        cs = cabinet.CabinetSet(paths[0])
+        cs.read_many(list(self.members))
+        sources = list(cs._pool.values())
+        self.assertTrue(sources)
+        cs.close()
+        self.assertEqual(len(cs._pool), 0)
+        for source in sources:
+            self.assertRaises(Exception, source.read_at, 0, 4)
+
+    def test_pool_eviction(self):
+        #volumes dropped from a full pool are closed, and reads go on
+        paths = self.write_set({1: None, 3: None, 8: None})
+        opened = []
+        open_source = cabinet.open_source
+        def recording_open_source(*args, **kwargs):
+            source = open_source(*args, **kwargs)
+            opened.append(source)
+            return source
+        cabinet.open_source = recording_open_source
+        try:
+            with cabinet.CabinetSet(paths[0], pool_size=1) as cs:
+                for name, data in sorted(self.members.items()):
+                    self.assertEqual(cs.read(name), data, name)
+                self.assertEqual(cs.read_many(sorted(self.members), workers=4),
+                                 [self.members[n] for n in sorted(self.members)])
+                pooled = list(cs._pool.values())
+                self.assertEqual(len(pooled), 1)
+                self.assertEqual(cs._dropped, set())
+        finally:
+            cabinet.open_source = open_source
+        self.assertTrue(len(opened) > len(paths))
+        for source in opened:
+            self.assertRaises(Exception, source.read_at, 0, 4)
+
+    def test_missing_volume(self):
+        paths = self.write_set({2: None, 5: None})
+        os.remove(paths[-1])
+        try:
+            cabinet.CabinetSet(paths[0])
+        except cabinet.CabinetError as e:
+            self.assertEqual(e.args[0], cabinet.FDIERROR_CABINET_NOT_FOUND)
+        else:
+            self.fail("a missing volume was not reported")
+
+    def test_wrong_set(self):
+        paths = self.write_set({2: None})
+        other = cabgen.make_set(self.folders, {2: None}, setID=0x1111)
+        with open(paths[1], "wb") as f:
+            f.write(other[1])
+        try:
+            cabinet.CabinetSet(paths[0])
+        except cabinet.CabinetError as e:
+            self.assertEqual(e.args[0], cabinet.FDIERROR_WRONG_CABINET)
+        else:
+            self.fail("a volume of another set was accepted")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Decode the cabinets in tests/data and compare them with known hashes.
+
+The LZX cabinets were made with a reference encoder and checked with the
+decoder of libarchive (bsdtar).  There is no independent Quantum decoder at
+hand, so the Quantum cabinets only guard against regressions in ours.
+"""
+import hashlib
+import os
+import unittest
+
+import cabinet
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+LZX = {
+    #window 2**15, with E8 translation, several block types and resets
+    "lzx15_e8.cab": (cabinet.tcompTYPE_LZX, 15, [
+        ("code.bin", 90000, "3d8dd8edf07731961ed0ac6ab6aacadce80781e735262dc6f274426d1e987bdc"),
+        ("text.txt", 30000, "075c8aa9f070c054145255dff90ab1045f518d3c6cd01b081dd7d736b1d38a4c"),
+    ]),
+    #window 2**21, with matches further back than 2**17
+    "lzx21.cab": (cabinet.tcompTYPE_LZX, 21, [
+        ("a.bin", 100000, "01e12b1b8d00cae9e88badd8ddfa8896cea6ee7cd1e9f99558ba9ea6499fce60"),
+        ("b.bin", 130000, "2a9e10447525ad1f191d906d3763b65a564b63f1e4f02166a7fa4a9c48509ecd"),
+    ]),
+}
+
+QUANTUM = {
+    "quantum15.cab": (cabinet.tcompTYPE_QUANTUM, 15, [
+        ("q1.txt", 30000, "4bfbaddacbb33960772326dd1a8639fa8a606a49525f327fff6a9ec1f2ae5677"),
+        ("q2.txt", 60000, "c079fa513651177d6d668bf7faa0bf0c516758810517fe47434b4195cbcc58ae"),
+    ]),
+    "quantum21.cab": (cabinet.tcompTYPE_QUANTUM, 21, [
+        ("q1.txt", 30000, "564aafaae8e18f1fcc0ff8ff51f0dd7f2e6e658fa20abdff799a1746098f0f35"),
+        ("q2.txt", 60000, "5d9db3f0f2ade894757ad5f32d11ca031d328366e1f105ef883f682c170cd545"),
+    ]),
+}
+
+
+class DecoderTest(unittest.TestCase):
+    def check_cabinet(self, filename, typeCompress, window, members):
+        with cabinet.CabinetFile(os.path.join(DATA, filename)) as cab:
+            for folder in cab._getdirectory().folders:
+                tc = folder.typeCompress
+                self.assertEqual(cabinet.CompressionTypeFromTCOMP(tc), typeCompress)
+                self.assertEqual(cabinet.CompressionMemoryFromTCOMP(tc), window)
+            self.assertEqual(cab.namelist(), [m[0] for m in members])
+            for name, size, digest in members:
+                data = cab.read(name)
+                self.assertEqual(len(data), size)
+                self.assertEqual(hashlib.sha256(data).hexdigest(), digest)
+            report = cab.testcabinet()
+            self.assertTrue(report, report.errors)
+
+    def test_lzx(self):
+        for filename, (typeCompress, window, members) in sorted(LZX.items()):
+            self.check_cabinet(filename, typeCompress, window, members)
+
+    def test_quantum(self):
+        for filename, (typeCompress, window, members) in sorted(QUANTUM.items()):
+            self.check_cabinet(filename, typeCompress, window, members)
+
+    def test_lzx_seek(self):
+        #resuming from a checkpoint must give the same data as decoding from the start
+        filename = os.path.join(DATA, "lzx15_e8.cab")
+        with cabinet.CabinetFile(filename, checkpoint_interval=1) as cab:
+            data = cab.read("code.bin")
+            with cab.open("code.bin") as f:
+                for pos in (70000, 5, 40000, 89999):
+                    f.seek(pos)
+                    self.assertEqual(f.read(1000), data[pos:pos + 1000])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Count what a RangeSource fetches, with an in-memory stand-in for an
+object store serving range requests.
+"""
+import random
+import unittest
+
+import cabinet
+import cabgen
+
+
+class RangeServer(object):
+    """Serves range requests from a buffer, and logs them"""
+    def __init__(self, data):
+        self.data = data
+        self.log = []
+
+    def __call__(self, offset, length):
+        self.log.append((offset, length))
+        return self.data[offset:offset + length]
+
+    def fetched(self):
+        return sum(len(self.data[o:o + l]) for o, l in self.log)
+
+
+class RangeSourceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rnd = random.Random(23)
+        #a directory larger than a page, followed by a folder of small members
+        #and a few folders of one large member each
+        small = [("dir\\member%04d.txt" % i, b"member %d\n" % i) for i in range(3000)]
+        folders = [(cabinet.tcompTYPE_NONE, small)]
+        for i in range(3):
+            data = bytes(bytearray(rnd.getrandbits(8) for _ in range(300000)))
+            folders.append((cabinet.tcompTYPE_NONE, [("large%d.bin" % i, data)]))
+        cls.blob = cabgen.make(folders)
+        cls.members = dict(m for _, members in folders for m in members)
+        cls.directory = cabinet.CabinetFile(cls.blob)._getdirectory()
+
+    def folder_range(self, name):
+        d = self.directory
+        info = cabinet.CabinetFile(self.blob).getinfo(name)
+        start = d.folders[info.folder_index].coffCabStart
+        ends = [f.coffCabStart for f in d.folders if f.coffCabStart > start]
+        return start, min(ends or [d.cbCabinet])
+
+    def open(self, **options):
+        server = RangeServer(self.blob)
+        cab = cabinet.CabinetFile(cabinet.RangeSource(server, **options), block_cache=False)
+        return server, cab
+
+    def test_listing(self):
+        #only the header and the directory, up to the first CFDATA block
+        server, cab = self.open()
+        self.assertTrue(self.directory.coffFiles + 64 * 1024 < self.directory.folders[0].coffCabStart)
+        self.assertEqual(sorted(cab.namelist()), sorted(self.members))
+        self.assertEqual(server.fetched(), self.directory.folders[0].coffCabStart)
+        self.assertEqual(cab._getsource().fetched, server.fetched())
+        self.assertTrue(len(server.log) <= 3, server.log)
+        cab.close()
+
+    def test_member(self):
+        #a member fetches its folder and nothing else
+        server, cab = self.open()
+        cab.namelist()
+        del server.log[:]
+        self.assertEqual(cab.read("large1.bin"), self.members["large1.bin"])
+        start, end = self.folder_range("large1.bin")
+        for offset, length in server.log:
+            self.assertTrue(start <= offset and offset + length <= end, (offset, length))
+        self.assertEqual(server.fetched(), end - start)
+        self.assertEqual(len(server.log), 1)
+        #then it is cached
+        del server.log[:]
+        self.assertEqual(cab.read("large1.bin"), self.members["large1.bin"])
+        self.assertEqual(server.log, [])
+        cab.close()
+
+    def test_readahead(self):
+        #a folder larger than readahead is fetched in requests of about that size
+        server, cab = self.open(page_size=4096, readahead=64 * 1024, cache_size=1024 * 1024)
+        cab.namelist()
+        del server.log[:]
+        self.assertEqual(cab.read("large2.bin"), self.members["large2.bin"])
+        start, end = self.folder_range("large2.bin")
+        self.assertEqual(server.fetched(), end - start)
+        self.assertTrue(len(server.log) <= (end - start) // (64 * 1024) + 2, server.log)
+        for offset, length in server.log:
+            self.assertTrue(length <= 64 * 1024 + cabinet.CB_MAX_CHUNK + 8, length)
+        cab.close()
+
+    def test_small_cache(self):
+        #many threads reading through a cache smaller than the cabinet
+        server, cab = self.open(cache_size=128 * 1024, page_size=16 * 1024)
+        names = cab.namelist()
+        self.assertEqual(cab.read_many(names, workers=4), [self.members[n] for n in names])
+        self.assertTrue(cab.testcabinet())
+        self.assertTrue(cab._getsource()._cached <= 128 * 1024)
+        cab.close()
+
+    def test_reads(self):
+        #arbitrary reads return the same bytes as the buffer
+        rnd = random.Random(5)
+        source = cabinet.RangeSource(RangeServer(self.blob), page_size=1000, cache_size=20000)
+        source.advise(50000, 200000)
+        for _ in range(500):
+            offset = rnd.randrange(len(self.blob) + 10)
+            size = rnd.choice([1, 7, 999, 1000, 1001, 5000, 30000])
+            data = bytes(source.read_at(offset, size))
+            self.assertEqual(data, self.blob[offset:offset + size])
+
+    def test_not_a_cabinet(self):
+        try:
+            cabinet.RangeSource(RangeServer(b"nope" * 20))
+        except cabinet.CabinetError as e:
+            self.assertEqual(e.args[0], cabinet.FDIERROR_NOT_A_CABINET)
+        else:
+            self.fail("not a cabinet was accepted")
+
+
+if __name__ == "__main__":
+    unittest.main()